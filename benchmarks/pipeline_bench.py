@@ -0,0 +1,251 @@
+"""
+End-to-End-Benchmark der Pipeline auf synthetischen Libraries (ohne Audio).
+
+    python3 benchmarks/pipeline_bench.py --sizes 1000,10000,50000 --out bench_results.json
+    python3 benchmarks/pipeline_bench.py --sizes 1000 --compare bench_results.json
+
+Gemessen pro Library-Größe: load_tracks (kalt/warm), generate_playlist, export_playlist,
+update_denon_db (Phase 5 inkl. Staging) sowie PlaylistManager.get_all_playlists und
+delete_multiple_playlists auf einer m.db mit Hunderten Playlisten. Zeit = Median über
+--repeat Läufe, Speicher = tracemalloc-Peak eines separaten Laufs.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+with contextlib.redirect_stdout(io.StringIO()):
+    # Import-Warnungen (fpdf/librosa fehlen) gehören nicht in die Ausgabe
+    import main_workflow_v10 as workflow
+from modules import db_access
+from modules.engine_blobs import performance_blobs
+from modules.playlist_manager import PlaylistManager
+from modules.schema_manager import ensure_library_schema
+
+CAMELOT = [f"{n}{m}" for n in range(1, 13) for m in "AB"]
+DEFAULT_SIZES = "1000,10000,50000"
+FOLDERS = 20
+PLAYLISTS_PER_FOLDER = 15
+ENTRIES_PER_PLAYLIST = 50
+DUPLICATE_RATE = 0.02
+
+
+def build_library(db_path, n_tracks, seed=0):
+    """songs-Tabelle mit n_tracks synthetischen Analysen (inkl. Blobs und Fingerabdrücken)."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    ensure_library_schema(conn)
+    # Ein realistisch großer Blob-Satz für alle Tracks; der Inhalt ist für die Messung egal
+    blobs = performance_blobs(44100, 44100 * 300, {'bpm': 126.0, 'lufs': -8.0, 'camelot_key': '8A',
+                                                   'first_downbeat': 0.3, 'mix_out_point': 280.0},
+                              bytes(rng.randrange(256) for _ in range(3072)), 12900)
+    rows = []
+    for i in range(1, n_tracks + 1):
+        bpm = rng.uniform(80, 170)
+        rec = rng.randrange(1, i) if i > 1 and rng.random() < DUPLICATE_RATE else i
+        rows.append((i, f"set/{i:06d}.mp3", f"Track {i:06d}.mp3", bpm, "Amin", rng.choice(CAMELOT),
+                     rng.uniform(0.05, 0.5), rng.randint(1, 10), rng.uniform(-14, -6), rng.uniform(150, 420),
+                     rng.uniform(120, 400), "Quantized", rng.uniform(0, 2), rng.randint(60, 220),
+                     f"{i:032x}", os.urandom(96), rec, blobs['track_data'], blobs['beat_data'],
+                     blobs['quick_cues'], blobs['overview_waveform']))
+    conn.executemany("""INSERT INTO songs (id, relative_path, filename, bpm, key_full, camelot_key, energy_avg, energy_norm,
+        lufs, duration, mix_out_point, rhythm_quality, first_downbeat, bars_count, content_hash, fingerprint, recording_id,
+        track_data, beat_data, quick_cues, overview_waveform) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", rows)
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def add_playlists(mdb_path, n_tracks, seed=0):
+    """Engine-artige Ordner/Playlist-Hierarchie mit nextListId-Ketten und Einträgen."""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(mdb_path)
+    # Echte Engine-m.db bringt diese View mit; die Trigger aus Phase 5 verweisen darauf
+    conn.execute("""CREATE VIEW IF NOT EXISTS PlaylistAllChildren AS WITH FindAllChild AS (
+        SELECT id, id AS childListId FROM Playlist
+        UNION ALL SELECT recursiveCTE.id, Plist.id FROM Playlist Plist
+        INNER JOIN FindAllChild recursiveCTE ON recursiveCTE.childListId = Plist.parentListId
+    ) SELECT * FROM FindAllChild WHERE id <> childListId""")
+    start = (conn.execute("SELECT max(id) FROM Playlist").fetchone()[0] or 0) + 1
+    pid = start
+    playlists, entities = [], []
+    folders = list(range(pid, pid + FOLDERS))
+    for f_idx, folder in enumerate(folders):
+        playlists.append((folder, f"Ordner {f_idx:02d}", 0, 0, folders[f_idx + 1] if f_idx + 1 < FOLDERS else 0))
+    pid += FOLDERS
+    for folder in folders:
+        children = list(range(pid, pid + PLAYLISTS_PER_FOLDER))
+        for c_idx, child in enumerate(children):
+            nxt = children[c_idx + 1] if c_idx + 1 < len(children) else 0
+            playlists.append((child, f"Set {child}", folder, 0, nxt))
+            tracks = rng.sample(range(1, n_tracks + 1), min(ENTRIES_PER_PLAYLIST, n_tracks))
+            entities.extend((child, tid, "bench", 0) for tid in tracks)
+        pid += PLAYLISTS_PER_FOLDER
+    # Neue Ordner hinten an die Top-Level-Kette hängen - VOR dem Insert, sonst verkettet der
+    # Insert-Trigger die bisher letzte Liste ein zweites Mal (UNIQUE parentListId/nextListId)
+    conn.execute("UPDATE Playlist SET nextListId = ? WHERE parentListId = 0 AND nextListId = 0", (start,))
+    conn.executemany("INSERT INTO Playlist (id, title, parentListId, isPersisted, nextListId, lastEditTime, isExplicitlyExported) "
+                     "VALUES (?, ?, ?, ?, ?, '2026-01-01 00:00:00', 1)", playlists)
+    conn.executemany("INSERT INTO PlaylistEntity (listId, trackId, databaseUuid, nextEntityId) VALUES (?, ?, ?, ?)", entities)
+    conn.commit()
+    conn.close()
+    return [p[0] for p in playlists if p[2] != 0]
+
+
+def _quiet(fn, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def measure(fn, repeat, memory, setup=None):
+    """Median-Laufzeit über `repeat` Läufe; optional ein weiterer Lauf unter tracemalloc."""
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        t0 = time.perf_counter()
+        _quiet(fn, state) if setup else _quiet(fn)
+        times.append(time.perf_counter() - t0)
+    result = {"sec": round(statistics.median(times), 6), "runs": len(times)}
+    if memory:
+        state = setup() if setup else None
+        tracemalloc.start()
+        try:
+            _quiet(fn, state) if setup else _quiet(fn)
+            result["peak_kb"] = round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def bench_size(n_tracks, workdir, repeat, memory, length):
+    lib = os.path.join(workdir, f"lib_{n_tracks}.db")
+    mdb = os.path.join(workdir, f"m_{n_tracks}.db")
+    out_dir = os.path.join(workdir, f"out_{n_tracks}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    t0 = time.perf_counter()
+    build_library(lib, n_tracks)
+    build_sec = time.perf_counter() - t0
+    results = {"tracks": n_tracks, "build_sec": round(build_sec, 3)}
+
+    def load_cold():
+        workflow._TRACK_CACHE.clear(); db_access.close(lib)
+        return workflow.load_tracks(lib)
+    results["load_tracks_cold"] = measure(load_cold, repeat, memory)
+    workflow.load_tracks(lib)
+    results["load_tracks_warm"] = measure(lambda: workflow.load_tracks(lib), repeat, memory)
+
+    results["generate_playlist"] = measure(lambda tracks: workflow.generate_playlist(tracks, length, 2.0, 1.0),
+                                           repeat, memory, setup=lambda: workflow.load_tracks(lib))
+    playlist = workflow.generate_playlist(workflow.load_tracks(lib), length, 2.0, 1.0)
+    results["export_playlist"] = measure(lambda: workflow.export_playlist(playlist, "BENCH", out_dir, 2.0, 1.0),
+                                         repeat, memory)
+
+    def fresh_target():
+        if os.path.exists(mdb): os.remove(mdb)
+        return mdb
+    results["update_denon_db"] = measure(lambda target: workflow.update_denon_db(lib, target, stage_dir=workdir),
+                                         repeat, memory, setup=fresh_target)
+
+    # PlaylistManager auf der zuletzt erzeugten m.db + Playlist-Hierarchie
+    fresh_target(); _quiet(workflow.update_denon_db, lib, mdb, stage_dir=workdir)
+    victims = add_playlists(mdb, n_tracks)
+    pristine = mdb + ".pristine"
+    shutil.copyfile(mdb, pristine)
+    results["playlists"] = len(victims) + FOLDERS
+    pm = PlaylistManager(mdb)
+
+    def list_cold():
+        db_access.close(mdb)
+        return pm.get_all_playlists()
+    results["get_all_playlists_cold"] = measure(list_cold, repeat, memory)
+    results["get_all_playlists_warm"] = measure(pm.get_all_playlists, repeat, memory)
+
+    def restore():
+        db_access.close(mdb)
+        shutil.copyfile(pristine, mdb)
+        return victims[::10]
+    results["delete_multiple_playlists"] = measure(pm.delete_multiple_playlists, repeat, memory, setup=restore)
+    db_access.close(mdb)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    """Zeilen 'Größe Phase alt -> neu (Faktor)' gegen eine frühere Ergebnisdatei."""
+    with open(baseline_path) as f: baseline = json.load(f)
+    old = {r["tracks"]: r for r in baseline.get("results", [])}
+    for res in current["results"]:
+        base = old.get(res["tracks"])
+        if not base: continue
+        for phase, val in res.items():
+            if not isinstance(val, dict) or phase not in base: continue
+            before, after = base[phase]["sec"], val["sec"]
+            factor = after / before if before else float("inf")
+            print(f"{res['tracks']:>6} {phase:<28} {before * 1000:10.2f} ms -> {after * 1000:10.2f} ms  ({factor:4.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline-Benchmark auf synthetischen Libraries")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Kommagetrennte Track-Anzahlen")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--length", type=int, default=20, help="Playlist-Länge für Phase 2/3")
+    parser.add_argument("--no-memory", action="store_true", help="Keinen tracemalloc-Lauf (schneller)")
+    parser.add_argument("--workdir", default=None, help="Arbeitsverzeichnis (Default: temporär, wird gelöscht)")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", default=None, help="Frühere Ergebnisdatei zum Vergleich")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="aidj_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    report = {
+        "revision": git_revision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "repeat": args.repeat,
+        "results": [],
+    }
+    try:
+        for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+            print(f"[BENCH] {size} Tracks ...", flush=True)
+            res = bench_size(size, workdir, args.repeat, not args.no_memory, args.length)
+            report["results"].append(res)
+            for phase, val in res.items():
+                if isinstance(val, dict):
+                    mem = f"  peak {val['peak_kb']:.0f} KB" if "peak_kb" in val else ""
+                    print(f"   {phase:<28} {val['sec'] * 1000:10.2f} ms{mem}", flush=True)
+    finally:
+        if not args.workdir: shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.out, "w") as f: json.dump(report, f, indent=2)
+    print(f"[BENCH] Ergebnisse: {args.out}", flush=True)
+    if args.compare: compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
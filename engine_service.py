@@ -0,0 +1,195 @@
+import argparse
+import collections
+import contextlib
+import itertools
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Einmal importieren = librosa/aubio & Library bleiben warm
+import main_workflow_v10 as workflow
+from modules.engine_client import ENGINE_HOST, ENGINE_PORT
+from modules import progress
+
+MAX_JOBS_KEPT = 20
+MAX_LINES_PER_JOB = 5000
+
+
+class Job:
+    def __init__(self, job_id, kind, argv):
+        self.id = job_id
+        self.kind = kind
+        self.argv = argv
+        self.status = "queued"
+        self.lines = []
+        self.first_line = 0          # Index der ältesten noch gehaltenen Zeile
+        self.result = None
+        self.progress = {}           # letztes Event je Typ (phase/scan/result)
+        self.returncode = None
+        self.created = time.time()
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def append(self, line):
+        event = progress.parse(line)
+        with self.lock:
+            if event: self.progress[event.get("event")] = event
+            self.lines.append(line)
+            if len(self.lines) > MAX_LINES_PER_JOB:
+                drop = len(self.lines) - MAX_LINES_PER_JOB
+                del self.lines[:drop]
+                self.first_line += drop
+
+    def snapshot(self, since=0):
+        with self.lock:
+            start = max(since - self.first_line, 0)
+            return {
+                "id": self.id, "kind": self.kind, "status": self.status,
+                "lines": self.lines[start:], "next": self.first_line + len(self.lines),
+                "result": self.result, "progress": dict(self.progress), "returncode": self.returncode,
+                "created": self.created, "finished": self.finished,
+            }
+
+
+class _JobWriter:
+    """stdout-Ersatz: sammelt ganze Zeilen in den laufenden Job (und spiegelt sie ins Service-Log)."""
+
+    def __init__(self, job, mirror):
+        self.job = job; self.mirror = mirror; self._buf = ""
+
+    def write(self, text):
+        self.mirror.write(text)
+        self._buf += text
+        while "\n" in self._buf:
+            line, self._buf = self._buf.split("\n", 1)
+            self.job.append(line + "\n")
+        return len(text)
+
+    def flush(self):
+        self.mirror.flush()
+
+    def close_line(self):
+        if self._buf: self.job.append(self._buf); self._buf = ""
+
+
+class EngineService:
+    """Hält den Motor warm und arbeitet Jobs nacheinander in EINEM Worker-Thread ab."""
+
+    def __init__(self):
+        self.jobs = collections.OrderedDict()
+        self.queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def submit(self, kind, argv):
+        if kind not in ("generate", "scan"): raise ValueError(f"Unbekannter Job-Typ: {kind}")
+        argv = [str(a) for a in argv]
+        if kind == "scan" and "--scan-only" not in argv: argv.append("--scan-only")
+        # Parser vorab prüfen, damit Fehler sofort beim Client landen
+        workflow.build_parser().parse_args(argv)
+        with self._lock:
+            job = Job(f"{int(time.time())}-{next(self._ids)}", kind, argv)
+            self.jobs[job.id] = job
+            while len(self.jobs) > MAX_JOBS_KEPT:
+                old_id, old = next(iter(self.jobs.items()))
+                if old.status in ("queued", "running"): break
+                self.jobs.pop(old_id)
+        self.queue.put(job)
+        return job
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            job.status = "running"
+            writer = _JobWriter(job, sys.__stdout__)
+            try:
+                args = workflow.build_parser().parse_args(job.argv)
+                with contextlib.redirect_stdout(writer):
+                    result = workflow.run_workflow(args)
+                job.result = result
+                job.returncode = 0 if result else 1
+                job.status = "done" if result else "error"
+            except BaseException as e:
+                writer.close_line()
+                job.append(f"❌ Engine Fehler: {e}\n")
+                for line in traceback.format_exc().splitlines(): job.append(line + "\n")
+                job.returncode = 1
+                job.status = "error"
+            finally:
+                writer.close_line()
+                job.finished = time.time()
+
+    def get(self, job_id):
+        with self._lock: return self.jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return [{"id": j.id, "kind": j.kind, "status": j.status, "created": j.created} for j in self.jobs.values()]
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            if parts == ["health"]:
+                return self._send(200, {"ok": True, "pid": os.getpid(), "queued": service.queue.qsize()})
+            if parts == ["jobs"]:
+                return self._send(200, {"jobs": service.list()})
+            if len(parts) == 2 and parts[0] == "jobs":
+                job = service.get(parts[1])
+                if not job: return self._send(404, {"error": "unbekannter Job"})
+                since = int(parse_qs(url.query).get("since", ["0"])[0])
+                return self._send(200, job.snapshot(since))
+            self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if urlparse(self.path).path.rstrip("/") != "/jobs": return self._send(404, {"error": "not found"})
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                data = json.loads(self.rfile.read(length) or b"{}")
+                job = service.submit(data.get("kind", "generate"), data.get("argv", []))
+            except SystemExit:
+                return self._send(400, {"error": "ungültige Argumente"})
+            except Exception as e:
+                return self._send(400, {"error": str(e)})
+            self._send(202, {"id": job.id})
+
+        def log_message(self, fmt, *args):
+            pass  # Polling würde sonst das Log fluten
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI-DJ Engine Service (warmer Motor hinter dem Web-UI)")
+    parser.add_argument("--host", default=ENGINE_HOST)
+    parser.add_argument("--port", type=int, default=ENGINE_PORT)
+    args = parser.parse_args()
+
+    service = EngineService()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"[ENGINE] Service läuft auf http://{args.host}:{args.port} (PID {os.getpid()})", flush=True)
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,35 @@
 import os
 import glob
 import argparse
+import contextlib
 import sys
 import sqlite3
 import re
 import subprocess
 import shutil
-import time
 import warnings
 import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
 from datetime import datetime
 from modules.smart_usb_mount import SmartUSBMount
 from modules.playlist_manager import PlaylistManager
+from modules.db_staging import StagedDatabase, LOCK_TIMEOUT, exclusive, is_locked
+from modules.schema_manager import ensure_library_schema, ensure_engine_objects
+from modules import db_access
+from modules import progress
+from modules import usb_profiler
+from modules import fingerprint
+from modules import smartlist
+from modules import tracing
+from modules.prefetch import Prefetcher
 
 # --- SETTINGS ---
 MOUNT_TARGET = "/mnt/denon"
 DENON_DB_REL_PATH = "Engine Library/Database2/m.db" 
+# Nur für Analyse/Smartlists nötig - der Player braucht sie nicht, also raus aus m.db
+LIBRARY_ONLY_TABLES = ("fingerprint_lsh", "sets", "set_history", "smartlist_tracks", "smartlist_state", "smartlist_meta")
+MAX_TRACK_MB = 40.0   # RAM-Schutz: größere Dateien werden weder gelesen noch analysiert
 
 # Warnungen unterdrücken
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -26,11 +40,12 @@ try:
     from fpdf import FPDF
     PDF_AVAILABLE = True
 except ImportError:
+    FPDF = object  # PDFReport bleibt definierbar, create_integrated_pdf springt vorher raus
     print("[SYSTEM] Warnung: 'fpdf' Modul fehlt. Kein PDF Export.", flush=True)
 
 # --- ANALYSE MODUL ---
 try:
-    from modules.analysis_engine_v3 import analyze_song
+    from modules.analysis_engine_v3 import analyze_song, buffer_decodable_exts
 except ImportError:
     print("[SYSTEM] Warnung: 'modules' Ordner fehlt.", flush=True)
 
@@ -164,90 +179,15 @@ def create_integrated_pdf(playlist, output_path, config_str, playlist_name):
 # ==========================================
 # 3. SYSTEM HELPER
 # ==========================================
-def auto_mount_usb():
-    mounter = SmartUSBMount()
+def auto_mount_usb(mount_target=MOUNT_TARGET):
+    mounter = SmartUSBMount(mount_target)
     mounter.mount() 
     
 def init_db(db_path):
-    conn = sqlite3.connect(db_path)
-    table = "songs"
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS """+table+""" (
-            id INTEGER PRIMARY KEY, relative_path TEXT NOT NULL UNIQUE, filename TEXT NOT NULL, bpm REAL, key_full TEXT, camelot_key TEXT, energy_avg REAL, energy_norm INTEGER, lufs REAL, duration REAL, mix_out_point REAL, rhythm_quality TEXT, first_downbeat REAL, bars_count INTEGER
-        )""")
-    conn.close()
-
-    conn = sqlite3.connect(db_path)
-    table = "Smartlist"
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS """+table+""" ( 
-            listUuid TEXT NOT NULL, title TEXT, parentPlaylistPath TEXT, nextPlaylistPath TEXT, nextListUuid TEXT, rules TEXT, lastEditTime DATETIME, CONSTRAINT C_NEXT_LIST_UNIQUE_FOR_PARENT UNIQUE(parentPlaylistPath,nextPlaylistPath,nextListUuid), CONSTRAINT C_NAME_UNIQUE_FOR_PARENT UNIQUE(title,parentPlaylistPath), PRIMARY KEY(listUuid)
-        )""")
-    conn.close()
-
-    conn = sqlite3.connect(db_path)
-    table = "PreparelistEntity"
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS """+table+""" (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, trackId INTEGER, trackNumber INTEGER, FOREIGN KEY(trackId) REFERENCES Track(id) ON DELETE CASCADE
-        )""")
-    conn.close()
-
-    conn = sqlite3.connect(db_path)
-    table = "PlaylistEntity"
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS """+table+""" (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, listId INTEGER, trackId INTEGER, databaseUuid TEXT, nextEntityId INTEGER, membershipReference INTEGER, FOREIGN KEY(listId) REFERENCES Playlist(id) ON DELETE CASCADE, CONSTRAINT C_NAME_UNIQUE_FOR_LIST UNIQUE(listId,databaseUuid,trackId)
-        )""")
-    conn.close()
-
-    conn = sqlite3.connect(db_path)
-    table = "Playlist"
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS """+table+""" (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, parentListId INTEGER, isPersisted BOOLEAN, nextListId INTEGER, lastEditTime DATETIME, isExplicitlyExported BOOLEAN, CONSTRAINT C_NEXT_LIST_ID_UNIQUE_FOR_PARENT UNIQUE(parentListId,nextListId), CONSTRAINT C_NAME_UNIQUE_FOR_PARENT UNIQUE(title,parentListId)
-        )""")
-    conn.close()
-
-    conn = sqlite3.connect(db_path)
-    table = "PerformanceData"
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS """+table+""" (
-            trackId INTEGER, trackData BLOB, overviewWaveFormData BLOB, beatData BLOB, quickCues BLOB, loops BLOB, thirdPartySourceId INTEGER, activeOnLoadLoops INTEGER, FOREIGN KEY(trackId) REFERENCES Track(id) ON DELETE CASCADE ON UPDATE CASCADE, PRIMARY KEY(trackId)
-        )""")
-    conn.close()
-
-    conn = sqlite3.connect(db_path)
-    table = "Track"
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS """+table+""" (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, playOrder INTEGER, length INTEGER, bpm INTEGER, year INTEGER, path TEXT, filename TEXT, bitrate INTEGER, bpmAnalyzed REAL, albumArtId INTEGER, fileBytes INTEGER, title TEXT, artist TEXT, album TEXT, genre TEXT, comment TEXT, label TEXT, composer TEXT, remixer TEXT, key INTEGER, rating INTEGER, albumArt TEXT, timeLastPlayed DATETIME, isPlayed BOOLEAN, fileType TEXT, isAnalyzed BOOLEAN, dateCreated DATETIME, dateAdded DATETIME, isAvailable BOOLEAN, isMetadataOfPackedTrackChanged BOOLEAN, isPerfomanceDataOfPackedTrackChanged BOOLEAN, playedIndicator INTEGER, isMetadataImported BOOLEAN, pdbImportKey INTEGER, streamingSource TEXT, uri TEXT, isBeatGridLocked BOOLEAN, originDatabaseUuid TEXT, originTrackId INTEGER, streamingFlags INTEGER, explicitLyrics BOOLEAN, lastEditTime DATETIME, FOREIGN KEY(albumArtId) REFERENCES AlbumArt(id) ON DELETE RESTRICT, CONSTRAINT C_path UNIQUE(path), CONSTRAINT C_originDatabaseUuid_originTrackId UNIQUE(originDatabaseUuid,originTrackId)
-        )""")
-    conn.close()
-
-    conn = sqlite3.connect(db_path)
-    table = "Pack"
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS """+table+""" (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, packId TEXT, changeLogDatabaseUuid TEXT, changeLogId INTEGER, lastPackTime DATETIME
-        )""")
-    conn.close()
-
-    conn = sqlite3.connect(db_path)
-    table = "AlbumArt"
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS """+table+""" (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, hash TEXT, albumArt BLOB
-        )""")
-    conn.close()
-
-    conn = sqlite3.connect(db_path)
-    table = "Information"
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS """+table+""" (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, uuid TEXT, schemaVersionMajor INTEGER, schemaVersionMinor INTEGER, schemaVersionPatch INTEGER, currentPlayedIndiciator INTEGER, lastRekordBoxLibraryImportReadCounter INTEGER
-        )""")
-    conn.close()
+    """Library-Schema in einer Verbindung/Transaktion anlegen; bei passender Version kein DDL."""
+    conn = db_access.connect(db_path, wal=True)
+    if ensure_library_schema(conn):
+        print(f" -> Schema aktualisiert: {db_path}", flush=True)
 
 #    new_uuid = str(uuid.uuid4())
 #    print(f"\n -> ⚠️ new_uuid: {new_uuid}", flush=True)
@@ -267,92 +207,277 @@ def init_db(db_path):
 
 
 
-def perform_scan(music_folder, db_path):
+def perform_scan(music_folder, db_path, workers=None):
     print("\n[PHASE 1] Smart-Scan...", flush=True)
+    progress.emit("phase", phase=1, name="scan")
     init_db(db_path)
     files = [p for ext in ['*.mp3','*.wav','*.flac'] for p in glob.glob(os.path.join(music_folder, '**', ext), recursive=True)]
     if not files: return 0
-    conn = sqlite3.connect(db_path)
+    conn = db_access.connect(db_path, wal=True)
     existing = set(); count_new = 0
     try:
         for r in conn.execute("SELECT relative_path FROM songs"): existing.add(r[0])
     except: pass
 
-    for i, fpath in enumerate(files):
-        rel_path = os.path.relpath(fpath, music_folder)
-        if rel_path in existing: continue
-        
-        # === NEU: RAM-SCHUTZSCHILD ===
-        try:
-            file_size_mb = os.path.getsize(fpath) / (1024 * 1024)
-            if file_size_mb > 40.0:
-                print(f" -> ⚠️ Überspringe Monster-Track (RAM-Schutz): {os.path.basename(fpath)} ({file_size_mb:.1f} MB)", flush=True)
-                continue
-        except Exception:
-            pass
-        # =============================
-
-        if count_new % 5 == 0: print(f" -> Analysiere: {os.path.basename(fpath)}", flush=True)
-        try:
-            data = analyze_song(fpath) 
-            if data:
-                en = data.get('energy_norm', 5)
-                e_avg = data.get('energy_avg', 0.5)
-                conn.execute("INSERT OR REPLACE INTO songs (relative_path, filename, bpm, key_full, camelot_key, energy_avg, energy_norm, lufs, duration, mix_out_point, rhythm_quality, first_downbeat, bars_count) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", 
-                (rel_path, os.path.basename(fpath), data['bpm'], data['key_full'], data['camelot_key'], e_avg, en, data['lufs'], data['duration'], data['mix_out_point'], data['rhythm_quality'], data['first_downbeat'], data['bars_count']))
-                conn.commit(); count_new += 1
-        except Exception: pass
-    conn.close()
+    pending = [f for f in files if os.path.relpath(f, music_folder) not in existing]
+    tracker = progress.ScanProgress(len(pending))
+    progress.emit("scan", done=0, total=len(pending), known=len(files) - len(pending))
+    if not pending: return len(files)
+
+    if workers is None:
+        # Pro Stick gemessen (modules/usb_profiler.py): Worker-Zahl + Read-Ahead
+        tuning = usb_profiler.tuned_settings(music_folder)
+        workers = tuning["workers"]
+        if usb_profiler.apply_readahead(tuning.get("device"), tuning["readahead_kb"]):
+            print(f" -> Read-Ahead: {tuning['readahead_kb']} KB", flush=True)
+    workers = max(1, min(workers, len(pending)))
+    print(f" -> Analyse mit {workers} Prozess(en)", flush=True)
+
+    copies = {}        # content_hash -> [(fpath, rel_path)] byte-gleiche Dateien, die auf die Analyse warten
+    dupes = 0
+
+    def insert(fpath, rel_path, data, chash, recording_id=None):
+        en = data.get('energy_norm', 5)
+        e_avg = data.get('energy_avg', 0.5)
+        fp = data.get('fingerprint')
+        cur = conn.execute("INSERT OR REPLACE INTO songs (relative_path, filename, bpm, key_full, camelot_key, energy_avg, energy_norm, lufs, duration, mix_out_point, rhythm_quality, first_downbeat, bars_count, content_hash, fingerprint, track_data, beat_data, quick_cues, overview_waveform) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", 
+        (rel_path, os.path.basename(fpath), data['bpm'], data['key_full'], data['camelot_key'], e_avg, en, data['lufs'], data['duration'], data['mix_out_point'], data['rhythm_quality'], data['first_downbeat'], data['bars_count'], chash, fp,
+         data.get('track_data'), data.get('beat_data'), data.get('quick_cues'), data.get('overview_waveform')))
+        song_id = cur.lastrowid
+        if recording_id is None:
+            # Nahe Duplikate (andere Bitrate, Edit) über den LSH-Index, sonst eigene Aufnahme
+            recording_id = fingerprint.find_recording(conn, fp) or song_id
+            fingerprint.index_song(conn, song_id, fp)
+        conn.execute("UPDATE songs SET recording_id = ? WHERE id = ?", (recording_id, song_id))
+        return recording_id
+
+    # Stick liest die nächsten Dateien, während analysiert wird; Verzeichnis-Reihenfolge = sequenziell auf dem Stick.
+    # Formate, die soundfile nicht aus dem RAM dekodiert (MP3 vor libsndfile 1.1), liest der Worker vom Pfad -
+    # die werden nicht vorgelesen; Hash und Analyse treffen dann den Page-Cache statt zweimal den Stick.
+    prefetcher = Prefetcher(sorted(pending), depth=workers * 2 + 2, skip_bytes=MAX_TRACK_MB * 1024 * 1024,
+                            read_exts=buffer_decodable_exts())
+
+    def admitted():
+        nonlocal dupes
+        for fpath, buf in prefetcher:
+            rel_path = os.path.relpath(fpath, music_folder)
+            # === NEU: RAM-SCHUTZSCHILD ===
+            try:
+                file_size_mb = os.path.getsize(fpath) / (1024 * 1024)
+                if file_size_mb > MAX_TRACK_MB:
+                    print(f" -> ⚠️ Überspringe Monster-Track (RAM-Schutz): {os.path.basename(fpath)} ({file_size_mb:.1f} MB)", flush=True)
+                    tracker.step(current=rel_path)
+                    continue
+            except Exception:
+                pass
+            # =============================
+            try: chash = fingerprint.content_hash(fpath, buf)
+            except OSError: chash = None
+            if chash:
+                # Byte-gleiche Kopie: Analyse der bekannten Datei übernehmen
+                cur = conn.cursor(); cur.row_factory = sqlite3.Row
+                known = cur.execute("SELECT * FROM songs WHERE content_hash = ? LIMIT 1", (chash,)).fetchone()
+                cur.close()
+                if known:
+                    insert(fpath, rel_path, dict(known), chash, known['recording_id'] or known['id'])
+                    conn.commit(); dupes += 1
+                    tracker.step(current=rel_path)
+                    continue
+                if chash in copies:
+                    copies[chash].append((fpath, rel_path))
+                    continue
+                copies[chash] = []
+            yield fpath, rel_path, chash, buf
+
+    def store(fpath, rel_path, chash, outcome):
+        nonlocal count_new, dupes
+        data, sec = outcome
+        if sec is not None:
+            tracing.observe("aidj_analysis_seconds", sec)
+            tracing.inc("aidj_tracks_analyzed_total", status="ok" if data else "failed")
+        waiting = copies.pop(chash, []) if chash else []
+        if data:
+            recording_id = insert(fpath, rel_path, data, chash)
+            for copy_path, copy_rel in waiting:
+                insert(copy_path, copy_rel, data, chash, recording_id); dupes += 1
+            conn.commit(); count_new += 1
+        tracker.step(analyzed=True, current=rel_path)
+        for _, copy_rel in waiting: tracker.step(current=copy_rel)
+
+    if workers == 1:
+        for fpath, rel_path, chash, buf in admitted():
+            if count_new % 5 == 0: print(f" -> Analysiere: {os.path.basename(fpath)}", flush=True)
+            try: outcome = tracing.timed(analyze_song, fpath, buf)
+            except Exception: outcome = (None, None)
+            store(fpath, rel_path, chash, outcome)
+    else:
+        # Decoding parallel, DB-Writes bleiben im Hauptprozess; max. 2 Jobs pro Worker in der Luft (RAM)
+        ctx = multiprocessing.get_context("forkserver")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            in_flight = {}
+            for fpath, rel_path, chash, buf in admitted():
+                if count_new % 5 == 0: print(f" -> Analysiere: {os.path.basename(fpath)}", flush=True)
+                in_flight[pool.submit(tracing.timed, analyze_song, fpath, buf)] = (fpath, rel_path, chash)
+                if len(in_flight) < workers * 2: continue
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    try: outcome = fut.result()
+                    except Exception: outcome = (None, None)
+                    store(*in_flight.pop(fut), outcome)
+            for fut in as_completed(list(in_flight)):
+                try: outcome = fut.result()
+                except Exception: outcome = (None, None)
+                store(*in_flight.pop(fut), outcome)
+    if dupes: print(f" -> {dupes} Duplikat(e) ohne Analyse übernommen", flush=True)
+    scan_span = tracing.current_span()
+    if scan_span: scan_span.set(files=len(files), analyzed=count_new, duplicates=dupes, workers=workers, prefetch=prefetcher.stats)
+    if prefetcher.stats["files"]:
+        st = prefetcher.stats
+        print(f" -> Prefetch: {st['bytes'] / 1e6:.0f} MB in {st['read_sec']:.1f}s gelesen, Analyse wartete {st['wait_sec']:.1f}s auf den Stick", flush=True)
     return len(files)
 
+def inject_denon_qnd(cur):
+    """Schreibt Tracks/Playlist in die (Staging-)Kopie von m.db. Indizes/Trigger/Views: schema_manager."""
+# --
+# -- ------------------------------------------------------------------------------------------------------
+# --
+    cur.execute("INSERT INTO Information (id,uuid,schemaVersionMajor,schemaVersionMinor,schemaVersionPatch,currentPlayedIndiciator,lastRekordBoxLibraryImportReadCounter) VALUES (1,'c27b6322-f420-43f8-9a7e-1a9477944393',3,0,1,-6499374409812624455,NULL)")
+    cur.execute("INSERT INTO AlbumArt (id,hash,albumArt) VALUES (1,NULL,NULL)")
+    # Mit Beatgrid aus der Analyse gilt der Track für den Player als analysiert (bpmAnalyzed/isAnalyzed)
+    cur.execute("INSERT INTO Track (id,playOrder,length,bpm,year ,path,filename,bitrate,bpmAnalyzed,albumArtId,fileBytes,title,artist,album,genre,comment,label,composer,remixer,key,rating,albumArt,timeLastPlayed,isPlayed,fileType,isAnalyzed,dateCreated,dateAdded,isAvailable,isMetadataOfPackedTrackChanged,isPerfomanceDataOfPackedTrackChanged,playedIndicator,isMetadataImported,pdbImportKey,streamingSource,uri,isBeatGridLocked,originDatabaseUuid,originTrackId,streamingFlags,explicitLyrics,lastEditTime) SELECT id,bars_count,printf('%.0f', duration),NULL ,2026,'../denon_tst/'||filename,filename,printf('%.0f', bpm),CASE WHEN beat_data IS NOT NULL THEN bpm END,1,NULL,filename,filename,'ALBUM',NULL,bars_count,NULL,NULL,NULL,-1,0,NULL,NULL,0,'mp3',beat_data IS NOT NULL,1772278870,1772278870,1,0,0,NULL,1,0,NULL,NULL,0,'c27b6322-f420-43f8-9a7e-1a9477944393',id,0,0,1772278870 FROM songs order by id asc")
+    # Blobs kommen fertig aus der Analyse (engine_blobs); ältere Songs ohne Blobs bleiben NULL
+    cur.execute("INSERT INTO PerformanceData (trackId,trackData,overviewWaveFormData,beatData,quickCues,loops,thirdPartySourceId,activeOnLoadLoops) SELECT id,track_data,overview_waveform,beat_data,quick_cues,NULL,NULL,NULL FROM songs order by id asc")
+    cur.execute("INSERT INTO Playlist (id,title,parentListId,isPersisted,nextListId,lastEditTime,isExplicitlyExported) VALUES (1,'test',0,1,0,'2026-03-01 13:22:45',1)")
+    cur.execute("INSERT INTO PlaylistEntity(listId,trackId,databaseUuid,nextEntityId,membershipReference) SELECT 1,id,'c27b6322-f420-43f8-9a7e-1a9477944393',id - 1,0 FROM Track order by playOrder asc")
+    cur.execute("update PlaylistEntity set nextEntityId=id -1; --INSERT INTO PlaylistEntity(id,listId,trackId,databaseUuid,nextEntityId,membershipReference)")
+
+
+# --
+# --
+# -- ------------------------------------------------------------------------------------------------------
+
+
 # ==========================================
-# MAIN WORKFLOW
+# 4. WORKFLOW PHASEN
 # ==========================================
-def main():
+def slim_denon_copy(cur):
+    """Library-Reste aus der m.db-Kopie entfernen (nach inject_denon_qnd, das die Blobs aus songs liest)."""
+    for table in LIBRARY_ONLY_TABLES:
+        cur.execute(f"DROP TABLE IF EXISTS {table}")
+    song_cols = {r[1] for r in cur.execute("PRAGMA table_info(songs)").fetchall()}
+    blobs = [c for c in SONG_BLOB_COLUMNS if c in song_cols]
+    if blobs: cur.execute("UPDATE songs SET " + ", ".join(f"{c} = NULL" for c in blobs))
+    # Unsere Smartlists ({"v":1,...}) liegen in der Engine-Tabelle - der Player kennt das Regel-Format nicht
+    own = [(uuid_,) for uuid_, raw in cur.execute("SELECT listUuid, rules FROM Smartlist").fetchall() if smartlist.is_own(raw)]
+    cur.executemany("DELETE FROM Smartlist WHERE listUuid = ?", own)
+    cur.commit()
+    # Freigewordene Seiten zurückgeben, sonst schreibt der Write-Back die alte Größe auf den Stick
+    cur.execute("VACUUM")
+
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument("music_folder") 
     parser.add_argument("--length", type=int, default=20)
     parser.add_argument("--force-analysis", action="store_true")
     parser.add_argument("--bpm-limit", type=float, default=2.0) 
     parser.add_argument("--energy-weight", type=float, default=1.0)
-    args = parser.parse_args()
-
-    print(f"\n--- AI-DJ MOTOR V15 (STABLE CORE) ---", flush=True)
-    auto_mount_usb()
-    MUSIC_FOLDER = args.music_folder 
-    
-    # 1. SCAN
-    raw_files = glob.glob(os.path.join(MUSIC_FOLDER, "**/*.mp3"), recursive=True)
+    parser.add_argument("--stage-dir", default=None, help="Lokales Staging-Verzeichnis für m.db (Default: /dev/shm bzw. /tmp)")
+    parser.add_argument("--direct-db", action="store_true", help="m.db direkt auf dem Stick bearbeiten (ohne Staging)")
+    parser.add_argument("--scan-only", action="store_true", help="Nur Phase 1 (Smart-Scan) ausführen")
+    parser.add_argument("--no-mount", action="store_true", help="Stick nicht (neu) mounten, z.B. für den Hintergrund-Scan")
+    parser.add_argument("--workers", type=int, default=0, help="Analyse-Prozesse (0 = automatisch aus dem USB-Profil)")
+    parser.add_argument("--smartlist", default=None, help="Set nur aus den Tracks dieser Smartlist bauen (siehe modules/smartlist.py)")
+    parser.add_argument("--mount-target", default=MOUNT_TARGET, help="Mount-Punkt des Sticks (Engine Library liegt dort)")
+    parser.add_argument("--output-dir", default=None, help="Ergebnis-Ordner inkl. Library-DB (Default: <Ordnername>_ergebnisse)")
+    return parser
+
+def library_paths(music_folder, output_dir=None):
+    """Ergebnis-Ordner und Library-DB für einen Musik-Ordner."""
+    project_name = os.path.basename(os.path.normpath(music_folder))
+    output_folder_web = output_dir or f"{project_name}_ergebnisse"
+    return output_folder_web, os.path.join(output_folder_web, "music_library_v3_final.db")
+
+def run_scan_phase(music_folder, force_analysis=False, workers=None, output_dir=None):
+    """Phase 1: Library anlegen/aktualisieren. Liefert (output_folder, db_path)."""
+    raw_files = glob.glob(os.path.join(music_folder, "**/*.mp3"), recursive=True)
     phys_count = len(raw_files)
     print(f"📂 Ordner Check: {phys_count} MP3s gefunden.", flush=True)
 
-    project_name = os.path.basename(os.path.normpath(MUSIC_FOLDER))
-    output_folder_web = f"{project_name}_ergebnisse"
+    output_folder_web, db_path = library_paths(music_folder, output_dir)
     if not os.path.exists(output_folder_web): os.makedirs(output_folder_web)
-    db_path = os.path.join(output_folder_web, "music_library_v3_final.db")
-
-    if args.force_analysis and os.path.exists(db_path): os.remove(db_path)
-    if not os.path.exists(db_path): perform_scan(MUSIC_FOLDER, db_path)
-    else:
-        conn = sqlite3.connect(db_path)
-        try: db_count = conn.execute("SELECT count(*) FROM songs").fetchone()[0]
-        except: db_count = 0
-        conn.close()
-        if db_count < phys_count: perform_scan(MUSIC_FOLDER, db_path)
-
-    # 2. GENERATE
-    print("\n[PHASE 2] Generiere Playlist...", flush=True)
-    conn = sqlite3.connect(db_path); conn.row_factory = sqlite3.Row
-    try: all_tracks = [dict(row) for row in conn.execute("SELECT * FROM songs WHERE bpm > 0 ORDER BY bpm ASC").fetchall()]
-    except: all_tracks = []
-    conn.close()
 
-    if not all_tracks: print("❌ FEHLER: Datenbank leer."); sys.exit(1)
-    
+    # Ein Scan pro Musik-Ordner (UI, Service, Stick-Wächter): sonst analysieren zwei Prozesse in dieselbe Library
+    if is_locked(music_folder, "scan"): print(" -> Warte auf laufenden Scan desselben Ordners...", flush=True)
+    with exclusive(music_folder, "scan"):
+        if force_analysis and os.path.exists(db_path):
+            db_access.close(db_path)
+            _TRACK_CACHE.pop(db_path, None)
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db_path + suffix): os.remove(db_path + suffix)
+        fresh = not os.path.exists(db_path)
+        # Auch ohne neue Dateien migrieren: eine Bestands-Library im alten Format braucht die neuen Tabellen/Spalten
+        init_db(db_path)
+        if fresh: perform_scan(music_folder, db_path, workers)
+        else:
+            conn = db_access.connect(db_path, wal=True)
+            try: db_count = conn.execute("SELECT count(*) FROM songs").fetchone()[0]
+            except: db_count = 0
+            if db_count < phys_count: perform_scan(music_folder, db_path, workers)
+        refresh_smartlists(db_path)
+    return output_folder_web, db_path
+
+def refresh_smartlists(db_path):
+    """Smartlists inkrementell nachziehen; ändert sich kein Energie-Dezil, bleibt der warme Track-Cache gültig."""
+    conn = db_access.connect(db_path, wal=True)
+    sig = _library_sig(db_path, conn)
+    stats = smartlist.refresh(conn)
+    if not stats["energy_changed"]: _keep_track_cache(db_path, sig)
+    if stats["full"] or stats["incremental"]:
+        print(f" -> Smartlists: {stats['full']} neu, {stats['incremental']} inkrementell ({stats['ms']:.1f} ms)", flush=True)
+    return stats
+
+# Warme Library für den Engine-Service: neu geladen nur, wenn die DB sich geändert hat
+_TRACK_CACHE = {}
+SONG_BLOB_COLUMNS = ("fingerprint", "track_data", "beat_data", "quick_cues", "overview_waveform")
+
+def _library_sig(db_path, conn):
+    try:
+        st = os.stat(db_path)
+        return (st.st_ino, conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+    except Exception:
+        return None
+
+def _keep_track_cache(db_path, sig_before):
+    """Nach Schreibzugriffen nur auf Nebentabellen (Sets, Smartlists) bleibt der warme Track-Cache gültig."""
+    cached = _TRACK_CACHE.get(db_path)
+    if cached and sig_before is not None and cached[0] == sig_before:
+        _TRACK_CACHE[db_path] = (_library_sig(db_path, db_access.connect(db_path, wal=True)), cached[1])
+
+def load_tracks(db_path):
+    conn = db_access.connect(db_path, wal=True)
+    sig = _library_sig(db_path, conn)
+    cached = _TRACK_CACHE.get(db_path)
+    if not (cached and sig is not None and cached[0] == sig):
+        cur = conn.cursor(); cur.row_factory = sqlite3.Row
+        # Blobs (Fingerabdruck, PerformanceData) braucht die Generierung nicht - nicht im warmen Cache halten
+        cols = ", ".join(c for c in db_access.table_columns(db_path, "songs") if c not in SONG_BLOB_COLUMNS) or "*"
+        try: rows = [dict(row) for row in cur.execute(f"SELECT {cols} FROM songs WHERE bpm > 0 ORDER BY bpm ASC").fetchall()]
+        except: rows = []
+        cur.close()
+        cached = (sig, rows)
+        _TRACK_CACHE[db_path] = cached
+    # Kopien, weil die Generierung die Liste leert und Felder ergänzt
+    return [dict(t) for t in cached[1]]
+
+def generate_playlist(all_tracks, length, bpm_limit, energy_weight):
+    """Phase 2: Greedy-Kette über BPM-Fenster und Energie-Abstand."""
     playlist = [all_tracks.pop(0)] 
-    while len(playlist) < args.length and all_tracks:
+    # Keine zweite Kopie derselben Aufnahme (recording_id aus dem Fingerabdruck-Index)
+    first = fingerprint.recording_key(playlist[0])
+    all_tracks[:] = [t for t in all_tracks if fingerprint.recording_key(t) != first]
+    while len(playlist) < length and all_tracks:
         last = playlist[-1]
-        limit_bpm = last['bpm'] + args.bpm_limit
+        limit_bpm = last['bpm'] + bpm_limit
         candidates = []
         candidates_idx = []
         for i, t in enumerate(all_tracks):
@@ -367,25 +492,25 @@ def main():
                 e_last = last.get('energy_avg', 0.5) or 0.5
                 e_cand = cand.get('energy_avg', 0.5) or 0.5
                 nrg_diff = abs(e_cand - e_last) * 10 
-                score = bpm_diff + (nrg_diff * args.energy_weight)
+                score = bpm_diff + (nrg_diff * energy_weight)
                 if score < best_score: best_score = score; selected = cand; selected_idx = candidates_idx[i]
         
         if not selected: selected = all_tracks[0]; selected_idx = 0
         playlist.append(selected)
         all_tracks.pop(selected_idx)
+        rec = fingerprint.recording_key(selected)
+        all_tracks[:] = [t for t in all_tracks if fingerprint.recording_key(t) != rec]
 
-    playlist = recalibrate_playlist_energy(playlist)
-    playlist_name = f"AI-Set-{datetime.now().strftime('%d-%H%M')}"
-    print(f"\n✅ GENERATED NAME: {playlist_name}", flush=True)
+    return recalibrate_playlist_energy(playlist)
 
-    # 3. EXPORT
-    print(f"\n[PHASE 3] Exportiere Files ({len(playlist)} Tracks)...", flush=True)
+def export_playlist(playlist, playlist_name, output_folder_web, bpm_limit, energy_weight):
+    """Phase 3: TXT + PDF in den Ergebnis-Ordner. Liefert (txt, pdf)."""
     txt_file_web = os.path.join(output_folder_web, f"ki_set_{len(playlist)}.txt")
     pdf_file_web = txt_file_web.replace(".txt", ".pdf")
     
     with open(txt_file_web, 'w', encoding='utf-8') as f:
         f.write(f"PLAYLIST: {playlist_name}\n") 
-        f.write(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M')} | Config: R={args.bpm_limit} E={args.energy_weight}\n")
+        f.write(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M')} | Config: R={bpm_limit} E={energy_weight}\n")
         f.write("-" * 125 + "\n")
         f.write(f"{'Nr':<3} | {'Title':<45} | {'BPM':<6} | {'Key':<4} | {'NRG':<4} | {'Intro':<12} | {'Mix-Out':<8}\n")
         f.write("-" * 125 + "\n")
@@ -400,253 +525,156 @@ def main():
             cue_in_txt = f"{fmt_time(cue_in)} ({intro_beats})"
             f.write(f"{i+1:<3} | {dname:<45} | {t['bpm']:<6.1f} | {key:<4} | {nrg:<4} | {cue_in_txt:<12} | {fmt_time(cue_out):<8}\n")
 
-    create_integrated_pdf(playlist, pdf_file_web, f"R={args.bpm_limit}, E={args.energy_weight}", playlist_name)
+    create_integrated_pdf(playlist, pdf_file_web, f"R={bpm_limit}, E={energy_weight}", playlist_name)
+    return txt_file_web, pdf_file_web
+
+def update_denon_db(db_path, denon_db_path, stage_dir=None, direct=False):
+    """Phase 5 (qnd): Library-Kopie als m.db injizieren, lokal gestaged und atomar zurückgeschrieben."""
+    print(f"\n -> ⚠️ db_path: {db_path}\n -> ⚠️ denon_db_path: {denon_db_path}", flush=True)
+    # Library läuft im WAL-Modus -> vor der Dateikopie alles in die Hauptdatei falten
+    db_access.checkpoint(db_path)
+    stage = None
+    work_db_path = None
+    writer = contextlib.ExitStack()
+    try:
+        if direct:
+            # Auch direkt nur mit dem Schreiber-Lock: m.db ändert sich nie, solange gelesen werden kann
+            writer.enter_context(exclusive(denon_db_path, "write", timeout=LOCK_TIMEOUT))
+            shutil.copyfile(db_path, denon_db_path)
+            work_db_path = denon_db_path
+        else:
+            # Alles lokal anwenden, danach EIN sequenzieller Write-Back auf den Stick
+            stage = StagedDatabase(denon_db_path, source_path=db_path, staging_dir=stage_dir)
+            work_db_path = stage.open()
+            print(f" -> Staging: {work_db_path}", flush=True)
+
+        print(f"\n[PHASE 5] Denon DB Update (qnd)...", flush=True)
+        progress.emit("phase", phase=5, name="denon_db")
+
+
+        new_uuid = str(uuid.uuid4())
+        print(f"\n -> ⚠️ new_uuid: {new_uuid}", flush=True)
+        #cur.execute("INSERT INTO Information (uuid) VALUES ('ed9f2c05-2056-4381-a38e-7c129a3cce08')")
+        #cur.execute("INSERT INTO Information VALUES (1, ?, 3, 0, 1, -6499374409812624455, NULL)", ("'"+new_uuid+"'"))
+
+
+        #cur = sqlite3.connect(db_path)
+        cur = db_access.connect(work_db_path)
+        # Kopie der WAL-Library: der Player erwartet ein klassisches Rollback-Journal
+        cur.execute("PRAGMA journal_mode=DELETE")
+        #cur.execute("INSERT INTO Information (uuid) VALUES ('ed9f2c05-2056-4381-a38e-7c129a3cce08')")
+        #cur.execute("INSERT INTO Information (uuid) VALUES (?)", ("'"+new_uuid+"'"))
+        #cur.close()
+        with tracing.span("db.inject"):
+            inject_denon_qnd(cur)
+            cur.commit()
+        # Erst nach der Injection, sonst feuern die Track-Trigger bei den Bulk-Inserts.
+        # Die Kopie kommt frisch aus der Library (Engine-Version 0) -> hier läuft immer 0->1.
+        with tracing.span("db.engine_objects"):
+            ensure_engine_objects(cur)
+        with tracing.span("db.slim"):
+            slim_denon_copy(cur)
+        db_access.close(work_db_path)
+        if stage:
+            with tracing.span("db.write_back") as sp:
+                stage.write_back()
+                sp.set(**stage.timings)
+            tracing.inc("aidj_stick_bytes_written_total", stage.timings.get("bytes", 0))
+            print(f" -> {stage.report()}", flush=True)
+    except db_access.DatabaseLockedError as e:
+        print(f"❌ DB Fehler: {e}", flush=True)
+        raise
+    finally:
+        # Auch nach einem Fehler keine gecachte Verbindung auf dem Stick offen lassen
+        if work_db_path: db_access.close_under(os.path.dirname(work_db_path))
+        if stage: stage.cleanup()
+        writer.close()
+
+def run_workflow(args):
+    """Alle 5 Phasen. Liefert dict mit Ergebnis-Pfaden oder None bei Fehler."""
+    # Ein Trace pro Lauf (traces.jsonl), Zähler/Histogramme nach metrics.prom
+    with tracing.span("run", folder=args.music_folder, scan_only=args.scan_only) as run_span:
+        status = "error"
+        try:
+            result = _run_phases(args)
+            status = "ok" if result else "error"
+            run_span.set(ok=bool(result))
+            return result
+        finally:
+            tracing.inc("aidj_runs_total", status=status)
+            tracing.flush_metrics()
+
+def _run_phases(args):
+    print(f"\n--- AI-DJ MOTOR V15 (STABLE CORE) ---", flush=True)
+    if not args.no_mount:
+        with tracing.phase("mount"): auto_mount_usb(args.mount_target)
+    MUSIC_FOLDER = args.music_folder 
+    
+    # 1. SCAN
+    with tracing.phase("scan"):
+        output_folder_web, db_path = run_scan_phase(MUSIC_FOLDER, args.force_analysis, args.workers or None, args.output_dir)
+    if args.scan_only:
+        print(f"\n✅ SCAN FERTIG! DB: {db_path}", flush=True)
+        progress.emit("result", db_path=db_path, trace_id=tracing.current_trace_id())
+        return {"db_path": db_path}
+
+    # 2. GENERATE
+    print("\n[PHASE 2] Generiere Playlist...", flush=True)
+    progress.emit("phase", phase=2, name="generate")
+    with tracing.phase("generate") as sp:
+        all_tracks = load_tracks(db_path)
+        if args.smartlist:
+            allowed = smartlist.song_ids(db_access.connect(db_path, wal=True), args.smartlist)
+            all_tracks = [t for t in all_tracks if t['id'] in allowed]
+            print(f" -> Smartlist '{args.smartlist}': {len(all_tracks)} Tracks", flush=True)
+        sp.set(library=len(all_tracks))
+
+        if not all_tracks: print("❌ FEHLER: Datenbank leer."); return None
+    
+        playlist = generate_playlist(all_tracks, args.length, args.bpm_limit, args.energy_weight)
+    playlist_name = f"AI-Set-{datetime.now().strftime('%d-%H%M')}"
+    print(f"\n✅ GENERATED NAME: {playlist_name}", flush=True)
+    # Für Smartlist-Regeln "not played in last N sets"
+    conn = db_access.connect(db_path, wal=True)
+    sig = _library_sig(db_path, conn)
+    smartlist.record_set(conn, playlist_name, playlist)
+    _keep_track_cache(db_path, sig)
+
+    # 3. EXPORT
+    print(f"\n[PHASE 3] Exportiere Files ({len(playlist)} Tracks)...", flush=True)
+    progress.emit("phase", phase=3, name="export", tracks=len(playlist))
+    with tracing.phase("export", tracks=len(playlist)):
+        txt_file_web, pdf_file_web = export_playlist(playlist, playlist_name, output_folder_web, args.bpm_limit, args.energy_weight)
     
     # 4. DEPLOY
     print(f"\n[PHASE 4] Stick Deployment...", flush=True)
+    progress.emit("phase", phase=4, name="deploy")
     dest_txt = os.path.join(MUSIC_FOLDER, f"{playlist_name}.txt")
-    try: shutil.copyfile(txt_file_web, dest_txt)
-    except: subprocess.run(["sudo", "cp", txt_file_web, dest_txt], check=False)
+    with tracing.phase("deploy"):
+        try: shutil.copyfile(txt_file_web, dest_txt)
+        except:
+            with tracing.span("subprocess", cmd="sudo cp"):
+                subprocess.run(["sudo", "cp", txt_file_web, dest_txt], check=False)
+        if os.path.exists(dest_txt): tracing.inc("aidj_stick_bytes_written_total", os.path.getsize(dest_txt))
         
     # ==========================================
     # 5. DB UPDATE (THE HOLY GRAIL - V15)
     # ==========================================
-    denon_db_path = os.path.join(MOUNT_TARGET, DENON_DB_REL_PATH)
-    print(f"\n -> ⚠️ db_path: {db_path}\n -> ⚠️ denon_db_path: {denon_db_path}", flush=True)
-    shutil.copyfile(db_path, denon_db_path)
-
-    print(f"\n[PHASE 5] Denon DB Update (qnd)...", flush=True)
-
-
-    new_uuid = str(uuid.uuid4())
-    print(f"\n -> ⚠️ new_uuid: {new_uuid}", flush=True)
-    #cur.execute("INSERT INTO Information (uuid) VALUES ('ed9f2c05-2056-4381-a38e-7c129a3cce08')")
-    #cur.execute("INSERT INTO Information VALUES (1, ?, 3, 0, 1, -6499374409812624455, NULL)", ("'"+new_uuid+"'"))
-
-
-    #cur = sqlite3.connect(db_path)
-    cur = sqlite3.connect(denon_db_path)
-    #cur.execute("INSERT INTO Information (uuid) VALUES ('ed9f2c05-2056-4381-a38e-7c129a3cce08')")
-    #cur.execute("INSERT INTO Information (uuid) VALUES (?)", ("'"+new_uuid+"'"))
-    #cur.close()
-# --
-# -- ------------------------------------------------------------------------------------------------------
-# --
-    cur.execute("INSERT INTO Information (id,uuid,schemaVersionMajor,schemaVersionMinor,schemaVersionPatch,currentPlayedIndiciator,lastRekordBoxLibraryImportReadCounter) VALUES (1,'c27b6322-f420-43f8-9a7e-1a9477944393',3,0,1,-6499374409812624455,NULL)")
-    cur.execute("INSERT INTO AlbumArt (id,hash,albumArt) VALUES (1,NULL,NULL)")
-    cur.execute("INSERT INTO Track (id,playOrder,length,bpm,year ,path,filename,bitrate,bpmAnalyzed,albumArtId,fileBytes,title,artist,album,genre,comment,label,composer,remixer,key,rating,albumArt,timeLastPlayed,isPlayed,fileType,isAnalyzed,dateCreated,dateAdded,isAvailable,isMetadataOfPackedTrackChanged,isPerfomanceDataOfPackedTrackChanged,playedIndicator,isMetadataImported,pdbImportKey,streamingSource,uri,isBeatGridLocked,originDatabaseUuid,originTrackId,streamingFlags,explicitLyrics,lastEditTime) SELECT id,bars_count,printf('%.0f', duration),NULL ,2026,'../denon_tst/'||filename,filename,printf('%.0f', bpm),NULL,1,NULL,filename,filename,'ALBUM',NULL,bars_count,NULL,NULL,NULL,-1,0,NULL,NULL,0,'mp3',0,1772278870,1772278870,1,0,0,NULL,1,0,NULL,NULL,0,'c27b6322-f420-43f8-9a7e-1a9477944393',id,0,0,1772278870 FROM songs order by id asc")
-    cur.execute("INSERT INTO PerformanceData (trackId,trackData,overviewWaveFormData,beatData,quickCues,loops,thirdPartySourceId,activeOnLoadLoops) SELECT id,NULL,NULL,NULL,NULL,NULL,NULL,NULL FROM songs order by id asc")
-    cur.execute("INSERT INTO Playlist (id,title,parentListId,isPersisted,nextListId,lastEditTime,isExplicitlyExported) VALUES (1,'test',0,1,0,'2026-03-01 13:22:45',1)")
-    cur.execute("INSERT INTO PlaylistEntity(listId,trackId,databaseUuid,nextEntityId,membershipReference) SELECT 1,id,'c27b6322-f420-43f8-9a7e-1a9477944393',id - 1,0 FROM Track order by playOrder asc")
-    cur.execute("update PlaylistEntity set nextEntityId=id -1; --INSERT INTO PlaylistEntity(id,listId,trackId,databaseUuid,nextEntityId,membershipReference)")
-
-    cur.execute("DROP INDEX IF EXISTS index_PreparelistEntity_trackId")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_PreparelistEntity_trackId ON PreparelistEntity ( trackId)")
-    cur.execute("DROP INDEX IF EXISTS index_PlaylistEntity_nextEntityId_listId")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_PlaylistEntity_nextEntityId_listId ON PlaylistEntity ( nextEntityId, listId)")
-    cur.execute("DROP INDEX IF EXISTS index_Track_bpmAnalyzed")
-    cur.execute("CREATE INDEX index_Track_bpmAnalyzed ON Track(CAST(bpmAnalyzed + 0.5 AS int))")
-    cur.execute("DROP INDEX IF EXISTS index_Track_key")
-    #cur.execute("CREATE INDEX IF NOT EXISTS index_Track_key ON Track ( KEYWORDASCOLUMNNAME)")
-    cur.execute("DROP INDEX IF EXISTS index_Track_album")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_Track_album ON Track ( album)")
-    cur.execute("DROP INDEX IF EXISTS index_Track_artist")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_Track_artist ON Track ( artist)")
-    cur.execute("DROP INDEX IF EXISTS index_Track_genre")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_Track_genre ON Track ( genre)")
-    cur.execute("DROP INDEX IF EXISTS index_Track_dateAdded")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_Track_dateAdded ON Track ( dateAdded)")
-    cur.execute("DROP INDEX IF EXISTS index_Track_year")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_Track_year ON Track ( year)")
-    cur.execute("DROP INDEX IF EXISTS index_Track_rating")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_Track_rating ON Track ( rating)")
-    cur.execute("DROP INDEX IF EXISTS index_Track_length")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_Track_length ON Track ( length)")
-    cur.execute("DROP INDEX IF EXISTS index_Track_title")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_Track_title ON Track ( title)")
-    cur.execute("DROP INDEX IF EXISTS index_Track_uri")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_Track_uri ON Track ( uri)")
-    cur.execute("DROP INDEX IF EXISTS index_Track_albumArtId")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_Track_albumArtId ON Track ( albumArtId)")
-    cur.execute("DROP INDEX IF EXISTS index_Track_filename")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_Track_filename ON Track ( filename)")
-    cur.execute("DROP INDEX IF EXISTS index_AlbumArt_hash")
-    cur.execute("CREATE INDEX IF NOT EXISTS index_AlbumArt_hash ON AlbumArt ( hash)")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_before_delete_PlaylistEntity")
-    cur.execute("CREATE TRIGGER trigger_before_delete_PlaylistEntity BEFORE DELETE ON PlaylistEntity WHEN OLD.trackId > 0 BEGIN  UPDATE PlaylistEntity SET   nextEntityId = OLD.nextEntityId  WHERE nextEntityId = OLD.id  AND listId = OLD.listId; END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_after_insert_isPersist")
-    cur.execute("CREATE TRIGGER trigger_after_insert_isPersist AFTER INSERT ON Playlist  WHEN new.isPersisted = 1 BEGIN  UPDATE Playlist SET   isPersisted = 1  WHERE id IN (SELECT parentListId FROM PlaylistAllParent WHERE id=new.id); END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_after_update_isPersistChild")
-    cur.execute("CREATE TRIGGER trigger_after_update_isPersistChild AFTER UPDATE ON Playlist  WHEN old.isPersisted = 1  AND new.isPersisted = 0 BEGIN  UPDATE Playlist SET   isPersisted = 0  WHERE id IN (SELECT childListId FROM PlaylistAllChildren WHERE id=new.id); END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_after_update_isPersistParent")
-    cur.execute("CREATE TRIGGER trigger_after_update_isPersistParent AFTER UPDATE ON Playlist  WHEN (old.isPersisted = 0  AND new.isPersisted = 1)  OR (old.parentListId != new.parentListId  AND new.isPersisted = 1) BEGIN  UPDATE Playlist SET   isPersisted = 1  WHERE id IN (SELECT parentListId FROM PlaylistAllParent WHERE id=new.id); END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_after_delete_List")
-    cur.execute("CREATE TRIGGER trigger_after_delete_List AFTER DELETE ON Playlist FOR EACH ROW BEGIN  UPDATE Playlist SET   nextListId = OLD.nextListId  WHERE nextListId = OLD.id;  DELETE FROM Playlist  WHERE parentListId = OLD.id; END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_after_insert_List")
-    cur.execute("CREATE TRIGGER trigger_after_insert_List AFTER INSERT ON Playlist FOR EACH ROW BEGIN  UPDATE Playlist SET   nextListId = NEW.id  WHERE nextListId = -(1 + NEW.nextListId)  AND parentListId = NEW.parentListId; END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_before_insert_List")
-    cur.execute("CREATE TRIGGER trigger_before_insert_List BEFORE INSERT ON Playlist FOR EACH ROW BEGIN  UPDATE Playlist SET   nextListId = -(1 + nextListId)  WHERE nextListId = NEW.nextListId  AND parentListId = NEW.parentListId; END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_PerformanceData_after_update_Track_timestamp")
-    cur.execute("CREATE TRIGGER trigger_PerformanceData_after_update_Track_timestamp  AFTER UPDATE OF trackData, isAnalyzed, overviewWaveFormData, beatData, quickCues, loops, activeOnLoadLoops  ON PerformanceData  FOR EACH ROW BEGIN  UPDATE Track  SET lastEditTime = strftime('%s')  WHERE id = NEW.trackId; END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_after_insert_Track_insert_performance_data")
-    cur.execute("CREATE TRIGGER trigger_after_insert_Track_insert_performance_data AFTER INSERT ON Track BEGIN  INSERT INTO PerformanceData(trackId) VALUES(NEW.id); END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_after_update_only_Track_timestamp")
-    cur.execute("CREATE TRIGGER trigger_after_update_only_Track_timestamp  AFTER UPDATE OF length, bpm, year, filename, bitrate, bpmAnalyzed, albumArtId,  title, artist, album, genre, comment, label, composer, remixer, key, rating, albumArt,  fileType, isAnalyzed, isBeatgridLocked, explicitLyrics  ON Track  FOR EACH ROW BEGIN  UPDATE Track SET lastEditTime = strftime('%s') WHERE ROWID=NEW.ROWID; END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_after_update_Track_fix_origin")
-    cur.execute("CREATE TRIGGER trigger_after_update_Track_fix_origin AFTER UPDATE ON Track  WHEN IFNULL(NEW.originTrackId, 0) = 0  OR IFNULL(NEW.originDatabaseUuid, '') = '' BEGIN  UPDATE Track SET   originTrackId = NEW.id,   originDatabaseUuid = (SELECT uuid FROM Information)  WHERE track.id = NEW.id; END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_after_insert_Track_fix_origin")
-    cur.execute("CREATE TRIGGER trigger_after_insert_Track_fix_origin AFTER INSERT ON Track  WHEN IFNULL(NEW.originTrackId, 0) = 0  OR IFNULL(NEW.originDatabaseUuid, '') = '' BEGIN  UPDATE Track SET   originTrackId = NEW.id,   originDatabaseUuid = (SELECT uuid FROM Information)  WHERE track.id = NEW.id; END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_after_update_Track_check_Id")
-    cur.execute("CREATE TRIGGER trigger_after_update_Track_check_Id BEFORE UPDATE ON Track  WHEN NEW.id <> OLD.id BEGIN  SELECT RAISE(ABORT, 'Changing track id''s are not allowed'); END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_after_insert_Track_check_id")
-    cur.execute("CREATE TRIGGER trigger_after_insert_Track_check_id AFTER INSERT ON Track  WHEN NEW.id <= (SELECT seq FROM sqlite_sequence WHERE name = 'Track') BEGIN  SELECT RAISE(ABORT, 'Recycling deleted track id''s are not allowed'); END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_after_insert_Pack_changeLogId")
-    cur.execute("CREATE TRIGGER trigger_after_insert_Pack_changeLogId AFTER INSERT ON Pack FOR EACH ROW WHEN NEW.changeLogId = 0 BEGIN  UPDATE Pack SET changeLogId = 1 WHERE ROWID = NEW.ROWID; END")
-    cur.execute("DROP TRIGGER IF EXISTS trigger_after_insert_Pack_timestamp")
-    cur.execute("CREATE TRIGGER trigger_after_insert_Pack_timestamp AFTER INSERT ON Pack FOR EACH ROW WHEN NEW.lastPackTime IS NULL BEGIN  UPDATE Pack SET lastPackTime = strftime('%s') WHERE ROWID = NEW.ROWID; END")
-    cur.execute("DROP VIEW IF EXISTS PlaylistPath")
-#    cur.execute("CREATE VIEW PlaylistPath AS WITH RECURSIVE Heirarchy AS (  SELECT id AS child, parentListId AS parent, title AS name, 1 AS depth FROM Playlist  UNION ALL  SELECT child, parentListId AS parent, title AS name, h.depth + 1 AS depth FROM Playlist c  JOIN Heirarchy h ON h.parent = c.id  ORDER BY depth DESC ), OrderedList AS (  SELECT id , nextListId, 1 AS position  FROM Playlist  WHERE nextListId = 0  UNION ALL  SELECT c.id , c.nextListId , l.position + 1  FROM Playlist c  INNER JOIN OrderedList l  ON c.nextListId = l.id ), NameConcat AS (  SELECT   child AS id,   GROUP_CONCAT(name ,';') || ';' AS path  FROM  (   SELECT child, name   FROM Heirarchy   ORDER BY depth DESC  )  GROUP BY child ) SELECT  id,  path,  ROW_NUMBER() OVER  (   ORDER BY   (SELECT COUNT(*) FROM (SELECT * FROM Heirarchy WHERE child = id) ) DESC,   (SELECT position FROM OrderedList ol WHERE ol.id = c.id) ASC  ) AS position FROM Playlist c LEFT JOIN NameConcat g USING (id);DROP VIEW IF EXISTS PlaylistAllChildren;CREATE VIEW PlaylistAllChildren AS WITH FindAllChild AS ( SELECT id, id as childListId FROM Playlist UNION ALL SELECT recursiveCTE.id, Plist.id FROM Playlist Plist INNER JOIN FindAllChild recursiveCTE ON recursiveCTE.childListId = Plist.parentListId )")
-    #SELECT * FROM FindAllChild WHERE id <> childListId")
-    cur.execute("DROP VIEW IF EXISTS PlaylistAllParent")
-    cur.execute("CREATE VIEW PlaylistAllParent AS WITH FindAllParent AS (  SELECT id, parentListId FROM Playlist  UNION ALL  SELECT recursiveCTE.id, Plist.parentListId FROM Playlist Plist  INNER JOIN FindAllParent recursiveCTE  ON recursiveCTE.parentListId = Plist.id ) SELECT * FROM FindAllParent")
-    cur.execute("DROP VIEW IF EXISTS ChangeLog")
-    cur.execute("CREATE VIEW ChangeLog (id, trackId) AS SELECT 0, 0 WHERE FALSE")
-
-# --
-# --
-# -- ------------------------------------------------------------------------------------------------------
-    cur.commit()
-    cur.close()
-
-
-    denon_db_path = "do_nothing_from_here"
-    if os.path.exists(denon_db_path):
-        print(f"\n[PHASE 5] Denon DB Update (STRICT BOUNCER)...", flush=True)
-        if not os.access(denon_db_path, os.W_OK):
-             subprocess.run(["sudo", "chmod", "666", denon_db_path], check=False)
-
-        try:
-            dconn = sqlite3.connect(denon_db_path)
-            cur = dconn.cursor()
-            
-            # --- 1. MASTER UUID ABRUFEN ---
-
-
-            new_uuid = str(uuid.uuid4())
-            print(f"\n -> ⚠️ new_uuid: {new_uuid}", flush=True)
-            cur.execute("INSERT INTO Information (uuid) VALUES ('ed9f2c05-2056-4381-a38e-7c129a3cce08')")
-            #cur.execute("INSERT INTO Information VALUES (1, ?, 3, 0, 1, -6499374409812624455, NULL)", ("'"+new_uuid+"'"))
-
-
-            cur.execute("SELECT uuid FROM Information LIMIT 1;")
-            res = cur.fetchone()
-            if not res:
-                print("❌ KRITISCHER FEHLER: Keine UUID in der Datenbank gefunden!", flush=True)
-                raise ValueError("Missing UUID")
-            
-            target_uuid = res[0]
-            print(f" -> Master-UUID erfolgreich geladen: {target_uuid}", flush=True)
-            
-            now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-            # --- 2. NEUE PLAYLIST ERSTELLEN ---
-            cur.execute("""
-                INSERT INTO Playlist (title, parentListId, isPersisted, isExplicitlyExported, nextListId, lastEditTime) 
-                VALUES (?, 0, 1, 1, NULL, ?)
-            """, (playlist_name, now_str))
-            new_pid = cur.lastrowid
-            print(f" -> Neue Playlist angelegt: ID {new_pid} ({playlist_name})", flush=True)
-
-            # --- 3. PLAYLIST KETTE SCHLIESSEN (THE ZIPPER) ---
-            cur.execute("SELECT id FROM Playlist WHERE parentListId = 0 ORDER BY id ASC")
-            all_root = [r[0] for r in cur.fetchall()]
-            
-            for pid in all_root:
-                cur.execute("UPDATE Playlist SET nextListId = NULL WHERE id = ?", (pid,))
-                
-            for i in range(len(all_root)):
-                current_id = all_root[i]
-                next_target = all_root[i+1] if i < len(all_root) - 1 else 0
-                cur.execute("UPDATE Playlist SET nextListId = ? WHERE id = ?", (next_target, current_id))
-                
-            print(" -> Playlist-Kette finalisiert.", flush=True)
-
-            # --- 4. TRACKS SUCHEN, VERIFIZIEREN & PFADE HEILEN (AUTO-HEALER) ---
-            valid_track_ids = []
-            for t in playlist:
-                filename = t['filename']
-                name_no_ext = filename.rsplit('.', 1)[0]
-                
-                cur.execute("SELECT id FROM Track WHERE filename = ?", (filename,))
-                res = cur.fetchone()
-                
-                if not res:
-                    cur.execute("SELECT id FROM Track WHERE filename = ?", (name_no_ext,))
-                    res = cur.fetchone()
-                    
-                if not res:
-                    cur.execute("SELECT id FROM Track WHERE path LIKE ?", (f"%{filename}%",))
-                    res = cur.fetchone()
-                
-                if res:
-                    track_id = res[0]
-                    valid_track_ids.append(track_id)
-                    
-                    # === THE AUTO-HEALER: Pfad in der Matrix erzwingen ===
-                    # 1. Absoluter Pfad der Datei auf dem Raspi (z.B. /mnt/denon/DJ-Set/Track.mp3)
-                    abs_path = os.path.join(MUSIC_FOLDER, t['relative_path'])
-                    # 2. Relativer Pfad vom USB-Root aus (z.B. DJ-Set/Track.mp3)
-                    rel_to_root = os.path.relpath(abs_path, MOUNT_TARGET)
-                    # 3. Denon-Format generieren (Linux-Slashes + '../' davor)
-                    denon_path = "../" + rel_to_root.replace("\\", "/")
-                    
-                    # Matrix mit der Realität überschreiben!
-                    cur.execute("UPDATE OR IGNORE Track SET path = ? WHERE id = ?", (denon_path, track_id))
-                    #cur.execute("UPDATE Track SET path = ? WHERE id = ?", (denon_path, track_id))
-                    
-                else:
-                    print(f" -> ⚠️ Übersprungen (Nicht in Denon DB gefunden): {filename}", flush=True)            
-
-            # --- 5. TRACKS ALS PERLENKETTE EINFÜGEN ---
-            cur.execute("PRAGMA table_info(PlaylistEntity)")
-            cols = [r[1] for r in cur.fetchall()]
-            is_legacy = 'trackOrder' not in cols
-            list_col = 'playlistId' if 'playlistId' in cols else 'listId'
-            
-            linked = 0
-            if not is_legacy:
-                # Modern Engine OS (nutzt trackOrder statt nextEntityId)
-                for i, tid in enumerate(valid_track_ids):
-                    cur.execute(f"INSERT INTO PlaylistEntity ({list_col}, trackId, trackOrder, databaseUuid) VALUES (?, ?, ?, ?)", 
-                                (new_pid, tid, i + 1, target_uuid))
-                    linked += 1
-            else:
-                # Legacy Engine OS - Die magische Rückwärts-Schleife!
-                next_entity_id = 0
-                for tid in reversed(valid_track_ids):
-                    cur.execute(f"""
-                        INSERT INTO PlaylistEntity ({list_col}, trackId, databaseUuid, nextEntityId) 
-                        VALUES (?, ?, ?, ?)
-                    """, (new_pid, tid, target_uuid, next_entity_id))
-                    
-                    # Die ID des gerade eingefügten Tracks für den nächsten Durchlauf merken
-                    next_entity_id = cur.lastrowid 
-                    linked += 1
-
-            dconn.commit()
-
-            print(" -> Checkpoint & Sync...", flush=True)
-            dconn.execute("PRAGMA wal_checkpoint(FULL)")
-            dconn.close()
-            subprocess.run("sync", shell=True)
-            time.sleep(2.0)
-            
-            print(f"✅ VERIFIKATION: {linked} Tracks erfolgreich als Kette geschmiedet!", flush=True)
-            
-        except Exception as e:
-            print(f"❌ DB Fehler: {e}", flush=True)
+    denon_db_path = os.path.join(args.mount_target, DENON_DB_REL_PATH)
+    with tracing.phase("denon_db", staged=not args.direct_db):
+        update_denon_db(db_path, denon_db_path, args.stage_dir, args.direct_db)
 
     print(f"\n✅ FERTIG! Datei: {txt_file_web}", flush=True)
+    progress.emit("result", txt=txt_file_web, pdf=pdf_file_web if os.path.exists(pdf_file_web) else None,
+                  playlist_name=playlist_name, db_path=db_path, trace_id=tracing.current_trace_id())
+    return {"db_path": db_path, "txt": txt_file_web, "pdf": pdf_file_web, "playlist_name": playlist_name}
+
+# ==========================================
+# MAIN WORKFLOW
+# ==========================================
+def main():
+    args = build_parser().parse_args()
+    if not run_workflow(args): sys.exit(1)
 
 if __name__ == "__main__":
     main()
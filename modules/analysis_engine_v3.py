@@ -2,11 +2,63 @@ import librosa
 import numpy as np
 import aubio
 import pyloudnorm as pyln
+import soundfile as sf
+import io
 import os
+from modules.fingerprint import FP_WINDOWS
+from modules.engine_blobs import OVERVIEW_ENTRIES, performance_blobs
 
-def analyze_song(file_path):
+def chroma_fingerprint(chroma, sr, start_sec=0.0, hop_length=512, max_window_sec=2.0):
+    """
+    96-Byte-Fingerabdruck aus der Chroma-Matrix: ab dem ersten Ton 64 Fenster,
+    je Fenster 12 Bit (Bin lauter als der Fenster-Mittelwert). Bitraten-robust.
+    """
+    start = int(start_sec * sr / hop_length)
+    frames = chroma.shape[1] - start
+    win = min(int(max_window_sec * sr / hop_length), frames // FP_WINDOWS)
+    if win < 1: return None
+    seg = chroma[:, start:start + win * FP_WINDOWS].reshape(chroma.shape[0], FP_WINDOWS, win).mean(axis=2)
+    bits = (seg > seg.mean(axis=0, keepdims=True)).T.flatten()
+    return np.packbits(bits).tobytes()
+
+def overview_entries(y, sr, entries=OVERVIEW_ENTRIES, chunk=64, split_hz=(250.0, 2500.0)):
+    """
+    Übersichts-Wellenform für Engine: pro Eintrag RMS in Low/Mid/High (0..255).
+    FFT blockweise über `chunk` Einträge, damit der Speicher auch bei langen Tracks klein bleibt.
+    """
+    spe = len(y) // entries
+    if spe < 2: return None, 0
+    freqs = np.fft.rfftfreq(spe, 1.0 / sr)
+    bands = [freqs < split_hz[0], (freqs >= split_hz[0]) & (freqs < split_hz[1]), freqs >= split_hz[1]]
+    levels = np.empty((entries, 3), dtype=np.float32)
+    for start in range(0, entries, chunk):
+        block = y[start * spe:(start + chunk) * spe].reshape(-1, spe)
+        power = np.abs(np.fft.rfft(block, axis=1)) ** 2
+        for b, mask in enumerate(bands):
+            levels[start:start + len(block), b] = np.sqrt(power[:, mask].sum(axis=1)) if mask.any() else 0.0
+    peak = levels.max(axis=0)
+    peak[peak == 0] = 1.0
+    return (levels / peak * 255).astype(np.uint8).tobytes(), spe
+
+# Endung -> libsndfile-Format. Nur diese kann librosa aus dem RAM lesen (MP3 erst ab libsndfile 1.1)
+SF_FORMATS = {".wav": "WAV", ".flac": "FLAC", ".aiff": "AIFF", ".aif": "AIFF", ".ogg": "OGG", ".mp3": "MP3"}
+
+def buffer_decodable_exts():
+    """Endungen, die load_audio direkt aus dem Prefetch-Puffer dekodiert; alle anderen lohnt Vorlesen nicht."""
+    try: available = sf.available_formats()
+    except Exception: return set()
+    return {ext for ext, fmt in SF_FORMATS.items() if fmt in available}
+
+def load_audio(file_path, data=None, sr=44100):
+    """Dekodiert aus dem vorab gelesenen Puffer (Prefetch); Formate, die soundfile nicht aus dem RAM kann, vom Pfad."""
+    if data is not None:
+        try: return librosa.load(io.BytesIO(data), sr=sr, mono=True)
+        except Exception: pass
+    return librosa.load(file_path, sr=sr, mono=True)
+
+def analyze_song(file_path, data=None):
     try:
-        y, sr = librosa.load(file_path, sr=44100, mono=True)
+        y, sr = load_audio(file_path, data)
         if np.mean(np.abs(y)) < 0.0001: return None
 
         duration = librosa.get_duration(y=y, sr=sr)
@@ -89,7 +141,7 @@ def analyze_song(file_path):
         
         key_map = {'Cmaj':'8B','Dbmaj':'3B','Dmaj':'10B','Ebmaj':'5B','Emaj':'12B','Fmaj':'7B','F#maj':'2B','Gmaj':'9B','Abmaj':'4B','Amaj':'11B','Bbmaj':'6B','Bmaj':'1B','Amin':'8A','Bbmin':'3A','Bmin':'10A','Cmin':'5A','C#min':'12A','Dmin':'7A','D#min':'2A','Emin':'9A','Fmin':'4A','F#min':'11A','Gmin':'6A','G#min':'1A'}
         
-        return {
+        result = {
             'bpm': float(bpm),
             'key_full': best_key,
             'camelot_key': key_map.get(best_key, best_key),
@@ -99,8 +151,14 @@ def analyze_song(file_path):
             'mix_out_point': float(mix_out_point),
             'rhythm_quality': rhythm_quality,
             'first_downbeat': float(start_offset_sec), # Cue1
-            'bars_count': bars_count
+            'bars_count': bars_count,
+            'fingerprint': chroma_fingerprint(chroma, sr, start_offset_sec)
         }
+        # Engine PerformanceData (Wellenform, Beatgrid, Cues) im selben Durchgang - kein zweites Dekodieren am PC
+        result['first_beat'] = float(aubio_beats[0]) if aubio_beats else float(start_offset_sec)
+        waveform, samples_per_entry = overview_entries(y, sr)
+        result.update(performance_blobs(sr, len(y), result, waveform, samples_per_entry))
+        return result
     except Exception as e:
         print(f"!! Fehler: {e}")
         return None
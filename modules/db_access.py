@@ -0,0 +1,189 @@
+import os
+import sqlite3
+import threading
+import weakref
+from urllib.parse import quote
+
+# Flash-freundliche Defaults: großer Page-Cache, mmap statt read(), Temp-Tabellen im RAM
+PRAGMAS = {
+    "mmap_size": 64 * 1024 * 1024,
+    "cache_size": -16384,        # negativ = KiB -> 16 MB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+STATEMENT_CACHE = 256
+
+_local = threading.local()
+_lock = threading.RLock()
+_generation = {}
+_schema_cache = {}
+_open_conns = []      # (path, conn) aller Threads - für close_under()
+
+
+class DatabaseLockedError(Exception):
+    """Ein anderer Schreiber hält die DB (oder hat sie während des Stagings geändert)."""
+
+
+def is_locked_error(exc):
+    return isinstance(exc, sqlite3.OperationalError) and any(w in str(exc).lower() for w in ("locked", "busy"))
+
+
+class _ThreadConns:
+    """
+    Verbindungen eines Threads. Stirbt der Thread (Streamlit startet pro Rerun einen neuen),
+    räumt threading.local das Objekt weg und der Finalizer schließt seine Verbindungen -
+    sonst sammeln sich offene Handles und Snapshots halten gelöschte m.db-Inodes fest.
+    """
+
+    def __init__(self):
+        self.conns = {}
+        self.snaps = {}
+        weakref.finalize(self, _close_all, self.conns, self.snaps)
+
+
+def _close_all(*caches):
+    for cache in caches:
+        for entry in list(cache.values()): _discard(entry[0])
+        cache.clear()
+
+
+def _thread_conns():
+    tc = getattr(_local, "tc", None)
+    if tc is None:
+        tc = _local.tc = _ThreadConns()
+    return tc
+
+
+def _key(db_path):
+    return os.path.realpath(db_path)
+
+
+def _identity(path):
+    """(dev, inode) der Datei - ändert sich, wenn m.db per rename ersetzt wurde."""
+    try:
+        st = os.stat(path)
+        return st.st_dev, st.st_ino
+    except FileNotFoundError:
+        return None
+
+
+def _open(path, wal):
+    conn = sqlite3.connect(path, cached_statements=STATEMENT_CACHE, check_same_thread=False)
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    if wal:
+        # WAL nur für lokale DBs; m.db auf dem Stick bleibt im Rollback-Journal (Player)
+        if conn.execute("PRAGMA journal_mode=WAL").fetchone()[0].lower() == "wal":
+            conn.execute("PRAGMA synchronous=NORMAL")
+    with _lock: _open_conns.append((path, conn))
+    return conn
+
+
+def _discard(conn):
+    with _lock: _open_conns[:] = [e for e in _open_conns if e[1] is not conn]
+    try: conn.close()
+    except Exception: pass
+
+
+def connect(db_path, wal=False):
+    """
+    Liefert eine langlebige Verbindung (pro Thread und DB-Datei, mit dem Thread geschlossen).
+    Wird die Datei ersetzt (Staging-Rename) oder invalidiert, wird neu geöffnet.
+    """
+    path = _key(db_path)
+    conns = _thread_conns().conns
+    with _lock: gen = _generation.get(path, 0)
+
+    entry = conns.get(path)
+    ident = _identity(path)
+    if entry:
+        conn, e_gen, e_ident = entry
+        if e_gen == gen and e_ident == ident and ident is not None:
+            return conn
+        _discard(conn)
+
+    conn = _open(path, wal)
+    conns[path] = (conn, gen, _identity(path))
+    return conn
+
+
+def _file_signature(path):
+    st = os.stat(path)
+    return st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def snapshot(db_path):
+    """
+    Nur-Lese-Verbindung auf einen festen Stand von db_path (pro Thread gecacht, mit dem Thread geschlossen).
+    immutable=1 nimmt keine Locks - Leser warten nie auf Schreiber. Das ist sicher, weil
+    Schreiber m.db per Staging + rename ersetzen: die offene Verbindung liest den alten
+    Inode weiter. Neu geöffnet wird, sobald sich Inode, mtime oder Größe ändern.
+    """
+    path = _key(db_path)
+    snaps = _thread_conns().snaps
+    with _lock: gen = _generation.get(path, 0)
+    sig = _file_signature(path)
+    entry = snaps.get(path)
+    if entry:
+        conn, e_gen, e_sig = entry
+        if e_gen == gen and e_sig == sig: return conn
+        _discard(conn)
+    conn = sqlite3.connect(f"file:{quote(path)}?immutable=1", uri=True,
+                           cached_statements=STATEMENT_CACHE, check_same_thread=False)
+    for name in ("mmap_size", "cache_size", "temp_store"):
+        conn.execute(f"PRAGMA {name}={PRAGMAS[name]}")
+    with _lock: _open_conns.append((path, conn))
+    snaps[path] = (conn, gen, sig)
+    return conn
+
+
+def invalidate(db_path):
+    """Alle Threads öffnen ihre Verbindung zu db_path beim nächsten Zugriff neu."""
+    path = _key(db_path)
+    with _lock:
+        _generation[path] = _generation.get(path, 0) + 1
+        for k in [k for k in _schema_cache if k[0] == path]:
+            del _schema_cache[k]
+
+
+def close(db_path):
+    """Verbindung des aktuellen Threads schließen und andere Threads zum Neuöffnen zwingen."""
+    path = _key(db_path)
+    tc = _thread_conns()
+    for cache in (tc.conns, tc.snaps):
+        entry = cache.pop(path, None)
+        if entry: _discard(entry[0])
+    invalidate(db_path)
+
+
+def close_under(directory):
+    """Alle Verbindungen (aller Threads) zu DBs unterhalb von directory schließen, z.B. vor dem Eject."""
+    prefix = os.path.join(os.path.realpath(directory), "")
+    with _lock:
+        hits = [(p, c) for p, c in _open_conns if p.startswith(prefix)]
+        _open_conns[:] = [(p, c) for p, c in _open_conns if not p.startswith(prefix)]
+    for path, conn in hits:
+        try: conn.close()
+        except Exception: pass
+        invalidate(path)
+    return len(hits)
+
+
+def checkpoint(db_path):
+    """WAL in die Hauptdatei falten, damit eine reine Dateikopie vollständig ist."""
+    conn = connect(db_path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def table_columns(db_path, table):
+    """Gecachtes PRAGMA table_info; neu gelesen nur wenn sich schema_version ändert."""
+    conn = connect(db_path)
+    path = _key(db_path)
+    version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    ident = _identity(path)
+    with _lock: cached = _schema_cache.get((path, table))
+    if cached and cached[0] == version and cached[1] == ident:
+        return cached[2]
+    cols = [r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+    with _lock: _schema_cache[(path, table)] = (version, ident, cols)
+    return cols
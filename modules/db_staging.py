@@ -0,0 +1,221 @@
+import contextlib
+import fcntl
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from modules.db_access import DatabaseLockedError, is_locked_error
+
+# tmpfs zuerst (RAM), dann lokale Platte
+STAGING_CANDIDATES = ["/dev/shm", tempfile.gettempdir()]
+COPY_CHUNK = 4 * 1024 * 1024
+# Wie lange ein Schreiber auf einen anderen wartet (Phase 5); die UI übergibt 0 = sofort melden
+LOCK_TIMEOUT = 60.0
+LOCK_POLL = 0.1
+
+
+def lock_path(path, kind="write"):
+    """Lokale Lock-Datei pro Pfad und Zweck - kein zusätzlicher Schreibzugriff auf den Stick, flock auf vfat egal."""
+    digest = hashlib.blake2b(os.path.realpath(path).encode(), digest_size=8).hexdigest()
+    suffix = "" if kind == "write" else f"-{kind}"
+    return os.path.join(tempfile.gettempdir(), f"aidj-{digest}{suffix}.lock")
+
+
+@contextlib.contextmanager
+def exclusive(path, kind, timeout=None):
+    """Exklusiver flock für (path, kind); timeout None = warten bis frei, sonst DatabaseLockedError."""
+    f = open(lock_path(path, kind), "w")
+    try:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | (fcntl.LOCK_NB if deadline is not None else 0))
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise DatabaseLockedError(f"{path} wird gerade von einem anderen Vorgang bearbeitet ({kind}).")
+                time.sleep(LOCK_POLL)
+        yield
+    finally:
+        f.close()   # gibt den flock frei
+
+
+def is_locked(path, kind):
+    """Hält gerade ein anderer Prozess den Lock (path, kind)?"""
+    try:
+        with exclusive(path, kind, timeout=0): return False
+    except DatabaseLockedError:
+        return True
+
+
+class StagedDatabase:
+    """
+    Arbeitet auf einer lokalen Kopie von m.db und schreibt sie am Ende
+    in einem Rutsch atomar auf den Stick zurück (tmp + fsync + rename).
+    """
+
+    def __init__(self, target_path, source_path=None, staging_dir=None, lock_timeout=LOCK_TIMEOUT):
+        self.target_path = target_path
+        # Quelle darf abweichen (z.B. frische Kopie der Library-DB)
+        self.source_path = source_path or target_path
+        self.staging_dir = staging_dir
+        self.lock_timeout = lock_timeout
+        self.local_path = None
+        self.timings = {}
+        self._tmp_dir = None
+        self._lock_file = None
+        self._base_sig = None
+
+    def _lock_path(self):
+        return lock_path(self.target_path)
+
+    def _acquire(self):
+        """Ein Schreiber pro m.db; sonst gewinnt beim rename der letzte und die andere Änderung ist weg."""
+        self._lock_file = open(self._lock_path(), "w")
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    self._release()
+                    raise DatabaseLockedError(f"{self.target_path} wird gerade von einem anderen Vorgang geschrieben.")
+                time.sleep(LOCK_POLL)
+
+    def _release(self):
+        if self._lock_file:
+            self._lock_file.close()   # gibt den flock frei
+            self._lock_file = None
+
+    def _target_sig(self):
+        try:
+            st = os.stat(self.target_path)
+            return st.st_ino, st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def _pick_staging_dir(self):
+        if self.staging_dir: return self.staging_dir
+        for cand in STAGING_CANDIDATES:
+            if os.path.isdir(cand) and os.access(cand, os.W_OK): return cand
+        return None
+
+    def _timed(self, step, start):
+        self.timings[step] = time.perf_counter() - start
+
+    def _settle_journal(self):
+        """
+        Liegt neben der Quelle ein -journal (abgebrochener Schreiber, z.B. Stick mitten im Commit gezogen),
+        ist die Hauptdatei halb geschrieben. Ein normaler Lesezugriff lässt SQLite das Hot Journal
+        zurückrollen - erst danach ist die Datei eine gültige Kopiervorlage.
+        """
+        if not os.path.exists(self.source_path + "-journal"): return
+        conn = sqlite3.connect(self.source_path, timeout=self.lock_timeout)
+        try:
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        except sqlite3.OperationalError as e:
+            if is_locked_error(e):
+                raise DatabaseLockedError(f"{self.source_path} wird gerade von einem anderen Programm geschrieben.") from e
+            raise
+        finally:
+            conn.close()
+
+    def open(self):
+        """Kopiert die Quell-DB ins Staging-Verzeichnis und liefert den lokalen Pfad."""
+        self._acquire()
+        try:
+            self._settle_journal()
+        except Exception:
+            self._release()
+            raise
+        t0 = time.perf_counter()
+        self._base_sig = self._target_sig()
+        self._tmp_dir = tempfile.mkdtemp(prefix="aidj_stage_", dir=self._pick_staging_dir())
+        self.local_path = os.path.join(self._tmp_dir, os.path.basename(self.target_path))
+        if os.path.exists(self.source_path):
+            shutil.copyfile(self.source_path, self.local_path)
+            # Eine evtl. vorhandene WAL gehört zum Stand der Quelle
+            for suffix in ("-wal",):
+                if os.path.exists(self.source_path + suffix):
+                    shutil.copyfile(self.source_path + suffix, self.local_path + suffix)
+        self._timed("stage_in", t0)
+        return self.local_path
+
+    def checkpoint(self):
+        """WAL einfalten und auf Rollback-Journal umstellen, damit nur EINE Datei zurück muss."""
+        t0 = time.perf_counter()
+        conn = sqlite3.connect(self.local_path)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("PRAGMA journal_mode=DELETE")
+        finally: conn.close()
+        self._timed("checkpoint", t0)
+
+    def write_back(self):
+        """Sequenziell nach <m.db>.aidj-tmp schreiben, nur diese Datei fsyncen, dann atomar umbenennen."""
+        self.checkpoint()
+        # Bearbeitung auf Basis des Ziels (z.B. Löschen): fremde Änderung seit dem Staging nicht überschreiben
+        if self.source_path == self.target_path and self._target_sig() != self._base_sig:
+            raise DatabaseLockedError(f"{self.target_path} wurde während der Bearbeitung von außen geändert.")
+        target_dir = os.path.dirname(self.target_path) or "."
+        tmp_target = self.target_path + ".aidj-tmp"
+
+        t0 = time.perf_counter()
+        written = 0
+        with open(self.local_path, "rb") as src, open(tmp_target, "wb") as dst:
+            while True:
+                chunk = src.read(COPY_CHUNK)
+                if not chunk: break
+                dst.write(chunk)
+                written += len(chunk)
+            dst.flush()
+            self._timed("copy_out", t0)
+            t1 = time.perf_counter()
+            os.fsync(dst.fileno())
+            self._timed("fsync", t1)
+
+        t2 = time.perf_counter()
+        os.replace(tmp_target, self.target_path)
+        # Alte Journale gehören nicht zur neuen Datei
+        for suffix in ("-wal", "-shm", "-journal"):
+            try: os.remove(self.target_path + suffix)
+            except FileNotFoundError: pass
+        try:
+            dfd = os.open(target_dir, os.O_RDONLY)
+            try: os.fsync(dfd)
+            finally: os.close(dfd)
+        except OSError:
+            # vfat/exfat erlauben kein fsync auf Verzeichnisse
+            pass
+        self._timed("rename", t2)
+        self.timings["bytes"] = written
+        return written
+
+    def cleanup(self):
+        if self._tmp_dir and os.path.isdir(self._tmp_dir):
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        self._tmp_dir = None
+        self._release()
+
+    def report(self):
+        """Kurze Zeitübersicht der Staging-Schritte für das Log."""
+        parts = [f"{k}={v:.3f}s" for k, v in self.timings.items() if k != "bytes"]
+        mb = self.timings.get("bytes", 0) / (1024 * 1024)
+        return f"Staging: {' | '.join(parts)} | {mb:.2f} MB"
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.write_back()
+                print(f" -> {self.report()}", flush=True)
+        finally:
+            self.cleanup()
+        return False
@@ -0,0 +1,94 @@
+import struct
+import zlib
+
+# Engine-DJ PerformanceData-Blobs (Format wie libdjinterop, Engine 1.x/2.x):
+# jedes Blob ist qCompress-kodiert = 4 Byte Big-Endian-Länge + zlib-Stream.
+OVERVIEW_ENTRIES = 1024
+HOT_CUES = 8
+# ARGB; Engine zeigt unbelegte Cues mit Farbe 0 an
+CUE_COLORS = {
+    "Cue1": (0xFF, 0x28, 0xE2, 0x14),      # grün: Einstieg
+    "Mix-Out": (0xFF, 0xE8, 0x1F, 0x1F),   # rot: Ausstieg
+}
+
+CAMELOT_NUMBERS = {f"{n}{m}" for n in range(1, 13) for m in "AB"}
+
+
+def qcompress(raw):
+    return struct.pack(">I", len(raw)) + zlib.compress(raw)
+
+
+def quncompress(blob):
+    if not blob or len(blob) < 4: return b""
+    return zlib.decompress(blob[4:])
+
+
+def engine_key(camelot):
+    """Camelot -> Engine-Tonartnummer (Quintenzirkel ab C-Dur = 0, a-Moll = 1, G-Dur = 2 ...); -1 = unbekannt."""
+    if not camelot or camelot.upper() not in CAMELOT_NUMBERS: return -1
+    num, mode = int(camelot[:-1]), camelot[-1].upper()
+    return ((num - 8) % 12) * 2 + (1 if mode == "A" else 0)
+
+
+def track_data(sample_rate, sample_count, lufs, camelot):
+    # Lautheit 0..1: -30 LUFS (leise) .. 0 LUFS (Brickwall)
+    loudness = min(1.0, max(0.0, (lufs + 30.0) / 30.0)) if lufs is not None else 0.5
+    return qcompress(struct.pack(">dqdi", float(sample_rate), int(sample_count), loudness, engine_key(camelot)))
+
+
+def _beatgrid(markers):
+    out = struct.pack(">q", len(markers))
+    for sample_offset, beat_number, number_of_beats in markers:
+        # Marker selbst sind Little-Endian (wie von Engine geschrieben)
+        out += struct.pack("<dqii", float(sample_offset), int(beat_number), int(number_of_beats), 0)
+    return out
+
+
+def beat_data(sample_rate, sample_count, bpm, first_beat_sec):
+    """Konstantes Beatgrid: Marker auf dem ersten Beat und auf dem letzten ganzen Beat."""
+    if not bpm or bpm <= 0:
+        markers = []
+    else:
+        samples_per_beat = sample_rate * 60.0 / bpm
+        first = first_beat_sec * sample_rate
+        beats = max(1, int((sample_count - first) // samples_per_beat))
+        markers = [(first, 0, beats), (first + beats * samples_per_beat, beats, 0)]
+    grid = _beatgrid(markers)
+    raw = struct.pack(">ddB", float(sample_rate), float(sample_count), 1 if markers else 0) + grid + grid
+    return qcompress(raw)
+
+
+def quick_cues(sample_rate, cues, main_cue_sec):
+    """cues: Liste (label, sekunden) für Hot-Cue 1..8; Rest bleibt leer."""
+    raw = struct.pack(">q", HOT_CUES)
+    for i in range(HOT_CUES):
+        if i < len(cues) and cues[i][1] is not None:
+            label, sec = cues[i]
+            name = label.encode("utf-8")[:255]
+            raw += struct.pack(">B", len(name)) + name + struct.pack(">d", sec * sample_rate)
+            raw += struct.pack(">4B", *CUE_COLORS.get(label, (0xFF, 0xFF, 0xFF, 0xFF)))
+        else:
+            raw += struct.pack(">Bd4B", 0, -1.0, 0, 0, 0, 0)
+    main = main_cue_sec * sample_rate
+    raw += struct.pack(">dBd", main, 0, main)
+    return qcompress(raw)
+
+
+def overview_waveform(entries, samples_per_entry):
+    """entries: Bytes mit je 3 Werten (low, mid, high) 0..255 pro Eintrag."""
+    n = len(entries) // 3
+    peak = [max(entries[band::3], default=0) for band in range(3)]
+    raw = struct.pack(">qqd", n, n, float(samples_per_entry)) + bytes(entries[:n * 3]) + bytes(peak)
+    return qcompress(raw)
+
+
+def performance_blobs(sample_rate, sample_count, analysis, waveform=None, samples_per_entry=None):
+    """Alle vier Blobs aus einem Analyse-Ergebnis (analyze_song) für songs/PerformanceData."""
+    first_beat = analysis.get('first_beat', analysis.get('first_downbeat')) or 0.0
+    cue1 = analysis.get('first_downbeat') or 0.0
+    return {
+        'track_data': track_data(sample_rate, sample_count, analysis.get('lufs'), analysis.get('camelot_key')),
+        'beat_data': beat_data(sample_rate, sample_count, analysis.get('bpm'), first_beat),
+        'quick_cues': quick_cues(sample_rate, [("Cue1", cue1), ("Mix-Out", analysis.get('mix_out_point'))], cue1),
+        'overview_waveform': overview_waveform(waveform, samples_per_entry) if waveform else None,
+    }
@@ -0,0 +1,80 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ENGINE_HOST = "127.0.0.1"
+ENGINE_PORT = 8765
+SERVICE_SCRIPT = "engine_service.py"
+
+
+class EngineClient:
+    """Schlanker HTTP-Client für den Engine-Service (nur stdlib, damit das UI leicht bleibt)."""
+
+    def __init__(self, host=ENGINE_HOST, port=ENGINE_PORT, timeout=2.0):
+        self.base = f"http://{host}:{port}"
+        self.timeout = timeout
+        self.last_error = ""
+        self.final = None
+
+    def _request(self, method, path, payload=None):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        req = urllib.request.Request(self.base + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+    def available(self):
+        try: return bool(self._request("GET", "/health").get("ok"))
+        except Exception as e:
+            self.last_error = str(e)
+            return False
+
+    def ensure_running(self, workdir=None, wait=8.0):
+        """Startet den Service im Hintergrund, falls er nicht läuft. True = erreichbar."""
+        if self.available(): return True
+        workdir = workdir or os.getcwd()
+        with open(os.path.join(workdir, "engine_service.log"), "a") as log:
+            subprocess.Popen([sys.executable, "-u", SERVICE_SCRIPT], cwd=workdir, stdout=log,
+                             stderr=subprocess.STDOUT, start_new_session=True)
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            if self.available(): return True
+            time.sleep(0.25)
+        return False
+
+    def submit(self, kind, argv):
+        """Job einreichen ('generate' oder 'scan'), liefert die Job-ID."""
+        try:
+            return self._request("POST", "/jobs", {"kind": kind, "argv": argv})["id"]
+        except urllib.error.HTTPError as e:
+            try: self.last_error = json.loads(e.read().decode("utf-8")).get("error", str(e))
+            except Exception: self.last_error = str(e)
+            return None
+
+    def status(self, job_id, since=0):
+        return self._request("GET", f"/jobs/{job_id}?since={int(since)}")
+
+    def jobs(self):
+        try: return self._request("GET", "/jobs").get("jobs", [])
+        except Exception: return []
+
+    def active_job(self):
+        """Letzter noch laufender Job als {"id", "kind", ...} (z.B. nach einem Browser-Reconnect) oder None."""
+        running = [j for j in self.jobs() if j["status"] in ("queued", "running")]
+        return running[-1] if running else None
+
+    def follow(self, job_id, poll=0.3):
+        """Generator über neue Log-Zeilen; endet, wenn der Job fertig ist. Liefert zuletzt den Status."""
+        since = 0
+        while True:
+            snap = self.status(job_id, since)
+            for line in snap["lines"]: yield line
+            since = snap["next"]
+            if snap["status"] in ("done", "error"):
+                self.final = snap
+                return
+            time.sleep(poll)
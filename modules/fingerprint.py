@@ -0,0 +1,70 @@
+import hashlib
+
+# Fingerabdruck: 64 Zeitfenster x 12 Chroma-Bins = 768 Bit (96 Bytes), siehe analysis_engine_v3
+FP_WINDOWS = 64
+FP_BINS = 12
+FP_BITS = FP_WINDOWS * FP_BINS
+# LSH: 24 Bänder à 32 Bit. Kandidat = mindestens ein Band identisch.
+# Bei 95 % Bit-Übereinstimmung trifft das mit ~99 %, bei fremden Songs (~50 %) praktisch nie.
+LSH_BANDS = 24
+BAND_BITS = FP_BITS // LSH_BANDS
+# Ab dieser Bit-Übereinstimmung gilt ein Kandidat als dieselbe Aufnahme
+MATCH_THRESHOLD = 0.9
+
+HASH_CHUNK = 1024 * 1024
+
+
+def content_hash(path, data=None):
+    """BLAKE2b über den Dateiinhalt - identisch nur bei byte-gleichen Kopien ("(1)"-Dateien)."""
+    h = hashlib.blake2b(digest_size=16)
+    if data is not None:
+        h.update(data)
+        return h.hexdigest()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def lsh_bands(fp):
+    """(band, bucket) je Band; bucket = die 32 Bit des Bands als Integer."""
+    value = int.from_bytes(fp, "big")
+    mask = (1 << BAND_BITS) - 1
+    return [(band, (value >> (band * BAND_BITS)) & mask) for band in range(LSH_BANDS)]
+
+
+def similarity(a, b):
+    """Anteil gleicher Bits zweier Fingerabdrücke (1.0 = identisch)."""
+    if not a or not b or len(a) != len(b): return 0.0
+    diff = int.from_bytes(a, "big") ^ int.from_bytes(b, "big")
+    return 1.0 - bin(diff).count("1") / (len(a) * 8)
+
+
+def find_recording(conn, fp, threshold=MATCH_THRESHOLD):
+    """recording_id der ähnlichsten bekannten Aufnahme (über den LSH-Index) oder None."""
+    if not fp: return None
+    bands = lsh_bands(fp)
+    where = " OR ".join(["(l.band = ? AND l.bucket = ?)"] * len(bands))
+    params = [v for pair in bands for v in pair]
+    rows = conn.execute(f"""
+        SELECT DISTINCT s.id, s.fingerprint, s.recording_id
+        FROM fingerprint_lsh l JOIN songs s ON s.id = l.song_id
+        WHERE {where}
+    """, params).fetchall()
+    best, best_sim = None, threshold
+    for song_id, cand_fp, recording_id in rows:
+        sim = similarity(fp, cand_fp)
+        if sim >= best_sim: best, best_sim = recording_id or song_id, sim
+    return best
+
+
+def index_song(conn, song_id, fp):
+    """Bänder eines Songs in den LSH-Index eintragen."""
+    if not fp: return
+    conn.executemany("INSERT OR IGNORE INTO fingerprint_lsh (band, bucket, song_id) VALUES (?, ?, ?)",
+                     [(band, bucket, song_id) for band, bucket in lsh_bands(fp)])
+
+
+def recording_key(track):
+    """Gruppenschlüssel für die Generierung: Songs ohne Fingerabdruck sind ihre eigene Aufnahme."""
+    return track.get('recording_id') or ("song", track.get('id') or track.get('relative_path'))
@@ -0,0 +1,174 @@
+import argparse
+import contextvars
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+from modules import progress, tracing
+from modules.smart_usb_mount import MOUNT_BASE, SmartUSBMount, mount_point_for
+from modules.usb_profiler import device_key
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_SCRIPT = os.path.join(REPO_DIR, "main_workflow_v10.py")
+STATUS_FILE = os.path.join(REPO_DIR, "stick_status.json")
+
+
+def discover(mounter=None, base=MOUNT_BASE):
+    """Alle Partitionen von Wechseldatenträgern, jede mit eigenem Mount-Punkt und Platten-Namen (Bus-Gruppe)."""
+    mounter = mounter or SmartUSBMount(base)
+    sticks = []
+    for device, majmin in mounter.list_usb_partitions():
+        sticks.append({
+            "device": device,
+            "majmin": majmin,
+            "disk": mounter.disk_name(majmin) or os.path.basename(device),
+            "mount_point": mount_point_for(device, base),
+            "key": device_key(device, mounter.sysfs_root),
+        })
+    return sticks
+
+
+def output_dir_for(stick):
+    """Library pro Stick (nicht pro Steckplatz): derselbe Stick findet seine Analyse wieder."""
+    return os.path.join(REPO_DIR, re.sub(r"[^\w.-]+", "_", stick["key"]).strip("_") + "_ergebnisse")
+
+
+class StatusBoard:
+    """Status aller Sticks als JSON-Datei (atomar ersetzt) - die UI liest nur mit."""
+
+    def __init__(self, path=STATUS_FILE):
+        self.path = path
+        self.started = time.time()
+        self.sticks = {}
+        self._lock = threading.Lock()
+
+    def update(self, device, **fields):
+        with self._lock:
+            entry = self.sticks.setdefault(device, {"device": device})
+            entry.update(fields, updated=round(time.time(), 3))
+            payload = {"pid": os.getpid(), "started": round(self.started, 3), "sticks": list(self.sticks.values())}
+            try:
+                with open(self.path + ".tmp", "w") as f: json.dump(payload, f, ensure_ascii=False)
+                os.replace(self.path + ".tmp", self.path)
+            except OSError:
+                pass
+
+
+def load_status(path=STATUS_FILE):
+    try:
+        with open(path) as f: return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_running(status):
+    """Läuft der Orchestrator, der diese Status-Datei schreibt, noch?"""
+    if not status or not status.get("pid"): return False
+    try:
+        os.kill(status["pid"], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return any(s.get("state") in ("queued", "mounting", "running") for s in status.get("sticks", []))
+
+
+def run_stick(stick, board, workflow_args=(), folder=None, workers=None):
+    """Einen Stick mounten und den kompletten Motor (Scan bis m.db) als eigenen Prozess laufen lassen."""
+    device, mount_point = stick["device"], stick["mount_point"]
+    with tracing.span("stick", device=device, mount_point=mount_point) as sp:
+        board.update(device, state="mounting", started=round(time.time(), 3))
+        ok, msg = SmartUSBMount(mount_point, device=device).mount()
+        if not ok:
+            board.update(device, state="error", message=msg)
+            sp.set(ok=False)
+            return False
+
+        music_folder = os.path.join(mount_point, folder) if folder else mount_point
+        out_dir = output_dir_for(stick)
+        os.makedirs(out_dir, exist_ok=True)
+        cmd = [sys.executable, "-u", BACKEND_SCRIPT, music_folder, "--no-mount",
+               "--mount-target", mount_point, "--output-dir", out_dir] + list(workflow_args)
+        if workers and "--workers" not in workflow_args: cmd += ["--workers", str(workers)]
+        board.update(device, state="running", message=msg, log=os.path.join(out_dir, "multi_stick.log"))
+
+        last_error = None
+        with open(os.path.join(out_dir, "multi_stick.log"), "w") as log:
+            proc = subprocess.Popen(cmd, cwd=REPO_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+            for line in proc.stdout:
+                log.write(line)
+                ev = progress.parse(line)
+                if ev is None:
+                    if "❌" in line: last_error = line.strip()
+                elif ev.get("event") == "phase":
+                    board.update(device, phase=ev.get("phase"), phase_name=ev.get("name"))
+                elif ev.get("event") == "scan":
+                    board.update(device, scan_done=ev.get("done"), scan_total=ev.get("total"))
+                elif ev.get("event") == "result":
+                    board.update(device, playlist=ev.get("playlist_name"), trace_id=ev.get("trace_id"))
+            returncode = proc.wait()
+
+        ok = returncode == 0
+        board.update(device, state="done" if ok else "error", returncode=returncode,
+                     finished=round(time.time(), 3), message=None if ok else last_error)
+        sp.set(ok=ok, returncode=returncode)
+        return ok
+
+
+def run_all(sticks, workflow_args=(), folder=None, board=None, cpu_count=None):
+    """
+    Sticks auf verschiedenen Platten parallel, Partitionen derselben Platte nacheinander
+    (die teilen sich den Bus). Die CPU wird auf die parallelen Läufe aufgeteilt.
+    """
+    board = board or StatusBoard()
+    lanes = {}
+    for stick in sticks:
+        lanes.setdefault(stick["disk"], []).append(stick)
+        board.update(stick["device"], state="queued", disk=stick["disk"], mount_point=stick["mount_point"], key=stick["key"])
+    workers = max(1, (cpu_count or os.cpu_count() or 1) // max(1, len(lanes)))
+    results = {}
+
+    def lane(group):
+        for stick in group:
+            try:
+                results[stick["device"]] = run_stick(stick, board, workflow_args, folder, workers)
+            except Exception as e:
+                board.update(stick["device"], state="error", message=f"{type(e).__name__}: {e}")
+                results[stick["device"]] = False
+
+    with tracing.span("multi_stick", sticks=len(sticks), lanes=len(lanes), workers=workers):
+        # Kontext kopieren, damit die Stick-Spans im selben Trace landen
+        threads = [threading.Thread(target=contextvars.copy_context().run, args=(lane, group), name=f"stick-{disk}")
+                   for disk, group in lanes.items()]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Alle eingesteckten Sticks parallel scannen, Sets generieren und in die jeweilige m.db schreiben. "
+                    "Unbekannte Optionen (z.B. --length 30) gehen an main_workflow_v10.py.")
+    parser.add_argument("--base", default=MOUNT_BASE, help="Präfix der Mount-Punkte (<base>-sdb1, ...)")
+    parser.add_argument("--folder", default=None, help="Musik-Unterordner auf jedem Stick (Default: ganzer Stick)")
+    parser.add_argument("--status-file", default=STATUS_FILE)
+    parser.add_argument("--list", action="store_true", help="Nur gefundene Sticks anzeigen")
+    args, workflow_args = parser.parse_known_args()
+
+    sticks = discover(base=args.base)
+    if args.list or not sticks:
+        print(json.dumps(sticks, indent=2) if sticks else "Keine Wechseldatenträger gefunden.")
+        return
+    print(f"{len(sticks)} Stick-Partition(en): " + ", ".join(f"{s['device']} -> {s['mount_point']}" for s in sticks), flush=True)
+    results = run_all(sticks, workflow_args, args.folder, StatusBoard(args.status_file))
+    tracing.flush_metrics()
+    for device, ok in results.items(): print(f"{'✅' if ok else '❌'} {device}", flush=True)
+    if not all(results.values()): sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,59 +1,130 @@
-import sqlite3
 import os
+import sqlite3
+from modules import db_access, tracing
+from modules.db_access import DatabaseLockedError
+from modules.db_staging import StagedDatabase
 
 class PlaylistManager:
     def __init__(self, db_path="/mnt/denon/Engine Library/Database2/m.db"):
         self.db_path = db_path
+        self.last_error = ""
 
-    def _get_column_name(self, cur):
+    def _get_column_name(self, conn):
         """Erkennt automatisch, ob die DB 'playlistId' oder 'listId' nutzt."""
-        cur.execute("PRAGMA table_info(PlaylistEntity)")
-        cols = [r[1] for r in cur.fetchall()]
+        cols = [r[1] for r in conn.execute("PRAGMA table_info(PlaylistEntity)")]
         return "playlistId" if "playlistId" in cols else "listId"
 
     def get_all_playlists(self):
-        """Halt wirklich ALLE Playlisten vom Stick, egal in welchem Ordner."""
+        """
+        Halt wirklich ALLE Playlisten vom Stick, egal in welchem Ordner.
+        Liest einen Snapshot (wartet nie auf Schreiber); Lock-Konflikte kommen als DatabaseLockedError.
+        """
         if not os.path.exists(self.db_path): return []
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
         try:
             # Wir entfernen 'parentListId = 0', um alles zu sehen
-            cur.execute("SELECT id, title FROM Playlist ORDER BY title ASC")
-            return cur.fetchall()
-        except: return []
-        finally: conn.close()
+            return db_access.snapshot(self.db_path).execute("SELECT id, title FROM Playlist ORDER BY title ASC").fetchall()
+        except sqlite3.OperationalError as e:
+            if db_access.is_locked_error(e): raise DatabaseLockedError(f"m.db gesperrt: {e}") from e
+            raise
 
-    def delete_multiple_playlists(self, playlist_ids):
-        """Löscht gewählte IDs und nutzt den korrekten Spaltennamen."""
+    def delete_multiple_playlists(self, playlist_ids, lock_timeout=0):
+        """
+        Löscht gewählte IDs (inkl. Unterordner) mengenbasiert in EINER Transaktion - auf einer
+        Staging-Kopie, die danach atomar zurückgeschrieben wird. Schreibt gerade ein anderer
+        Vorgang (Phase 5), kommt sofort DatabaseLockedError statt zu warten.
+        """
         if not playlist_ids: return False
-        conn = sqlite3.connect(self.db_path)
+        with tracing.span("db.delete_playlists", count=len(playlist_ids)) as sp:
+            stage = StagedDatabase(self.db_path, lock_timeout=lock_timeout)
+            stage.open()
+            try:
+                ok = self._delete_playlists(stage.local_path, playlist_ids)
+                if ok:
+                    stage.write_back()
+                    sp.set(**stage.timings)
+            finally:
+                stage.cleanup()
+            sp.set(ok=ok)
+        return ok
+
+    def _delete_playlists(self, local_path, playlist_ids):
+        conn = sqlite3.connect(local_path)
         cur = conn.cursor()
         try:
-            col = self._get_column_name(cur)
-            for pid in playlist_ids:
-                # Nutzt die dynamisch erkannte Spalte (playlistId oder listId)
-                cur.execute(f"DELETE FROM PlaylistEntity WHERE {col} = ?", (pid,))
-                cur.execute("DELETE FROM Playlist WHERE id = ?", (pid,))
-            conn.commit()
+            col = self._get_column_name(conn)
+            cur.execute("BEGIN IMMEDIATE")
+            cur.execute("CREATE TEMP TABLE IF NOT EXISTS _delete_ids (id INTEGER PRIMARY KEY)")
+            cur.execute("DELETE FROM temp._delete_ids")
+            cur.executemany("INSERT OR IGNORE INTO temp._delete_ids (id) VALUES (?)", [(int(pid),) for pid in playlist_ids])
+            # Unterordner mitnehmen, sonst bleiben ihre Einträge verwaist
+            cur.execute("""
+                INSERT OR IGNORE INTO temp._delete_ids (id)
+                WITH RECURSIVE sub(id) AS (
+                    SELECT id FROM temp._delete_ids
+                    UNION SELECT p.id FROM Playlist p JOIN sub ON p.parentListId = sub.id
+                ) SELECT id FROM sub
+            """)
+            # Reihenfolge der betroffenen Ordner VOR dem Löschen merken
+            self._record_chain(cur)
+            cur.execute(f"DELETE FROM PlaylistEntity WHERE {col} IN (SELECT id FROM temp._delete_ids)")
+            cur.execute("DELETE FROM Playlist WHERE id IN (SELECT id FROM temp._delete_ids)")
             self._repair_chain(cur)
             conn.commit()
             return True
         except Exception as e:
+            conn.rollback()
+            self.last_error = str(e)
             print(f"Löschfehler: {e}")
             return False
-        finally: conn.close()
+        finally:
+            cur.close()
+            conn.close()
+
+    def _record_chain(self, cur):
+        """
+        Merkt sich die nextListId-Reihenfolge aller Ordner, die Listen verlieren (temp._chain_order).
+        Kopf = Liste, auf die kein Geschwister zeigt; Listen außerhalb der Kette hängen nach id sortiert hinten an.
+        """
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS _affected_parents (id INTEGER PRIMARY KEY)")
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS _chain_order (id INTEGER PRIMARY KEY, parentListId INTEGER, pos INTEGER)")
+        cur.execute("DELETE FROM temp._affected_parents")
+        cur.execute("DELETE FROM temp._chain_order")
+        # Ordner, die selbst gelöscht werden, brauchen keine Kette mehr
+        cur.execute("""
+            INSERT OR IGNORE INTO temp._affected_parents (id)
+            SELECT parentListId FROM Playlist
+            WHERE id IN (SELECT id FROM temp._delete_ids) AND parentListId NOT IN (SELECT id FROM temp._delete_ids)
+        """)
+        cur.execute("""
+            INSERT OR IGNORE INTO temp._chain_order (id, parentListId, pos)
+            WITH RECURSIVE walk(id, parent, pos) AS (
+                SELECT p.id, p.parentListId, 0 FROM Playlist p
+                WHERE p.parentListId IN (SELECT id FROM temp._affected_parents)
+                  AND NOT EXISTS (SELECT 1 FROM Playlist q WHERE q.parentListId = p.parentListId AND q.nextListId = p.id)
+                UNION ALL
+                SELECT n.id, n.parentListId, w.pos + 1 FROM walk w
+                JOIN Playlist n ON n.id = (SELECT nextListId FROM Playlist WHERE id = w.id) AND n.parentListId = w.parent
+                WHERE w.pos < (SELECT COUNT(*) FROM Playlist)
+            )
+            SELECT id, parent, MIN(pos) FROM walk GROUP BY id
+        """)
+        # Nicht erreichbare Listen (kaputte Kette/Zyklus) nicht verlieren
+        cur.execute("""
+            INSERT OR IGNORE INTO temp._chain_order (id, parentListId, pos)
+            SELECT id, parentListId, (SELECT COUNT(*) FROM Playlist) + id FROM Playlist
+            WHERE parentListId IN (SELECT id FROM temp._affected_parents)
+        """)
 
     def _repair_chain(self, cur):
-            """Flickt die nextListId-Kette wieder zusammen."""
-            cur.execute("SELECT id FROM Playlist ORDER BY id ASC")
-            remaining = [r[0] for r in cur.fetchall()]
-            
-            # --- DER FIX: Kette zuerst komplett trennen ---
-            for pid in remaining:
-                cur.execute("UPDATE Playlist SET nextListId = NULL WHERE id = ?", (pid,))
-                
-            # --- Kette sauber neu aufbauen ---
-            for i in range(len(remaining)):
-                current_id = remaining[i]
-                next_id = remaining[i+1] if i < len(remaining) - 1 else 0
-                cur.execute("UPDATE Playlist SET nextListId = ? WHERE id = ?", (next_id, current_id))
+        """Verkettet nur die Ordner aus temp._chain_order neu - in alter Reihenfolge, ohne gelöschte Listen."""
+        # --- Erst trennen (NULL verletzt UNIQUE(parentListId,nextListId) nicht) ---
+        cur.execute("UPDATE Playlist SET nextListId = NULL WHERE id IN (SELECT id FROM temp._chain_order)")
+        # --- Dann pro Ordner neu verketten, letzte Liste zeigt auf 0 ---
+        cur.execute("""
+            WITH ordered AS (
+                SELECT c.id, LEAD(c.id, 1, 0) OVER (PARTITION BY c.parentListId ORDER BY c.pos) AS next_id
+                FROM temp._chain_order c JOIN Playlist p ON p.id = c.id
+            )
+            UPDATE Playlist SET nextListId = ordered.next_id
+            FROM ordered WHERE Playlist.id = ordered.id
+        """)
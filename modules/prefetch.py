@@ -0,0 +1,111 @@
+import collections
+import os
+import threading
+import time
+
+# Vorlauf für Phase 1: so viele Dateien / Bytes liegen höchstens fertig gelesen im RAM
+PREFETCH_FILES = 4
+PREFETCH_BYTES = 256 * 1024 * 1024
+
+
+def _advise(fd, advice):
+    try: os.posix_fadvise(fd, 0, 0, advice)
+    except (AttributeError, OSError): pass
+
+
+def read_file(path):
+    """Datei in einem sequenziellen Rutsch lesen; danach den Page-Cache freigeben (wir halten die Bytes selbst)."""
+    with open(path, "rb", buffering=0) as f:
+        _advise(f.fileno(), getattr(os, "POSIX_FADV_SEQUENTIAL", 2))
+        data = f.read()
+        _advise(f.fileno(), getattr(os, "POSIX_FADV_DONTNEED", 4))
+    return data
+
+
+class Prefetcher:
+    """
+    Liest die nächsten Dateien in einem Hintergrund-Thread vom Stick, während die aktuelle analysiert wird.
+    Iteration liefert (path, bytes) in Eingangsreihenfolge; bytes ist None bei Lesefehlern,
+    Dateien über `skip_bytes` (die liest der Aufrufer gar nicht erst) und Endungen außerhalb
+    von `read_exts` (die dekodiert der Aufrufer ohnehin vom Pfad - vorlesen hieße doppelt lesen).
+    """
+
+    def __init__(self, paths, depth=PREFETCH_FILES, max_bytes=PREFETCH_BYTES, skip_bytes=None, read_exts=None):
+        self.paths = list(paths)
+        self.depth = max(1, depth)
+        self.max_bytes = max_bytes
+        self.skip_bytes = skip_bytes
+        self.read_exts = None if read_exts is None else {e.lower() for e in read_exts}
+        self.stats = {"read_sec": 0.0, "wait_sec": 0.0, "bytes": 0, "files": 0}
+        self._ready = collections.deque()
+        self._buffered = 0
+        self._delivered = 0   # schon an __iter__ übergebene Pfade
+        self._stop = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+
+    def _has_room(self, size):
+        # Eine Datei passt immer, sonst blockiert ein einzelner großer Track die Pipeline
+        if not self._ready: return True
+        return len(self._ready) < self.depth and self._buffered + size <= self.max_bytes
+
+    def _run(self):
+        try:
+            self._read_all()
+        finally:
+            # Was auch immer schiefging: jeder noch fehlende Pfad kommt als (path, None), sonst wartet __iter__ ewig
+            with self._cond:
+                if self._stop: return
+                done = self._delivered + len(self._ready)
+                self._ready.extend((path, None) for path in self.paths[done:])
+                self._cond.notify_all()
+
+    def _read_all(self):
+        for path in self.paths:
+            try: size = os.path.getsize(path)
+            except OSError: size = None
+            wanted = size is not None and (self.skip_bytes is None or size <= self.skip_bytes)
+            if self.read_exts is not None and os.path.splitext(path)[1].lower() not in self.read_exts: wanted = False
+            with self._cond:
+                while not self._stop and not self._has_room(size if wanted else 0):
+                    self._cond.wait()
+                if self._stop: return
+            data = None
+            if wanted:
+                t0 = time.perf_counter()
+                try: data = read_file(path)
+                except Exception: data = None   # Aufrufer liest dann selbst vom Pfad
+                self.stats["read_sec"] += time.perf_counter() - t0
+            with self._cond:
+                if self._stop: return
+                self._ready.append((path, data))
+                self._buffered += len(data or b"")
+                self._cond.notify_all()
+
+    def __iter__(self):
+        self._thread.start()
+        try:
+            for _ in self.paths:
+                with self._cond:
+                    if not self._ready:
+                        # Hier wartet die CPU auf den Stick -> I/O-gebunden
+                        t0 = time.perf_counter()
+                        while not self._ready: self._cond.wait()
+                        self.stats["wait_sec"] += time.perf_counter() - t0
+                    path, data = self._ready.popleft()
+                    self._delivered += 1
+                    self._buffered -= len(data or b"")
+                    self._cond.notify_all()
+                if data is not None:
+                    self.stats["files"] += 1
+                    self.stats["bytes"] += len(data)
+                yield path, data
+        finally:
+            self.close()
+
+    def close(self):
+        with self._cond:
+            self._stop = True
+            self._ready.clear()
+            self._buffered = 0
+            self._cond.notify_all()
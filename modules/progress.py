@@ -0,0 +1,67 @@
+import collections
+import json
+import time
+
+# Maschinenlesbare Zeilen im normalen Log: "@@EVENT {json}"
+EVENT_PREFIX = "@@EVENT "
+LOG_RING_SIZE = 500
+
+
+def emit(event, **fields):
+    """Gibt ein Fortschritts-Event als JSON-Zeile auf stdout aus."""
+    payload = {"event": event, "ts": round(time.time(), 3)}
+    payload.update(fields)
+    print(EVENT_PREFIX + json.dumps(payload, ensure_ascii=False), flush=True)
+
+
+def parse(line):
+    """Event-Dict aus einer Log-Zeile oder None für normale Textzeilen."""
+    if not line.startswith(EVENT_PREFIX): return None
+    try: return json.loads(line[len(EVENT_PREFIX):])
+    except ValueError: return None
+
+
+class ScanProgress:
+    """Zählt Dateien der Phase 1 und meldet Rate (Tracks/s) und ETA, max. alle `interval` Sekunden."""
+
+    def __init__(self, total, interval=0.5):
+        self.total = total
+        self.interval = interval
+        self.start = time.monotonic()
+        self._last_emit = 0.0
+        self.done = 0
+        self.analyzed = 0
+
+    def step(self, analyzed=False, current=None):
+        self.done += 1
+        if analyzed: self.analyzed += 1
+        now = time.monotonic()
+        if now - self._last_emit < self.interval and self.done < self.total: return
+        self._last_emit = now
+        elapsed = max(now - self.start, 1e-6)
+        rate = self.analyzed / elapsed
+        remaining = self.total - self.done
+        # ETA über die Analyse-Rate; übersprungene (bekannte) Dateien kosten praktisch nichts
+        eta = remaining / rate if rate > 0 else None
+        emit("scan", done=self.done, total=self.total, analyzed=self.analyzed,
+             tracks_per_sec=round(rate, 3), eta_sec=round(eta, 1) if eta is not None else None,
+             current=current)
+
+
+class LogRing:
+    """Fester Ringpuffer für Log-Zeilen (UI), damit lange Scans nicht quadratisch teurer werden."""
+
+    def __init__(self, size=LOG_RING_SIZE):
+        self.lines = collections.deque(maxlen=size)
+        self.dropped = 0
+
+    def append(self, line):
+        if len(self.lines) == self.lines.maxlen: self.dropped += 1
+        self.lines.append(line.rstrip("\n"))
+
+    def clear(self):
+        self.lines.clear(); self.dropped = 0
+
+    def text(self):
+        head = f"... ({self.dropped} ältere Zeilen ausgeblendet)\n" if self.dropped else ""
+        return head + "\n".join(self.lines)
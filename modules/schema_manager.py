@@ -0,0 +1,140 @@
+from modules import tracing
+
+# PRAGMA user_version hält zwei 16-Bit Zähler:
+#   untere 16 Bit = Library-Schema (songs + Engine-Tabellen, siehe init_db)
+#   obere 16 Bit  = Denon-Objekte (Indizes, Trigger, Views aus Phase 5)
+# Die Objekte kommen erst NACH der Injection dazu, weil die Trigger die
+# Bulk-Inserts sonst blockieren würden. Deshalb bleibt die obere Hälfte in der
+# Library immer 0: Phase 5 baut m.db aus einer frischen Library-Kopie und legt
+# die Engine-Ebene dort jedes Mal neu an (die Indizes müssen über die neu
+# injizierten Tracks ohnehin neu gebaut werden). Der Versionsstempel in m.db
+# schützt nur Kopien, die ohne Phase 5 noch einmal angefasst werden.
+LIBRARY_SCHEMA_VERSION = 4
+ENGINE_SCHEMA_VERSION = 1
+
+LIBRARY_MIGRATIONS = {
+    1: [
+        "CREATE TABLE IF NOT EXISTS songs (id INTEGER PRIMARY KEY, relative_path TEXT NOT NULL UNIQUE, filename TEXT NOT NULL, bpm REAL, key_full TEXT, camelot_key TEXT, energy_avg REAL, energy_norm INTEGER, lufs REAL, duration REAL, mix_out_point REAL, rhythm_quality TEXT, first_downbeat REAL, bars_count INTEGER)",
+        "CREATE TABLE IF NOT EXISTS Smartlist (listUuid TEXT NOT NULL, title TEXT, parentPlaylistPath TEXT, nextPlaylistPath TEXT, nextListUuid TEXT, rules TEXT, lastEditTime DATETIME, CONSTRAINT C_NEXT_LIST_UNIQUE_FOR_PARENT UNIQUE(parentPlaylistPath,nextPlaylistPath,nextListUuid), CONSTRAINT C_NAME_UNIQUE_FOR_PARENT UNIQUE(title,parentPlaylistPath), PRIMARY KEY(listUuid))",
+        "CREATE TABLE IF NOT EXISTS PreparelistEntity (id INTEGER PRIMARY KEY AUTOINCREMENT, trackId INTEGER, trackNumber INTEGER, FOREIGN KEY(trackId) REFERENCES Track(id) ON DELETE CASCADE)",
+        "CREATE TABLE IF NOT EXISTS PlaylistEntity (id INTEGER PRIMARY KEY AUTOINCREMENT, listId INTEGER, trackId INTEGER, databaseUuid TEXT, nextEntityId INTEGER, membershipReference INTEGER, FOREIGN KEY(listId) REFERENCES Playlist(id) ON DELETE CASCADE, CONSTRAINT C_NAME_UNIQUE_FOR_LIST UNIQUE(listId,databaseUuid,trackId))",
+        "CREATE TABLE IF NOT EXISTS Playlist (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, parentListId INTEGER, isPersisted BOOLEAN, nextListId INTEGER, lastEditTime DATETIME, isExplicitlyExported BOOLEAN, CONSTRAINT C_NEXT_LIST_ID_UNIQUE_FOR_PARENT UNIQUE(parentListId,nextListId), CONSTRAINT C_NAME_UNIQUE_FOR_PARENT UNIQUE(title,parentListId))",
+        "CREATE TABLE IF NOT EXISTS PerformanceData (trackId INTEGER, trackData BLOB, overviewWaveFormData BLOB, beatData BLOB, quickCues BLOB, loops BLOB, thirdPartySourceId INTEGER, activeOnLoadLoops INTEGER, FOREIGN KEY(trackId) REFERENCES Track(id) ON DELETE CASCADE ON UPDATE CASCADE, PRIMARY KEY(trackId))",
+        "CREATE TABLE IF NOT EXISTS Track (id INTEGER PRIMARY KEY AUTOINCREMENT, playOrder INTEGER, length INTEGER, bpm INTEGER, year INTEGER, path TEXT, filename TEXT, bitrate INTEGER, bpmAnalyzed REAL, albumArtId INTEGER, fileBytes INTEGER, title TEXT, artist TEXT, album TEXT, genre TEXT, comment TEXT, label TEXT, composer TEXT, remixer TEXT, key INTEGER, rating INTEGER, albumArt TEXT, timeLastPlayed DATETIME, isPlayed BOOLEAN, fileType TEXT, isAnalyzed BOOLEAN, dateCreated DATETIME, dateAdded DATETIME, isAvailable BOOLEAN, isMetadataOfPackedTrackChanged BOOLEAN, isPerfomanceDataOfPackedTrackChanged BOOLEAN, playedIndicator INTEGER, isMetadataImported BOOLEAN, pdbImportKey INTEGER, streamingSource TEXT, uri TEXT, isBeatGridLocked BOOLEAN, originDatabaseUuid TEXT, originTrackId INTEGER, streamingFlags INTEGER, explicitLyrics BOOLEAN, lastEditTime DATETIME, FOREIGN KEY(albumArtId) REFERENCES AlbumArt(id) ON DELETE RESTRICT, CONSTRAINT C_path UNIQUE(path), CONSTRAINT C_originDatabaseUuid_originTrackId UNIQUE(originDatabaseUuid,originTrackId))",
+        "CREATE TABLE IF NOT EXISTS Pack (id INTEGER PRIMARY KEY AUTOINCREMENT, packId TEXT, changeLogDatabaseUuid TEXT, changeLogId INTEGER, lastPackTime DATETIME)",
+        "CREATE TABLE IF NOT EXISTS AlbumArt (id INTEGER PRIMARY KEY AUTOINCREMENT, hash TEXT, albumArt BLOB)",
+        "CREATE TABLE IF NOT EXISTS Information (id INTEGER PRIMARY KEY AUTOINCREMENT, uuid TEXT, schemaVersionMajor INTEGER, schemaVersionMinor INTEGER, schemaVersionPatch INTEGER, currentPlayedIndiciator INTEGER, lastRekordBoxLibraryImportReadCounter INTEGER)",
+    ],
+    # V2: Duplikat-Erkennung (modules/fingerprint.py)
+    2: [
+        "ALTER TABLE songs ADD COLUMN content_hash TEXT",
+        "ALTER TABLE songs ADD COLUMN fingerprint BLOB",
+        "ALTER TABLE songs ADD COLUMN recording_id INTEGER",
+        "CREATE INDEX IF NOT EXISTS index_songs_content_hash ON songs (content_hash)",
+        "CREATE INDEX IF NOT EXISTS index_songs_recording_id ON songs (recording_id)",
+        "CREATE TABLE IF NOT EXISTS fingerprint_lsh (band INTEGER NOT NULL, bucket INTEGER NOT NULL, song_id INTEGER NOT NULL, PRIMARY KEY (band, bucket, song_id)) WITHOUT ROWID",
+    ],
+    # V3: fertige PerformanceData-Blobs aus der Analyse (modules/engine_blobs.py)
+    3: [
+        "ALTER TABLE songs ADD COLUMN track_data BLOB",
+        "ALTER TABLE songs ADD COLUMN beat_data BLOB",
+        "ALTER TABLE songs ADD COLUMN quick_cues BLOB",
+        "ALTER TABLE songs ADD COLUMN overview_waveform BLOB",
+    ],
+    # V4: Smartlists (modules/smartlist.py) - Regel-Indizes, Set-Historie, materialisierte Listen
+    4: [
+        "CREATE INDEX IF NOT EXISTS index_songs_key_bpm_energy ON songs (camelot_key, bpm, energy_norm)",
+        "CREATE INDEX IF NOT EXISTS index_songs_bpm_energy ON songs (bpm, energy_norm)",
+        "CREATE INDEX IF NOT EXISTS index_songs_energy ON songs (energy_avg, energy_norm)",
+        "CREATE TABLE IF NOT EXISTS sets (id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, created DATETIME)",
+        "CREATE TABLE IF NOT EXISTS set_history (set_id INTEGER NOT NULL, position INTEGER NOT NULL, song_id INTEGER NOT NULL, recording_id INTEGER NOT NULL, PRIMARY KEY (set_id, position)) WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS index_set_history_recording ON set_history (recording_id, set_id)",
+        "CREATE TABLE IF NOT EXISTS smartlist_tracks (listUuid TEXT NOT NULL, song_id INTEGER NOT NULL, PRIMARY KEY (listUuid, song_id)) WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS smartlist_state (listUuid TEXT PRIMARY KEY, rules TEXT, song_mark INTEGER, set_mark INTEGER)",
+        "CREATE TABLE IF NOT EXISTS smartlist_meta (key TEXT PRIMARY KEY, value INTEGER)",
+    ],
+}
+
+ENGINE_MIGRATIONS = {
+    # V1: Stand von Phase 5 (V15). Läuft immer auf einer frischen Library-Kopie ohne
+    # Engine-Objekte - daher keine DROPs, nur idempotente CREATE ... IF NOT EXISTS.
+    1: [
+        "CREATE INDEX IF NOT EXISTS index_PreparelistEntity_trackId ON PreparelistEntity ( trackId)",
+        "CREATE INDEX IF NOT EXISTS index_PlaylistEntity_nextEntityId_listId ON PlaylistEntity ( nextEntityId, listId)",
+        "CREATE INDEX IF NOT EXISTS index_Track_bpmAnalyzed ON Track(CAST(bpmAnalyzed + 0.5 AS int))",
+        "CREATE INDEX IF NOT EXISTS index_Track_album ON Track ( album)",
+        "CREATE INDEX IF NOT EXISTS index_Track_artist ON Track ( artist)",
+        "CREATE INDEX IF NOT EXISTS index_Track_genre ON Track ( genre)",
+        "CREATE INDEX IF NOT EXISTS index_Track_dateAdded ON Track ( dateAdded)",
+        "CREATE INDEX IF NOT EXISTS index_Track_year ON Track ( year)",
+        "CREATE INDEX IF NOT EXISTS index_Track_rating ON Track ( rating)",
+        "CREATE INDEX IF NOT EXISTS index_Track_length ON Track ( length)",
+        "CREATE INDEX IF NOT EXISTS index_Track_title ON Track ( title)",
+        "CREATE INDEX IF NOT EXISTS index_Track_uri ON Track ( uri)",
+        "CREATE INDEX IF NOT EXISTS index_Track_albumArtId ON Track ( albumArtId)",
+        "CREATE INDEX IF NOT EXISTS index_Track_filename ON Track ( filename)",
+        "CREATE INDEX IF NOT EXISTS index_AlbumArt_hash ON AlbumArt ( hash)",
+        "CREATE TRIGGER IF NOT EXISTS trigger_before_delete_PlaylistEntity BEFORE DELETE ON PlaylistEntity WHEN OLD.trackId > 0 BEGIN  UPDATE PlaylistEntity SET   nextEntityId = OLD.nextEntityId  WHERE nextEntityId = OLD.id  AND listId = OLD.listId; END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_after_insert_isPersist AFTER INSERT ON Playlist  WHEN new.isPersisted = 1 BEGIN  UPDATE Playlist SET   isPersisted = 1  WHERE id IN (SELECT parentListId FROM PlaylistAllParent WHERE id=new.id); END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_after_update_isPersistChild AFTER UPDATE ON Playlist  WHEN old.isPersisted = 1  AND new.isPersisted = 0 BEGIN  UPDATE Playlist SET   isPersisted = 0  WHERE id IN (SELECT childListId FROM PlaylistAllChildren WHERE id=new.id); END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_after_update_isPersistParent AFTER UPDATE ON Playlist  WHEN (old.isPersisted = 0  AND new.isPersisted = 1)  OR (old.parentListId != new.parentListId  AND new.isPersisted = 1) BEGIN  UPDATE Playlist SET   isPersisted = 1  WHERE id IN (SELECT parentListId FROM PlaylistAllParent WHERE id=new.id); END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_after_delete_List AFTER DELETE ON Playlist FOR EACH ROW BEGIN  UPDATE Playlist SET   nextListId = OLD.nextListId  WHERE nextListId = OLD.id;  DELETE FROM Playlist  WHERE parentListId = OLD.id; END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_after_insert_List AFTER INSERT ON Playlist FOR EACH ROW BEGIN  UPDATE Playlist SET   nextListId = NEW.id  WHERE nextListId = -(1 + NEW.nextListId)  AND parentListId = NEW.parentListId; END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_before_insert_List BEFORE INSERT ON Playlist FOR EACH ROW BEGIN  UPDATE Playlist SET   nextListId = -(1 + nextListId)  WHERE nextListId = NEW.nextListId  AND parentListId = NEW.parentListId; END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_PerformanceData_after_update_Track_timestamp  AFTER UPDATE OF trackData, isAnalyzed, overviewWaveFormData, beatData, quickCues, loops, activeOnLoadLoops  ON PerformanceData  FOR EACH ROW BEGIN  UPDATE Track  SET lastEditTime = strftime('%s')  WHERE id = NEW.trackId; END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_after_insert_Track_insert_performance_data AFTER INSERT ON Track BEGIN  INSERT INTO PerformanceData(trackId) VALUES(NEW.id); END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_after_update_only_Track_timestamp  AFTER UPDATE OF length, bpm, year, filename, bitrate, bpmAnalyzed, albumArtId,  title, artist, album, genre, comment, label, composer, remixer, key, rating, albumArt,  fileType, isAnalyzed, isBeatgridLocked, explicitLyrics  ON Track  FOR EACH ROW BEGIN  UPDATE Track SET lastEditTime = strftime('%s') WHERE ROWID=NEW.ROWID; END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_after_update_Track_fix_origin AFTER UPDATE ON Track  WHEN IFNULL(NEW.originTrackId, 0) = 0  OR IFNULL(NEW.originDatabaseUuid, '') = '' BEGIN  UPDATE Track SET   originTrackId = NEW.id,   originDatabaseUuid = (SELECT uuid FROM Information)  WHERE track.id = NEW.id; END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_after_insert_Track_fix_origin AFTER INSERT ON Track  WHEN IFNULL(NEW.originTrackId, 0) = 0  OR IFNULL(NEW.originDatabaseUuid, '') = '' BEGIN  UPDATE Track SET   originTrackId = NEW.id,   originDatabaseUuid = (SELECT uuid FROM Information)  WHERE track.id = NEW.id; END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_after_update_Track_check_Id BEFORE UPDATE ON Track  WHEN NEW.id <> OLD.id BEGIN  SELECT RAISE(ABORT, 'Changing track id''s are not allowed'); END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_after_insert_Track_check_id AFTER INSERT ON Track  WHEN NEW.id <= (SELECT seq FROM sqlite_sequence WHERE name = 'Track') BEGIN  SELECT RAISE(ABORT, 'Recycling deleted track id''s are not allowed'); END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_after_insert_Pack_changeLogId AFTER INSERT ON Pack FOR EACH ROW WHEN NEW.changeLogId = 0 BEGIN  UPDATE Pack SET changeLogId = 1 WHERE ROWID = NEW.ROWID; END",
+        "CREATE TRIGGER IF NOT EXISTS trigger_after_insert_Pack_timestamp AFTER INSERT ON Pack FOR EACH ROW WHEN NEW.lastPackTime IS NULL BEGIN  UPDATE Pack SET lastPackTime = strftime('%s') WHERE ROWID = NEW.ROWID; END",
+        "CREATE VIEW IF NOT EXISTS PlaylistAllParent AS WITH FindAllParent AS (  SELECT id, parentListId FROM Playlist  UNION ALL  SELECT recursiveCTE.id, Plist.parentListId FROM Playlist Plist  INNER JOIN FindAllParent recursiveCTE  ON recursiveCTE.parentListId = Plist.id ) SELECT * FROM FindAllParent",
+        "CREATE VIEW IF NOT EXISTS ChangeLog (id, trackId) AS SELECT 0, 0 WHERE FALSE",
+    ],
+}
+
+def get_versions(conn):
+    """Liefert (library_version, engine_version) aus PRAGMA user_version."""
+    raw = conn.execute("PRAGMA user_version").fetchone()[0]
+    return raw & 0xFFFF, (raw >> 16) & 0xFFFF
+
+
+def _set_versions(conn, library_version, engine_version):
+    packed = (engine_version << 16) | library_version
+    # PRAGMA kennt keine Parameter -> int() sichert die Formatierung ab
+    conn.execute(f"PRAGMA user_version = {int(packed)}")
+
+
+def _migrate(conn, layer, migrations, target):
+    """Spielt fehlende Migrationen einer Ebene in EINER Transaktion ein. False = nichts zu tun."""
+    lib_v, eng_v = get_versions(conn)
+    current = lib_v if layer == "library" else eng_v
+    if current >= target: return False
+
+    own_tx = not conn.in_transaction
+    with tracing.span("db.migrate", layer=layer, source=current, target=target):
+        if own_tx: conn.execute("BEGIN IMMEDIATE")
+        try:
+            for version in range(current + 1, target + 1):
+                for stmt in migrations.get(version, []):
+                    conn.execute(stmt)
+            if layer == "library": lib_v = target
+            else: eng_v = target
+            _set_versions(conn, lib_v, eng_v)
+            if own_tx: conn.commit()
+        except Exception:
+            if own_tx: conn.rollback()
+            raise
+    return True
+
+
+def ensure_library_schema(conn):
+    """Tabellen der Library-DB anlegen/migrieren (nur wenn die Version abweicht)."""
+    return _migrate(conn, "library", LIBRARY_MIGRATIONS, LIBRARY_SCHEMA_VERSION)
+
+
+def ensure_engine_objects(conn):
+    """Denon-Indizes, -Trigger und -Views anlegen (nur wenn die Version abweicht)."""
+    return _migrate(conn, "engine", ENGINE_MIGRATIONS, ENGINE_SCHEMA_VERSION)
@@ -1,71 +1,309 @@
+import ctypes
+import ctypes.util
 import subprocess
 import os
+import time
+from modules import tracing
+
+MOUNT_BASE = "/mnt/denon"
+# Wer eine dieser Partitionen trägt, ist die System-Platte - nie als Stick anfassen
+SYSTEM_MOUNTS = ("/", "/boot", "/boot/firmware")
+
+
+def mount_point_for(device, base=MOUNT_BASE):
+    """Eigener Mount-Punkt pro Partition für den Mehr-Stick-Betrieb, z.B. /mnt/denon-sdb1."""
+    return f"{base}-{os.path.basename(device)}"
+
 
 class SmartUSBMount:
-    def __init__(self, mount_point="/mnt/denon"):
+    def __init__(self, mount_point=MOUNT_BASE, sysfs_root="/sys", proc_root="/proc", dev_root="/dev", device=None):
         self.mount_point = mount_point
+        # Fest vorgegebene Partition (Orchestrator); None = erste gefundene
+        self.wanted = device
         self.device = None
         self.last_error = ""
+        self.last_eject = None
+        # Wurzeln injizierbar, damit die Logik gegen einen Fake-Baum laufen kann
+        self.sysfs_root = sysfs_root
+        self.proc_root = proc_root
+        self.dev_root = dev_root
 
-    def find_usb_device(self):
+    @property
+    def mountinfo_path(self):
+        return os.path.join(self.proc_root, "self", "mountinfo")
+
+    def _read_sys(self, *parts):
+        try:
+            with open(os.path.join(self.sysfs_root, *parts)) as f: return f.read().strip()
+        except OSError:
+            return None
+
+    def _system_devices(self):
+        """
+        (maj:min-Menge, Quell-Pfade) der Geräte hinter /, /boot, /boot/firmware und Swap.
+        Eine Platte mit so einer Partition ist System-Platte (z.B. Root auf USB-SSD) und kein Stick;
+        anderswo gemountete Sticks (Desktop-Automount unter /media/<user>) bleiben Kandidaten.
+        """
+        majmins, sources = set(), set()
+        try:
+            with open(self.mountinfo_path) as f:
+                for line in f:
+                    left, _, right = line.partition(" - ")
+                    fields = left.split()
+                    if len(fields) < 6: continue
+                    if fields[4].replace("\\040", " ") not in SYSTEM_MOUNTS: continue
+                    majmins.add(fields[2])
+                    source = (right.split() + ["", ""])[1]
+                    if source.startswith("/"): sources.add(os.path.realpath(source))
+        except OSError:
+            pass
+        try:
+            with open(os.path.join(self.proc_root, "swaps")) as f:
+                for line in f.readlines()[1:]:
+                    source = line.split()[0] if line.split() else ""
+                    if source.startswith("/"): sources.add(os.path.realpath(source.replace("\\040", " ")))
+        except OSError:
+            pass
+        return majmins, sources
+
+    def list_usb_partitions(self):
         """
-        Sucht nach dem Stick mit der 'Flat-List' Logik (-l),
-        um Baum-Grafiken (wie └─) zu vermeiden.
+        Liest /sys/block direkt: alle Partitionen von Wechseldatenträgern
+        (removable=1 oder am USB-Bus, z.B. SSD-Gehäuse), ohne leere Kartenleser
+        und ohne System-Platten (Root, Boot, Swap).
+        Liefert Liste von (device, 'maj:min').
         """
+        block_dir = os.path.join(self.sysfs_root, "block")
+        found = []
+        try:
+            disks = sorted(os.listdir(block_dir))
+        except OSError:
+            return found   # kein sysfs (Container, macOS) -> keine Sticks statt Absturz
+        system_majmins, system_sources = self._system_devices()
+        for disk in disks:
+            if disk.startswith(("loop", "ram", "zram", "dm-", "md")): continue
+            removable = self._read_sys("block", disk, "removable") == "1"
+            on_usb = "/usb" in os.path.realpath(os.path.join(block_dir, disk))
+            if not (removable or on_usb): continue
+            if self._read_sys("block", disk, "size") in (None, "0"): continue
+            disk_dir = os.path.join(block_dir, disk)
+            try: entries = sorted(os.listdir(disk_dir))
+            except OSError: continue   # Stick während der Suche abgezogen
+            parts = [(os.path.join(self.dev_root, part), self._read_sys("block", disk, part, "dev"))
+                     for part in entries if os.path.exists(os.path.join(disk_dir, part, "partition"))]
+            devices = parts + [(os.path.join(self.dev_root, disk), self._read_sys("block", disk, "dev"))]
+            if any(mm in system_majmins or os.path.realpath(dev) in system_sources for dev, mm in devices):
+                continue
+            found.extend(parts)
+        return found
+
+    def _find_via_lsblk(self):
+        # Fallback ohne sysfs (z.B. Container); -l flach, -n ohne Kopf, -p voller Pfad
+        output = subprocess.check_output(["lsblk", "-lnpo", "NAME,RM,TYPE,FSTYPE"]).decode().splitlines()
+        for line in output:
+            parts = line.split()
+            if len(parts) < 3: continue
+            if parts[1] == "1" and parts[2] == "part": return parts[0]
+        return None
+
+    def disk_name(self, majmin):
+        """Name der ganzen Platte (z.B. 'sdb') zu einer Partition - Partitionen einer Platte teilen sich den Bus."""
+        disk_dir = self._disk_dir(majmin)
+        return os.path.basename(disk_dir) if disk_dir else None
+
+    def find_usb_device(self):
+        """Sucht die erste (bzw. die vorgegebene) Partition eines Wechseldatenträgers (sysfs, Fallback lsblk)."""
+        self.device_id = None
         try:
-            # -l steht für 'list' (flaches Format ohne Baum-Grafik)
-            # -n für keine Überschriften
-            # -p für vollen Pfad (/dev/sda1 statt sda1)
-            cmd = "lsblk -lnpo NAME,RM,TYPE,FSTYPE"
-            output = subprocess.check_output(cmd, shell=True).decode().splitlines()
-            
-            for line in output:
-                parts = line.split()
-                if len(parts) < 3: continue
-                
-                # Jetzt sind die Pfade sauber, z.B. '/dev/sda1'
-                name = parts[0]
-                is_removable = parts[1] == "1"
-                is_partition = parts[2] == "part"
-                
-                if is_removable and is_partition:
-                    self.device = name
+            if os.path.isdir(os.path.join(self.sysfs_root, "block")):
+                parts = self.list_usb_partitions()
+                if self.wanted:
+                    parts = [p for p in parts if os.path.realpath(p[0]) == os.path.realpath(self.wanted)]
+                if parts:
+                    self.device, self.device_id = parts[0]
+                    return self.device
+            else:
+                dev = self.wanted or self._find_via_lsblk()
+                if dev:
+                    self.device = dev
                     return self.device
-            
-            self.last_error = "Kein wechselbarer Datenträger gefunden."
+
+            self.last_error = f"Datenträger {self.wanted} nicht gefunden." if self.wanted else "Kein wechselbarer Datenträger gefunden."
             return None
         except Exception as e:
             self.last_error = f"Hardware-Suche Fehler: {str(e)}"
             return None
 
+    def _is_current(self, mount, device):
+        """Ist genau dieses Gerät bereits RW am Mount-Punkt eingehängt?"""
+        if not mount: return False
+        source, _, options, majmin = mount
+        same = (self.device_id and majmin == self.device_id) or os.path.realpath(source) == os.path.realpath(device)
+        return bool(same) and "rw" in options.split(",")
+
+    def _run(self, cmd, **kw):
+        """subprocess.run mit Span (Dauer + Returncode landen im Trace)."""
+        with tracing.span("subprocess", cmd=" ".join(cmd[:3])) as sp:
+            result = subprocess.run(cmd, **kw)
+            sp.set(returncode=result.returncode)
+            return result
+
     def mount(self):
+        with tracing.span("usb.mount", mount_point=self.mount_point) as sp:
+            ok, msg = self._mount()
+            sp.set(ok=ok, device=self.device)
+            return ok, msg
+
+    def _mount(self):
         device = self.find_usb_device()
         if not device:
             return False, self.last_error
 
+        # 0. Schon richtig gemountet? Dann nichts anfassen (kein sudo, kein Schreibtest)
+        current = self.current_mount()
+        if self._is_current(current, device):
+            return True, f"Stick {device} ist bereits RW gemountet."
+
         # 1. Mount-Punkt aufräumen
         if not os.path.exists(self.mount_point):
-            subprocess.run(["sudo", "mkdir", "-p", self.mount_point])
-        
+            if self._run(["sudo", "mkdir", "-p", self.mount_point]).returncode != 0 or not os.path.isdir(self.mount_point):
+                return False, f"Mount-Punkt {self.mount_point} konnte nicht angelegt werden."
+
         # Sicherstellen, dass der Ordner dir gehört, falls der Mount fehlschlägt
-        subprocess.run(["sudo", "chown", "1000:1000", self.mount_point])
+        if current is None and os.stat(self.mount_point).st_uid != 1000:
+            self._run(["sudo", "chown", "1000:1000", self.mount_point])
 
-        # Aushängen erzwingen
-        subprocess.run(["sudo", "umount", "-l", self.mount_point], stderr=subprocess.DEVNULL)
+        # Aushängen nur, wenn dort etwas (Falsches/RO) hängt. Kein "-l": ein lazy umount meldet Erfolg,
+        # obwohl noch Dateien offen sind, und der neue Mount liegt dann über einem halb geschriebenen Stick
+        if current is not None:
+            result = self._run(["sudo", "umount", self.mount_point], capture_output=True, text=True)
+            if result.returncode != 0:
+                return False, f"{self.mount_point} ist noch belegt ({result.stderr.strip() or result.returncode}) - offene Dateien schließen und erneut versuchen."
 
         # 2. Der saubere Mount-Befehl
         mount_cmd = [
             "sudo", "mount", device, self.mount_point,
             "-o", "rw,uid=1000,gid=1000,umask=000,nofail"
         ]
-        
-        result = subprocess.run(mount_cmd)
-        
+
+        result = self._run(mount_cmd)
+
         if result.returncode == 0:
             return self.health_check()
         else:
             return False, f"Mount fehlgeschlagen für {device}. Prüfe Dateisystem!"
 
+    def current_mount(self, mountinfo_path=None):
+        """
+        Liest die Mount-Tabelle direkt (ohne Subprozess).
+        Liefert (device, fstype, options, 'maj:min') für den Mount-Punkt oder None.
+        """
+        target = os.path.realpath(self.mount_point)
+        found = None
+        try:
+            with open(mountinfo_path or self.mountinfo_path) as f:
+                for line in f:
+                    # <id> <parent> <maj:min> <root> <mountpoint> <opts> [optional...] - <fstype> <source> <superopts>
+                    left, _, right = line.partition(" - ")
+                    fields = left.split()
+                    if len(fields) < 6: continue
+                    mnt = fields[4].replace("\\040", " ")
+                    if mnt != target: continue
+                    fstype, source, *rest = right.split() + [""]
+                    found = (source, fstype, fields[5], fields[2])   # letzter Eintrag gewinnt (Overmounts)
+        except OSError:
+            return None
+        return found
+
+    def _disk_dir(self, majmin):
+        """sysfs-Verzeichnis der ganzen Platte zu einer Partition (maj:min)."""
+        if not majmin: return None
+        path = os.path.realpath(os.path.join(self.sysfs_root, "dev", "block", majmin))
+        if os.path.exists(os.path.join(path, "partition")): path = os.path.dirname(path)
+        return path if os.path.isdir(path) else None
+
+    def _disk_counters(self, disk_dir):
+        """(laufende Schreib-I/Os, geschriebene Sektoren) aus inflight/stat der Platte."""
+        try:
+            with open(os.path.join(disk_dir, "inflight")) as f: writes_inflight = int(f.read().split()[1])
+            with open(os.path.join(disk_dir, "stat")) as f: sectors_written = int(f.read().split()[6])
+            return writes_inflight, sectors_written
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def _syncfs(self):
+        """Nur das Dateisystem des Sticks flushen (syncfs), nicht alle Geräte wie `sync`."""
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = os.open(self.mount_point, os.O_RDONLY)
+        try:
+            if libc.syncfs(fd) != 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+        finally:
+            os.close(fd)
+
+    def eject(self, paths=(), timeout=30.0, poll=0.1):
+        """
+        Sicheres Auswerfen: geschriebene Dateien gezielt fsyncen, syncfs auf den Stick,
+        warten bis die Schreib-Queue der Platte leer ist, dann NICHT-lazy aushängen.
+        Liefert (ok, msg); Messwerte in self.last_eject.
+        """
+        with tracing.span("usb.eject", mount_point=self.mount_point) as sp:
+            ok, msg = self._eject(paths, timeout, poll)
+            sp.set(ok=ok, **(self.last_eject or {}))
+            return ok, msg
+
+    def _eject(self, paths, timeout, poll):
+        current = self.current_mount()
+        if current is None:
+            return True, f"Nichts gemountet auf {self.mount_point}."
+        stats = {"device": current[0], "flush_sec": None, "bytes_written": None, "fsynced": 0}
+        self.last_eject = stats
+        disk_dir = self._disk_dir(current[3])
+        before = self._disk_counters(disk_dir) if disk_dir else None
+        t0 = time.monotonic()
+
+        # 1. Nur unsere Dateien auf dem Stick
+        prefix = os.path.join(os.path.realpath(self.mount_point), "")
+        for path in paths:
+            if not path or not os.path.realpath(path).startswith(prefix): continue
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try: os.fsync(fd)
+                finally: os.close(fd)
+                stats["fsynced"] += 1
+            except OSError:
+                pass
+
+        # 2. Rest des Dateisystems (Verzeichniseinträge, FAT)
+        try:
+            self._syncfs()
+        except (OSError, AttributeError) as e:
+            return False, f"syncfs fehlgeschlagen: {e}"
+
+        # 3. Warten bis die Platte nichts mehr schreibt (inflight 0, Sektorzähler stabil)
+        after = before
+        if before:
+            deadline = t0 + timeout
+            while time.monotonic() < deadline:
+                counters = self._disk_counters(disk_dir)
+                if counters is None: break
+                settled = counters[0] == 0 and counters[1] == after[1]
+                after = counters
+                if settled: break
+                time.sleep(poll)
+            else:
+                return False, f"Stick schreibt nach {timeout:.0f}s immer noch - NICHT abziehen!"
+            stats["bytes_written"] = (after[1] - before[1]) * 512
+        stats["flush_sec"] = round(time.monotonic() - t0, 3)
+
+        # 4. Echtes umount: schlägt fehl statt zu lügen, solange etwas offen ist
+        result = self._run(["sudo", "umount", self.mount_point], capture_output=True, text=True)
+        if result.returncode != 0:
+            return False, f"Umount fehlgeschlagen ({result.stderr.strip() or result.returncode}) - Stick noch in Benutzung?"
+        written = f", {stats['bytes_written'] / 1e6:.1f} MB geschrieben" if stats["bytes_written"] is not None else ""
+        return True, f"Stick {current[0]} sicher entfernt (Flush {stats['flush_sec']:.2f}s{written})."
+
     def health_check(self):
         test_file = os.path.join(self.mount_point, ".write_test")
         try:
@@ -0,0 +1,251 @@
+import argparse
+import json
+import math
+import re
+import time
+import uuid
+from datetime import datetime
+
+from modules import db_access, tracing
+
+# Regeln liegen als JSON in Smartlist.rules; "v" markiert unser Format (Engine-eigene Smartlists bleiben unberührt)
+RULES_VERSION = 1
+ENERGY_LEVELS = 10
+
+_RANGE = r"(\d+(?:\.\d+)?)\s*(?:-|–|\.\.)\s*(\d+(?:\.\d+)?)"
+_CMP = r"(>=|<=|≥|≤|>|<|=)"
+_CMP_OPS = {"≥": ">=", "≤": "<="}
+_CLAUSES = [
+    ("bpm", re.compile(r"^(?:bpm\s*)?" + _RANGE + r"(?:\s*bpm)?$")),
+    ("bpm_cmp", re.compile(r"^bpm\s*" + _CMP + r"\s*(\d+(?:\.\d+)?)$")),
+    ("key", re.compile(r"^(?:key\s*)?(\d{1,2}[ab])(?:\s*(?:±|\+-|\+/-)\s*(\d))?$")),
+    ("energy", re.compile(r"^energy\s*" + _RANGE + "$")),
+    ("energy_cmp", re.compile(r"^energy\s*" + _CMP + r"\s*(\d+)$")),
+    ("history", re.compile(r"^not played(?: in)?(?: (?:the )?last)?\s*(\d+)(?: sets?)?$")),
+]
+
+
+def parse_rules(text):
+    """
+    Kurzschreibweise -> Regel-Dict, z.B. "124-128 BPM, 8A±1, energy >= 7, not played in last 3 sets".
+    Unbekannte Klauseln sind ein Fehler (ValueError), damit Tippfehler nicht still alles matchen.
+    """
+    rules = {"v": RULES_VERSION}
+    for clause in filter(None, (c.strip().lower() for c in text.split(","))):
+        for kind, pattern in _CLAUSES:
+            m = pattern.match(clause)
+            if m: break
+        else:
+            raise ValueError(f"Unbekannte Regel: '{clause}'")
+        if kind == "bpm":
+            rules["bpm_min"], rules["bpm_max"] = sorted((float(m.group(1)), float(m.group(2))))
+        elif kind == "energy":
+            rules["energy_min"], rules["energy_max"] = sorted((int(float(m.group(1))), int(float(m.group(2)))))
+        elif kind in ("bpm_cmp", "energy_cmp"):
+            field, op, value = kind[:-4], _CMP_OPS.get(m.group(1), m.group(1)), float(m.group(2))
+            # Grenzen sind inklusiv (>=/<=); ">"/"<" schließen den Wert aus: Energie ganzzahlig um 1,
+            # BPM (kontinuierlich) um die nächste darstellbare Zahl
+            if field == "energy":
+                value = int(value)
+                above, below = value + 1, value - 1
+            else:
+                above, below = math.nextafter(value, math.inf), math.nextafter(value, -math.inf)
+            if op in (">=", "="): rules[f"{field}_min"] = value
+            if op == ">": rules[f"{field}_min"] = above
+            if op in ("<=", "="): rules[f"{field}_max"] = value
+            if op == "<": rules[f"{field}_max"] = below
+        elif kind == "key":
+            rules["key"] = m.group(1).upper()
+            rules["key_range"] = int(m.group(2) or 0)
+        elif kind == "history":
+            rules["not_played_sets"] = int(m.group(1))
+    return rules
+
+
+def camelot_neighbours(key, spread):
+    """8A ±1 -> [7A, 8A, 9A] (Kreis: 12 -> 1)."""
+    num, mode = int(key[:-1]), key[-1].upper()
+    spread = min(spread, 6)
+    return sorted({f"{(num - 1 + d) % 12 + 1}{mode}" for d in range(-spread, spread + 1)})
+
+
+def compile_rules(rules):
+    """
+    Regel-Dict -> (WHERE-SQL über songs s, Parameter, Abhängigkeiten).
+    Tonart + BPM laufen über index_songs_key_bpm_energy, reine BPM-Regeln über index_songs_bpm_energy.
+    """
+    where, params, deps = ["s.bpm > 0"], [], set()
+    if rules.get("key"):
+        keys = camelot_neighbours(rules["key"], rules.get("key_range", 0))
+        where.append(f"s.camelot_key IN ({','.join('?' * len(keys))})"); params += keys
+    if rules.get("bpm_min") is not None: where.append("s.bpm >= ?"); params.append(rules["bpm_min"])
+    if rules.get("bpm_max") is not None: where.append("s.bpm <= ?"); params.append(rules["bpm_max"])
+    lo, hi = rules.get("energy_min"), rules.get("energy_max")
+    if lo is not None or hi is not None:
+        deps.add("energy")
+        where.append("s.energy_norm BETWEEN ? AND ?")
+        # "is None" statt "or": eine 0 als Grenze ist gültig ("energy < 1" matcht nichts)
+        params += [1 if lo is None else lo, ENERGY_LEVELS if hi is None else hi]
+    if rules.get("not_played_sets"):
+        deps.add("history")
+        # Gespielt = in einem der letzten N generierten Sets; Duplikate zählen über die recording_id mit
+        where.append("""NOT EXISTS (SELECT 1 FROM set_history h
+            WHERE h.recording_id = COALESCE(s.recording_id, s.id)
+              AND h.set_id >= (SELECT COALESCE(MIN(id), 0) FROM (SELECT id FROM sets ORDER BY id DESC LIMIT ?)))""")
+        params.append(int(rules["not_played_sets"]))
+    return " AND ".join(where), params, deps
+
+
+def update_energy_norm(conn):
+    """
+    energy_norm = Energie-Dezil 1..10 über die ganze Library (statt fix 5 aus dem Scan).
+    Schreibt nur geänderte Zeilen; liefert die kleinste betroffene Song-ID oder None.
+    Songs kommen nur hinzu -> ohne neue Songs (Anzahl + höchste ID gleich) bleiben die Dezile stehen.
+    """
+    library = conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM songs").fetchone()
+    meta = dict(conn.execute("SELECT key, value FROM smartlist_meta WHERE key IN ('energy_songs', 'energy_mark')"))
+    if (meta.get("energy_songs"), meta.get("energy_mark")) == library: return None
+    conn.executemany("INSERT OR REPLACE INTO smartlist_meta (key, value) VALUES (?, ?)",
+                     [("energy_songs", library[0]), ("energy_mark", library[1])])
+    changed = conn.execute(f"""
+        SELECT id, n FROM (
+            SELECT id, energy_norm, NTILE({ENERGY_LEVELS}) OVER (ORDER BY energy_avg, id) AS n
+            FROM songs WHERE energy_avg IS NOT NULL
+        ) WHERE energy_norm IS NOT n
+    """).fetchall()
+    if not changed: return None
+    conn.executemany("UPDATE songs SET energy_norm = ? WHERE id = ?", [(n, song_id) for song_id, n in changed])
+    return min(song_id for song_id, _ in changed)
+
+
+def _load_rules(raw):
+    try: rules = json.loads(raw or "")
+    except ValueError: return None
+    return rules if isinstance(rules, dict) and rules.get("v") == RULES_VERSION else None
+
+
+def is_own(raw):
+    """True, wenn Smartlist.rules unser JSON-Format ist (nicht das der Engine)."""
+    return _load_rules(raw) is not None
+
+
+def refresh(conn):
+    """
+    Alle Smartlists nach einem Scan nachziehen. Komplett neu nur, wenn sich die Regel, ein
+    Energie-Dezil bereits erfasster Songs oder (bei Historien-Regeln) die Set-Historie geändert hat;
+    sonst werden nur Songs oberhalb der Wasserstandsmarke geprüft.
+    """
+    t0 = time.perf_counter()
+    stats = {"lists": 0, "full": 0, "incremental": 0, "energy_changed": False}
+    with tracing.span("smartlist.refresh") as sp:
+        lowest_energy = update_energy_norm(conn)
+        stats["energy_changed"] = lowest_energy is not None
+        song_mark = conn.execute("SELECT COALESCE(MAX(id), 0) FROM songs").fetchone()[0]
+        set_mark = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sets").fetchone()[0]
+        states = {row[0]: row[1:] for row in conn.execute("SELECT listUuid, rules, song_mark, set_mark FROM smartlist_state")}
+        for list_uuid, raw in conn.execute("SELECT listUuid, rules FROM Smartlist").fetchall():
+            rules = _load_rules(raw)
+            if rules is None: continue
+            stats["lists"] += 1
+            where, params, deps = compile_rules(rules)
+            state = states.get(list_uuid)
+            full = (state is None or state[0] != raw or state[1] > song_mark
+                    or ("energy" in deps and lowest_energy is not None and lowest_energy <= state[1])
+                    or ("history" in deps and state[2] != set_mark))
+            if full:
+                conn.execute("DELETE FROM smartlist_tracks WHERE listUuid = ?", (list_uuid,))
+                conn.execute(f"INSERT INTO smartlist_tracks (listUuid, song_id) SELECT ?, s.id FROM songs s WHERE {where}",
+                             [list_uuid] + params)
+                stats["full"] += 1
+            elif song_mark > state[1]:
+                conn.execute(f"INSERT OR IGNORE INTO smartlist_tracks (listUuid, song_id) SELECT ?, s.id FROM songs s WHERE s.id > ? AND {where}",
+                             [list_uuid, state[1]] + params)
+                stats["incremental"] += 1
+            else:
+                continue
+            conn.execute("INSERT OR REPLACE INTO smartlist_state (listUuid, rules, song_mark, set_mark) VALUES (?, ?, ?, ?)",
+                         (list_uuid, raw, song_mark, set_mark))
+        # Gelöschte Smartlists
+        conn.execute("DELETE FROM smartlist_tracks WHERE listUuid NOT IN (SELECT listUuid FROM Smartlist)")
+        conn.execute("DELETE FROM smartlist_state WHERE listUuid NOT IN (SELECT listUuid FROM Smartlist)")
+        conn.commit()
+        stats["ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        sp.set(**stats)
+    return stats
+
+
+def save(conn, title, rules):
+    """Smartlist anlegen oder ihre Regeln ersetzen (Titel ist eindeutig). Liefert die listUuid."""
+    raw = json.dumps(rules, sort_keys=True)
+    compile_rules(rules)   # ungültige Regeln gar nicht erst speichern
+    row = conn.execute("SELECT listUuid FROM Smartlist WHERE title = ? AND parentPlaylistPath = ''", (title,)).fetchone()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if row:
+        conn.execute("UPDATE Smartlist SET rules = ?, lastEditTime = ? WHERE listUuid = ?", (raw, now, row[0]))
+        list_uuid = row[0]
+    else:
+        list_uuid = str(uuid.uuid4())
+        conn.execute("INSERT INTO Smartlist (listUuid, title, parentPlaylistPath, rules, lastEditTime) VALUES (?, ?, '', ?, ?)",
+                     (list_uuid, title, raw, now))
+    conn.commit()
+    return list_uuid
+
+
+def remove(conn, title):
+    cur = conn.execute("DELETE FROM Smartlist WHERE title = ? AND parentPlaylistPath = ''", (title,))
+    conn.commit()
+    return cur.rowcount > 0
+
+
+def song_ids(conn, title):
+    """Materialisierte Song-IDs einer Smartlist (leer, wenn es sie nicht gibt)."""
+    return {r[0] for r in conn.execute("""
+        SELECT t.song_id FROM Smartlist l JOIN smartlist_tracks t ON t.listUuid = l.listUuid
+        WHERE l.title = ?""", (title,))}
+
+
+def record_set(conn, title, playlist):
+    """Generiertes Set in die Historie ("not played in last N sets")."""
+    cur = conn.execute("INSERT INTO sets (title, created) VALUES (?, ?)", (title, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    rows = [(cur.lastrowid, pos, t['id'], t.get('recording_id') or t['id']) for pos, t in enumerate(playlist) if t.get('id')]
+    conn.executemany("INSERT INTO set_history (set_id, position, song_id, recording_id) VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    return cur.lastrowid
+
+
+def overview(conn):
+    """(Titel, Regeln, Anzahl Tracks) aller eigenen Smartlists."""
+    rows = conn.execute("""
+        SELECT l.title, l.rules, COUNT(t.song_id) FROM Smartlist l
+        LEFT JOIN smartlist_tracks t ON t.listUuid = l.listUuid
+        GROUP BY l.listUuid ORDER BY l.title""").fetchall()
+    return [(title, rules, count) for title, raw, count in rows if (rules := _load_rules(raw)) is not None]
+
+
+def main():
+    from modules.schema_manager import ensure_library_schema
+    parser = argparse.ArgumentParser(description="Regelbasierte Smartlists über die Analyse-Library")
+    parser.add_argument("db_path", help="Library-DB (…_ergebnisse/music_library_v3_final.db)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    add = sub.add_parser("add", help='z.B. add "Peak 8A" "124-128 BPM, 8A±1, energy >= 7, not played in last 3 sets"')
+    add.add_argument("title"); add.add_argument("rules")
+    rm = sub.add_parser("rm"); rm.add_argument("title")
+    sub.add_parser("list")
+    sub.add_parser("refresh")
+    args = parser.parse_args()
+
+    conn = db_access.connect(args.db_path, wal=True)
+    ensure_library_schema(conn)
+    if args.cmd == "add":
+        save(conn, args.title, parse_rules(args.rules))
+    elif args.cmd == "rm" and not remove(conn, args.title):
+        parser.exit(1, f"Keine Smartlist '{args.title}'\n")
+    if args.cmd in ("add", "rm", "refresh"):
+        print(json.dumps(refresh(conn)))
+    if args.cmd in ("add", "list"):
+        for title, rules, count in overview(conn):
+            print(f"{title}: {count} Tracks  {json.dumps(rules, sort_keys=True)}")
+
+
+if __name__ == "__main__":
+    main()
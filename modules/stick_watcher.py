@@ -0,0 +1,114 @@
+import argparse
+import os
+import select
+import shutil
+import subprocess
+import sys
+import time
+
+from modules.db_staging import is_locked
+from modules.smart_usb_mount import SmartUSBMount
+from modules.ui_cache import FolderTreeCache
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_SCRIPT = os.path.join(REPO_DIR, "main_workflow_v10.py")
+
+
+class StickWatcher:
+    """
+    Hintergrund-Wächter: erkennt einen frisch gemounteten Stick oder neue Dateien
+    und startet sofort einen inkrementellen Scan mit niedriger Priorität.
+    Ohne feste `folders` werden genau die Ordner vorab gescannt, die das UI anbietet
+    (ganzer Stick + jeder Top-Level-Ordner) - jeder landet wie im UI in <ordner>_ergebnisse.
+    """
+
+    def __init__(self, mount_point="/mnt/denon", folders=None, interval=5.0, niceness=10, workdir=None, mounter=None):
+        self.mounter = mounter or SmartUSBMount(mount_point)
+        self.folders = folders
+        self.interval = interval
+        self.niceness = niceness
+        self.workdir = workdir or REPO_DIR
+        self.tree = FolderTreeCache(quiet_window=0)
+        self._mounted = None
+        self._signatures = {}
+        self._proc = None
+        self._pending = []
+
+    def _scan_cmd(self, folder):
+        cmd = [sys.executable, "-u", BACKEND_SCRIPT, folder, "--scan-only", "--no-mount"]
+        # ionice idle: der Scan soll den Stick nur nutzen, wenn sonst niemand liest
+        if shutil.which("ionice"): cmd = ["ionice", "-c", "3"] + cmd
+        return cmd
+
+    def _start_scan(self, folder):
+        print(f"[WATCH] Starte Hintergrund-Scan (nice {self.niceness}): {folder}", flush=True)
+        niceness = self.niceness
+        self._proc = subprocess.Popen(self._scan_cmd(folder), cwd=self.workdir,
+                                      preexec_fn=lambda: os.nice(niceness))
+
+    def check(self):
+        """Ein Durchlauf: Mount-Status + Verzeichnis-mtimes prüfen, ggf. Scan einreihen/starten."""
+        mount = self.mounter.current_mount()
+        if mount != self._mounted:
+            if mount: print(f"[WATCH] Stick erkannt: {mount[0]} ({mount[1]}) auf {self.mounter.mount_point}", flush=True)
+            else: print("[WATCH] Stick entfernt.", flush=True)
+            self._mounted = mount
+            self._signatures.clear()
+            self.tree.invalidate()
+        if not mount: return
+
+        folders = self.folders or list(self.tree.music_folders(self.mounter.mount_point).values())
+        for folder in folders:
+            if not os.path.isdir(folder): continue
+            # Läuft schon ein Scan/Job auf dieser Library, nimmt der neue Dateien selbst mit
+            if is_locked(folder, "scan"): continue
+            sig = self.tree.signature(folder)
+            if self._signatures.get(folder) != sig:
+                self._signatures[folder] = sig
+                if folder not in self._pending: self._pending.append(folder)
+
+        if self._proc and self._proc.poll() is not None:
+            print(f"[WATCH] Scan beendet (Code {self._proc.returncode}).", flush=True)
+            self._proc = None
+        if not self._proc:
+            # Erst starten, wenn niemand sonst den Ordner scannt (sonst wartet unser Prozess nur am Lock)
+            ready = [f for f in self._pending if not is_locked(f, "scan")]
+            if ready:
+                self._pending.remove(ready[0])
+                self._start_scan(ready[0])
+
+    def run(self):
+        """Blockierende Schleife. Mount-Änderungen wecken sofort (POLLPRI auf mountinfo)."""
+        poller = None
+        try:
+            mi = open(self.mounter.mountinfo_path)
+            poller = select.poll()
+            poller.register(mi.fileno(), select.POLLPRI | select.POLLERR)
+        except (OSError, AttributeError):
+            mi = None
+        try:
+            while True:
+                self.check()
+                if poller:
+                    if poller.poll(self.interval * 1000):
+                        mi.seek(0); mi.read()   # Ereignis quittieren
+                else:
+                    time.sleep(self.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if mi: mi.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startet Scans automatisch, sobald ein Stick gemountet ist")
+    parser.add_argument("--mount-point", default="/mnt/denon")
+    parser.add_argument("--folder", action="append", help="Zu scannender Ordner (mehrfach möglich, Default: ganzer Stick + alle Top-Level-Ordner wie im UI)")
+    parser.add_argument("--interval", type=float, default=5.0)
+    parser.add_argument("--nice", type=int, default=10)
+    args = parser.parse_args()
+    StickWatcher(args.mount_point, args.folder, args.interval, args.nice).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import contextlib
+import contextvars
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRACE_FILE = os.path.join(REPO_DIR, "traces.jsonl")
+METRICS_FILE = os.path.join(REPO_DIR, "metrics.prom")
+TRACE_MAX_BYTES = 5 * 1024 * 1024
+TRACE_BACKUPS = 3
+
+# Sekunden-Buckets für Phasen und Einzel-Analysen (Prometheus "le")
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+HELP = {
+    "aidj_runs_total": ("counter", "Motor-Läufe nach Ergebnis"),
+    "aidj_tracks_analyzed_total": ("counter", "Analysierte Tracks (Phase 1)"),
+    "aidj_stick_bytes_written_total": ("counter", "Auf den Stick geschriebene Bytes"),
+    "aidj_analysis_seconds": ("histogram", "Analysezeit pro Track"),
+    "aidj_phase_seconds": ("histogram", "Dauer pro Phase"),
+}
+
+_current = contextvars.ContextVar("aidj_span", default=None)
+_write_lock = threading.Lock()
+_metrics_lock = threading.Lock()
+_pending = {}     # (name, labels) -> Delta seit dem letzten flush_metrics()
+
+
+class Span:
+    def __init__(self, name, parent, attrs):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent else None
+        self.depth = parent.depth + 1 if parent else 0
+        self.attrs = dict(attrs)
+        self.start = time.time()
+        self.duration = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def record(self, status, error=None):
+        rec = {"trace": self.trace_id, "span": self.span_id, "parent": self.parent_id, "depth": self.depth,
+               "name": self.name, "start": round(self.start, 6), "dur": round(self.duration, 6),
+               "status": status, "pid": os.getpid(), "attrs": self.attrs}
+        if error: rec["error"] = error
+        return rec
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """Verschachtelter Zeitabschnitt; landet beim Verlassen als JSON-Zeile in traces.jsonl."""
+    sp = Span(name, _current.get(), attrs)
+    token = _current.set(sp)
+    t0 = time.perf_counter()
+    status, error = "ok", None
+    try:
+        yield sp
+    except BaseException as e:
+        status, error = "error", f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        sp.duration = time.perf_counter() - t0
+        _current.reset(token)
+        _write(sp.record(status, error))
+
+
+@contextlib.contextmanager
+def phase(name, **attrs):
+    """Span für eine Workflow-Phase + Eintrag im Histogramm aidj_phase_seconds."""
+    t0 = time.perf_counter()
+    try:
+        with span(f"phase.{name}", **attrs) as sp:
+            yield sp
+    finally:
+        observe("aidj_phase_seconds", time.perf_counter() - t0, phase=name)
+
+
+def current_span():
+    return _current.get()
+
+
+def current_trace_id():
+    sp = _current.get()
+    return sp.trace_id if sp else None
+
+
+def _rotate(path):
+    for i in range(TRACE_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"): os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    os.replace(path, f"{path}.1")
+
+
+def _write(record, path=None):
+    path = path or TRACE_FILE
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    try:
+        with _write_lock, open(path, "a", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)   # Motor, Watcher-Scans und UI schreiben in dieselbe Datei
+            if f.tell() + len(line) > TRACE_MAX_BYTES:
+                _rotate(path)
+                with open(path, "a", encoding="utf-8") as fresh: fresh.write(line)
+            else:
+                f.write(line)
+    except OSError:
+        pass  # Tracing darf den Motor nie stoppen
+
+
+def timed(fn, *args):
+    """(fn(*args), Sekunden) - auch im Worker-Prozess nutzbar (picklebar)."""
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - t0
+
+
+# --- Metriken -----------------------------------------------------------------
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    with _metrics_lock:
+        key = (name, _labels(labels))
+        _pending[key] = _pending.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    with _metrics_lock:
+        key = (name, _labels(labels))
+        hist = _pending.setdefault(key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+        for i, le in enumerate(BUCKETS):
+            if value <= le: hist["buckets"][i] += 1
+        hist["sum"] += value
+        hist["count"] += 1
+
+
+def _merge(state, deltas):
+    for (name, labels), delta in deltas.items():
+        key = json.dumps([name, labels])
+        if isinstance(delta, dict):
+            cur = state.setdefault(key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+            cur["buckets"] = [a + b for a, b in zip(cur["buckets"], delta["buckets"])]
+            cur["sum"] += delta["sum"]; cur["count"] += delta["count"]
+        else:
+            state[key] = state.get(key, 0) + delta
+
+
+def _fmt_labels(labels, extra=None):
+    pairs = [f'{k}="{v}"' for k, v in labels] + ([extra] if extra else [])
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def render(state):
+    """Prometheus-Textformat aus dem akkumulierten Zustand."""
+    by_name = {}
+    for key, value in state.items():
+        name, labels = json.loads(key)
+        by_name.setdefault(name, []).append(([tuple(l) for l in labels], value))
+    out = []
+    for name in sorted(by_name):
+        kind, text = HELP.get(name, ("untyped", name))
+        out += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+        for labels, value in sorted(by_name[name]):
+            if isinstance(value, dict):
+                for le, count in list(zip(BUCKETS, value["buckets"])) + [("+Inf", value["count"])]:
+                    bucket = 'le="%s"' % le
+                    out.append(f"{name}_bucket{_fmt_labels(labels, bucket)} {count}")
+                out.append(f"{name}_sum{_fmt_labels(labels)} {value['sum']:.6f}")
+                out.append(f"{name}_count{_fmt_labels(labels)} {value['count']}")
+            else:
+                out.append(f"{name}{_fmt_labels(labels)} {value}")
+    return "\n".join(out) + "\n"
+
+
+def flush_metrics(path=None):
+    """Offene Deltas in den gemeinsamen Zustand mergen und metrics.prom atomar neu schreiben."""
+    path = path or METRICS_FILE
+    with _metrics_lock:
+        deltas = dict(_pending); _pending.clear()
+    if not deltas: return
+    state_path = path + ".json"
+    try:
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(state_path) as f: state = json.load(f)
+            except (OSError, ValueError):
+                state = {}
+            _merge(state, deltas)
+            for target, text in ((state_path, json.dumps(state)), (path, render(state))):
+                with open(target + ".tmp", "w") as f: f.write(text)
+                os.replace(target + ".tmp", target)
+    except OSError:
+        pass
+
+
+# --- Auswertung (UI) ----------------------------------------------------------
+
+def load_trace(trace_id, path=None):
+    """Alle Spans eines Laufs (auch aus rotierten Dateien), nach Startzeit sortiert."""
+    path = path or TRACE_FILE
+    spans = []
+    for candidate in [path] + [f"{path}.{i}" for i in range(1, TRACE_BACKUPS + 1)]:
+        try:
+            with open(candidate, encoding="utf-8") as f:
+                for line in f:
+                    if trace_id not in line: continue
+                    try: rec = json.loads(line)
+                    except ValueError: continue
+                    if rec.get("trace") == trace_id: spans.append(rec)
+        except OSError:
+            continue
+    return sorted(spans, key=lambda r: r["start"])
+
+
+def breakdown(spans, max_depth=2):
+    """Zeilen (Einrückung + Name, Sekunden, Anteil am Lauf) für die UI, in Baum-Reihenfolge."""
+    children = {}
+    for rec in spans: children.setdefault(rec.get("parent"), []).append(rec)
+    roots = children.get(None, [])
+    total = sum(r["dur"] for r in roots) or 1.0
+    rows = []
+
+    def walk(rec):
+        if rec["depth"] > max_depth: return
+        label = "  " * rec["depth"] + rec["name"] + (" ❌" if rec.get("status") == "error" else "")
+        rows.append({"Abschnitt": label, "Sekunden": round(rec["dur"], 3), "Anteil": f"{rec['dur'] / total:.0%}"})
+        for child in children.get(rec["span"], []): walk(child)
+
+    for root in roots: walk(root)
+    return rows
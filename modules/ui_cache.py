@@ -0,0 +1,140 @@
+import os
+import subprocess
+import threading
+import time
+
+AUDIO_EXTS = ('.mp3', '.wav', '.flac', '.aiff', '.m4a')
+SKIP_DIRS = ["Engine Library", "System Volume Information", "$RECYCLE.BIN"]
+# Innerhalb dieses Fensters beantwortet der Cache Widget-Reruns ganz ohne I/O
+QUIET_WINDOW = 2.0
+
+
+class FolderTreeCache:
+    """
+    Merkt sich Ordnerliste und Song-Zähler pro Verzeichnis.
+    Neu gelesen wird nur ein Verzeichnis, dessen mtime sich geändert hat.
+    """
+
+    def __init__(self, quiet_window=QUIET_WINDOW):
+        self.quiet_window = quiet_window
+        self._dirs = {}       # path -> (mtime_ns, n_audio, [subdirs])
+        self._folders = {}    # base -> (mtime_ns, options)
+        self._counts = {}     # folder -> (checked_at, count)
+        self._lock = threading.Lock()
+
+    def _scan_dir(self, path):
+        audio = []; subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    # Engine Library & Co. enthalten keine Musik, ändern sich aber bei jedem m.db-Write-Back
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in SKIP_DIRS: subdirs.append(entry.path)
+                    elif entry.name.lower().endswith(AUDIO_EXTS): audio.append(entry.name)
+                except OSError: pass
+        return len(audio), subdirs, hash(tuple(sorted(audio)))
+
+    def _dir_info(self, path):
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._dirs.get(path)
+        if cached and cached[0] == mtime: return cached
+        n_audio, subdirs, audio_sig = self._scan_dir(path)
+        info = (mtime, n_audio, subdirs, audio_sig)
+        self._dirs[path] = info
+        return info
+
+    def count_songs(self, folder):
+        """Rekursiver Song-Zähler; pro Verzeichnis nur ein stat(), solange sich nichts ändert."""
+        with self._lock:
+            hit = self._counts.get(folder)
+            if hit and time.monotonic() - hit[0] < self.quiet_window: return hit[1]
+            count = 0; stack = [folder]
+            while stack:
+                path = stack.pop()
+                try: _, n_audio, subdirs, _ = self._dir_info(path)
+                except OSError:
+                    self._dirs.pop(path, None)
+                    continue
+                count += n_audio
+                stack.extend(subdirs)
+            self._counts[folder] = (time.monotonic(), count)
+            return count
+
+    def signature(self, folder):
+        """
+        Fingerabdruck der Audio-Dateien im Baum (Verzeichnis, Namen) - ändert sich bei neuen/gelöschten/umbenannten
+        Tracks, nicht aber durch eigene Ausgaben (m.db in Engine Library, exportierte .txt/.pdf).
+        """
+        with self._lock:
+            parts = []; stack = [folder]
+            while stack:
+                path = stack.pop()
+                try: _, n_audio, subdirs, audio_sig = self._dir_info(path)
+                except OSError:
+                    self._dirs.pop(path, None)
+                    continue
+                parts.append((path, n_audio, audio_sig))
+                stack.extend(subdirs)
+            return hash(tuple(sorted(parts)))
+
+    def music_folders(self, base):
+        """Top-Level-Ordner des Sticks; neu gelesen nur bei geänderter mtime des Stick-Roots."""
+        with self._lock:
+            try: mtime = os.stat(base).st_mtime_ns
+            except OSError: return {}
+            cached = self._folders.get(base)
+            if cached and cached[0] == mtime: return cached[1]
+
+            options = {f"💾 Ganzer Stick ({base})": base}
+            try:
+                names = sorted(e.name for e in os.scandir(base) if e.is_dir(follow_symlinks=False))
+            except PermissionError:
+                # Fallback wie früher, falls der Mount-Punkt root gehört
+                res = subprocess.run(["sudo", "ls", "-F", base], capture_output=True, text=True)
+                names = [i[:-1] for i in res.stdout.splitlines() if i.endswith('/')] if res.returncode == 0 else []
+            for name in names:
+                if name in SKIP_DIRS: continue
+                options[f"📂 {name}"] = os.path.join(base, name)
+            self._folders[base] = (mtime, options)
+            return options
+
+    def invalidate(self):
+        with self._lock:
+            self._dirs.clear(); self._folders.clear(); self._counts.clear()
+
+
+class DbReadCache:
+    """
+    Cacht Lesezugriffe auf m.db. Gültig, solange Datei (inode, mtime, size) unverändert ist.
+    """
+
+    def __init__(self, db_path, quiet_window=QUIET_WINDOW):
+        self.db_path = db_path
+        self.quiet_window = quiet_window
+        self._entries = {}    # name -> (signature, value)
+        self._checked = {}    # name -> monotonic time
+        self._lock = threading.Lock()
+
+    def _signature(self):
+        # Nur stat(): Schreiber ersetzen m.db per Staging-rename, jede Änderung ändert Inode/mtime/Größe.
+        # Ein PRAGMA data_version bräuchte einen SHARED-Lock und würde hinter dem Schreiber warten.
+        try: st = os.stat(self.db_path)
+        except OSError: return None
+        return st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size
+
+    def get(self, name, loader):
+        """Liefert loader() aus dem Cache oder lädt neu, wenn sich m.db geändert hat."""
+        with self._lock:
+            entry = self._entries.get(name)
+            now = time.monotonic()
+            if entry and now - self._checked.get(name, 0) < self.quiet_window: return entry[1]
+            sig = self._signature()
+            self._checked[name] = now
+            if entry and sig is not None and entry[0] == sig: return entry[1]
+            value = loader()
+            self._entries[name] = (sig, value)
+            return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear(); self._checked.clear()
@@ -0,0 +1,255 @@
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import time
+
+from modules.smart_usb_mount import SmartUSBMount
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILE_FILE = os.path.join(REPO_DIR, "usb_profiles.json")
+AUDIO_EXTS = ('.mp3', '.wav', '.flac', '.aiff', '.m4a')
+
+# Budget einer Messung: wenige Sekunden auch auf langsamen USB-2.0-Sticks
+SEQ_BYTES = 32 * 1024 * 1024
+SEQ_BLOCK = 1024 * 1024
+RANDOM_READS = 200
+RANDOM_BLOCK = 4096
+SQLITE_COMMITS = 10
+
+# Grobe Kosten der Analyse pro Track (librosa/aubio) für die Tuning-Rechnung
+AVG_TRACK_MB = 8.0
+ANALYSIS_SEC_PER_TRACK = 4.0
+
+
+def mount_for(path, mountinfo_path="/proc/self/mountinfo"):
+    """(mount_point, device, 'maj:min') des Dateisystems, auf dem path liegt (längster Präfix)."""
+    target = os.path.realpath(path)
+    best = None
+    try:
+        with open(mountinfo_path) as f:
+            for line in f:
+                left, _, right = line.partition(" - ")
+                fields = left.split()
+                if len(fields) < 6: continue
+                mnt = fields[4].replace("\\040", " ")
+                if target != mnt and not target.startswith(os.path.join(mnt, "")): continue
+                if best is None or len(mnt) >= len(best[0]):
+                    best = (mnt, (right.split() + ["", ""])[1], fields[2])
+    except OSError:
+        return None
+    return best
+
+
+def device_key(device, sysfs_root="/sys", by_uuid="/dev/disk/by-uuid"):
+    """Stabiler Schlüssel pro Stick: Dateisystem-UUID, sonst Modell/Größe aus sysfs, sonst Gerätename."""
+    if not device: return "unknown"
+    real = os.path.realpath(device)
+    try:
+        for uuid in os.listdir(by_uuid):
+            if os.path.realpath(os.path.join(by_uuid, uuid)) == real: return f"uuid:{uuid}"
+    except OSError:
+        pass
+    name = os.path.basename(real)
+    disk_dir = os.path.realpath(os.path.join(sysfs_root, "class", "block", name))
+    if os.path.exists(os.path.join(disk_dir, "partition")): disk_dir = os.path.dirname(disk_dir)
+    parts = []
+    for rel in ("device/vendor", "device/model", "size"):
+        try:
+            with open(os.path.join(disk_dir, rel)) as f: parts.append(f.read().strip())
+        except OSError:
+            pass
+    return "|".join(p for p in parts if p) or name
+
+
+def _sample_files(folder, limit=50):
+    found = []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [d for d in dirs if not d.startswith((".", "Engine Library", "System Volume Information"))]
+        found.extend(os.path.join(root, f) for f in files if f.lower().endswith(AUDIO_EXTS))
+        if len(found) >= limit: break
+    return found[:limit]
+
+
+def _drop_cache(fd):
+    # Saubere Seiten verwerfen, damit wir den Stick messen und nicht den Page-Cache
+    try: os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except (AttributeError, OSError): pass
+
+
+def measure_sequential(files, budget=SEQ_BYTES, block=SEQ_BLOCK):
+    """Sequenzielles Lesen über die Beispieldateien; liefert MB/s."""
+    total = 0; t0 = time.monotonic()
+    for path in files:
+        if total >= budget: break
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            _drop_cache(fd)
+            while total < budget:
+                chunk = os.read(fd, block)
+                if not chunk: break
+                total += len(chunk)
+        finally:
+            os.close(fd)
+    elapsed = max(time.monotonic() - t0, 1e-6)
+    return round(total / elapsed / 1e6, 2) if total else None
+
+
+def measure_random(files, reads=RANDOM_READS, block=RANDOM_BLOCK, seed=0):
+    """4-KiB-Lesezugriffe an zufälligen Offsets; liefert (IOPS, MB/s)."""
+    rng = random.Random(seed)
+    handles = []
+    for path in files:
+        size = os.path.getsize(path)
+        if size <= block: continue
+        fd = os.open(path, os.O_RDONLY)
+        _drop_cache(fd)
+        handles.append((fd, size))
+    if not handles: return None, None
+    try:
+        t0 = time.monotonic()
+        for _ in range(reads):
+            fd, size = rng.choice(handles)
+            os.pread(fd, block, rng.randrange(0, size - block) & ~(block - 1))
+        elapsed = max(time.monotonic() - t0, 1e-6)
+    finally:
+        for fd, _ in handles: os.close(fd)
+    return round(reads / elapsed, 1), round(reads * block / elapsed / 1e6, 2)
+
+
+def measure_sqlite_write(mount_point, commits=SQLITE_COMMITS):
+    """
+    Commit-Latenz (Median, ms) einer Wegwerf-DB im Rollback-Journal wie m.db.
+    Liegt im Stick-Root (keine Audio-Endung, wird nie gescannt) - nie im Musik-Ordner,
+    sonst ändert die Messung dessen mtime und der Scan-Cache hält ihn für geändert.
+    """
+    path = os.path.join(mount_point, ".aidj-probe.db")
+    try:
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=DELETE")
+        conn.execute("CREATE TABLE IF NOT EXISTS probe (id INTEGER PRIMARY KEY, payload BLOB)")
+        latencies = []
+        for i in range(commits):
+            t0 = time.monotonic()
+            conn.execute("INSERT INTO probe (payload) VALUES (?)", (os.urandom(4096),))
+            conn.commit()
+            latencies.append((time.monotonic() - t0) * 1000)
+        conn.close()
+        return round(statistics.median(latencies), 2)
+    except sqlite3.Error:
+        return None
+    finally:
+        for suffix in ("", "-journal"):
+            try: os.remove(path + suffix)
+            except OSError: pass
+
+
+def _cpu_workers(cpus):
+    # Ein Kern bleibt fürs UI frei
+    return max(1, cpus - 1 if cpus > 2 else cpus)
+
+
+def tune(profile, cpu_count=None):
+    """
+    Analyse-Prozesse und Read-Ahead aus den Messwerten ableiten.
+    Langsamer Stick: wenige Worker (sonst nur Seek-Thrashing) + großes Read-Ahead;
+    schneller Stick: CPU-gebunden, ein Kern bleibt fürs UI frei.
+    """
+    cpus = cpu_count or os.cpu_count() or 1
+    seq = profile.get("seq_read_mbps") or 0
+    iops = profile.get("random_iops") or 0
+    per_worker_mbps = AVG_TRACK_MB / ANALYSIS_SEC_PER_TRACK
+    feedable = int(seq / per_worker_mbps) if seq else 1
+    workers = max(1, min(_cpu_workers(cpus), feedable))
+    if iops and iops < 100: workers = min(workers, 2)
+    # ~100 ms sequenzieller Durchsatz pro Request, auf Zweierpotenz gerundet
+    readahead_kb = seq * 1024 * 0.1 / workers if seq else 512
+    readahead_kb = int(2 ** round(math.log2(max(128, min(4096, readahead_kb)))))
+    return {"workers": workers, "readahead_kb": readahead_kb}
+
+
+def load_profiles(path=PROFILE_FILE):
+    try:
+        with open(path) as f: return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_profile(key, profile, path=PROFILE_FILE):
+    profiles = load_profiles(path)
+    profiles[key] = profile
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f: json.dump(profiles, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def profile_device(folder, save=True, write_probe=False):
+    """
+    Misst den Stick unter folder und speichert das Ergebnis pro Gerät.
+    Der Schreibtest (write_probe) läuft nur auf ausdrücklichen Wunsch (CLI) - das Tuning braucht ihn nicht.
+    """
+    mount = mount_for(folder)
+    device = mount[1] if mount else None
+    files = _sample_files(folder)
+    seq = measure_sequential(files) if files else None
+    iops, rand_mbps = measure_random(files) if files else (None, None)
+    profile = {
+        "device": device,
+        "mount_point": mount[0] if mount else None,
+        "seq_read_mbps": seq,
+        "random_iops": iops,
+        "random_read_mbps": rand_mbps,
+        "sqlite_commit_ms": measure_sqlite_write(mount[0]) if write_probe and mount else None,
+        "measured_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    profile.update(tune(profile))
+    if save and device: save_profile(device_key(device), profile)
+    return profile
+
+
+def tuned_settings(folder, measure=True):
+    """Gespeichertes (oder frisch gemessenes) Tuning für den Stick unter folder."""
+    mount = mount_for(folder)
+    device = mount[1] if mount else None
+    if not device or not device.startswith("/dev/"):
+        # Kein Blockgerät (lokaler Ordner, tmpfs, Netzlaufwerk): nichts zu messen, unter "unknown" nichts teilen
+        return {"workers": _cpu_workers(os.cpu_count() or 1), "readahead_kb": None, "device": None}
+    profile = load_profiles().get(device_key(device))
+    if profile is None and measure: profile = profile_device(folder)
+    if profile is None: return {"workers": 1, "readahead_kb": None, "device": device}
+    # CPU-Zahl kann sich geändert haben (anderer Rechner, gleicher Stick). Gerät immer vom aktuellen Mount:
+    # das Profil hängt an der UUID, der Gerätename (sdb/sdc) kann sich seit der Messung geändert haben
+    return dict(tune(profile), device=device)
+
+
+def apply_readahead(device, readahead_kb, sysfs_root="/sys"):
+    """Read-Ahead der Platte setzen (sudo ohne Passwort-Prompt); True bei Erfolg."""
+    if not device or not readahead_kb: return False
+    name = os.path.basename(os.path.realpath(device))
+    disk_dir = os.path.realpath(os.path.join(sysfs_root, "class", "block", name))
+    if os.path.exists(os.path.join(disk_dir, "partition")): disk_dir = os.path.dirname(disk_dir)
+    knob = os.path.join(disk_dir, "queue", "read_ahead_kb")
+    try:
+        with open(knob) as f:
+            if int(f.read().strip()) == readahead_kb: return True
+    except (OSError, ValueError):
+        return False
+    res = subprocess.run(["sudo", "-n", "tee", knob], input=str(readahead_kb), text=True,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return res.returncode == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Misst Lese-/Schreibleistung des Sticks und leitet Scan-Tuning ab")
+    parser.add_argument("folder", nargs="?", default=SmartUSBMount().mount_point)
+    parser.add_argument("--no-save", action="store_true", help="Ergebnis nicht in usb_profiles.json speichern")
+    args = parser.parse_args()
+    print(json.dumps(profile_device(args.folder, save=not args.no_save, write_probe=True), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,11 @@ import os
 import subprocess
 import time
 import glob
+import sqlite3
+from modules.ui_cache import FolderTreeCache, DbReadCache
+from modules.engine_client import EngineClient
+from modules import db_access, multi_stick, progress, tracing
+from modules.progress import LogRing
 
 # --- CONFIG ---
 # Wir nutzen den "getarnten" V15 Motor (Dateiname ist v10, Inhalt ist v15)
@@ -11,6 +16,15 @@ SEARCH_BASE = "/mnt/denon"
 
 st.set_page_config(page_title="AI-DJ Studio V5 Pro", layout="wide", page_icon="🎛️")
 
+# Caches überleben Streamlit-Reruns; neu gelesen wird nur bei echter Änderung (mtime / data_version)
+@st.cache_resource
+def get_tree_cache():
+    return FolderTreeCache()
+
+@st.cache_resource
+def get_db_cache(db_path):
+    return DbReadCache(db_path)
+
 st.markdown("""
 <style>
     .header-box { background-color: #111; color: #eee; padding: 15px; border-left: 5px solid #dc3545; border-radius: 5px; font-family: monospace; margin-bottom: 20px;}
@@ -41,6 +55,7 @@ with st.sidebar:
         from modules.smart_usb_mount import SmartUSBMount
         mounter = SmartUSBMount() 
         success, msg = mounter.mount()
+        get_tree_cache().invalidate()
         
         if success:
             st.success(msg)
@@ -50,19 +65,9 @@ with st.sidebar:
             st.error(msg)
 # --- HELPER ---
 def get_music_folders():
-    options = {}
-    if os.path.exists(SEARCH_BASE):
-        options[f"💾 Ganzer Stick ({SEARCH_BASE})"] = SEARCH_BASE
-        try:
-            cmd = f"sudo ls -F {SEARCH_BASE}"
-            res = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-            if res.returncode == 0:
-                for item in res.stdout.splitlines():
-                    if item.endswith('/') and item not in ["Engine Library/", "System Volume Information/", "$RECYCLE.BIN/"]:
-                        clean = item[:-1]
-                        options[f"📂 {clean}"] = os.path.join(SEARCH_BASE, clean)
-        except: pass
-    return options
+    if not os.path.exists(SEARCH_BASE): return {}
+    try: return get_tree_cache().music_folders(SEARCH_BASE)
+    except: return {}
 
 #def count_songs(folder):
  #   try:
@@ -70,16 +75,9 @@ def get_music_folders():
    # except: return 0
 
 def count_songs(folder):
-    count = 0
-    try:
-        # Wühlt sich durch alle Unterordner und ignoriert Groß-/Kleinschreibung
-        for root, dirs, files in os.walk(folder):
-            for file in files:
-                if file.lower().endswith(('.mp3', '.wav', '.flac', '.aiff', '.m4a')):
-                    count += 1
-    except:
-        pass
-    return count
+    # Wühlt sich durch alle Unterordner (ignoriert Groß-/Kleinschreibung), aber nur durch geänderte
+    try: return get_tree_cache().count_songs(folder)
+    except: return 0
 
 
 # --- MAIN SELECTION ---
@@ -108,12 +106,47 @@ else:
     c_sys.markdown("System Status<br><h3 class='status-ok'>BEREIT 🚀</h3>", unsafe_allow_html=True)
 
 
+# --- MEHRERE STICKS ---
+# Orchestrator läuft als eigener Prozess weiter, die UI liest nur stick_status.json
+stick_status = multi_stick.load_status()
+stick_busy = multi_stick.is_running(stick_status)
+with st.expander("🧷 Alle Sticks", expanded=stick_busy):
+    c_all, c_refresh = st.columns([3, 1])
+    if c_all.button("🚀 Alle eingesteckten Sticks bearbeiten", disabled=stick_busy, use_container_width=True):
+        argv = ["--length", str(playlist_length), "--bpm-limit", str(bpm_limit), "--energy-weight", str(energy_weight)]
+        if force_rescan: argv.append("--force-analysis")
+        subprocess.Popen(["python3", "-u", "-m", "modules.multi_stick"] + argv, start_new_session=True,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(1)
+        st.rerun()
+    if c_refresh.button("🔄 Status", use_container_width=True): st.rerun()
+    if stick_status and stick_status.get("sticks"):
+        icons = {"queued": "⏳", "mounting": "🔌", "running": "⚙️", "done": "✅", "error": "❌"}
+        rows = []
+        for s in stick_status["sticks"]:
+            scan = f"{s['scan_done']}/{s['scan_total']}" if s.get("scan_total") else ""
+            rows.append({"Stick": s["device"], "Mount": s.get("mount_point"),
+                         "Status": f"{icons.get(s.get('state'), '')} {s.get('state')}",
+                         "Phase": s.get("phase_name") or "", "Scan": scan,
+                         "Set / Meldung": s.get("playlist") or s.get("message") or ""})
+        st.dataframe(rows, hide_index=True, use_container_width=True)
+    else:
+        st.caption("Noch kein Mehr-Stick-Lauf.")
+
 # --- 2. PLAYLIST MANAGEMENT (Mass-Delete) ---
 st.subheader("2. Playlist Management")
 from modules.playlist_manager import PlaylistManager
 pm = PlaylistManager(os.path.join(SEARCH_BASE, "Engine Library/Database2/m.db"))
+db_cache = get_db_cache(pm.db_path)
 
-all_playlists = pm.get_all_playlists()
+try:
+    all_playlists = db_cache.get("playlists", pm.get_all_playlists)
+except db_access.DatabaseLockedError as e:
+    all_playlists = None
+    st.warning(f"⏳ {e} - bitte gleich neu laden.")
+except sqlite3.DatabaseError as e:
+    all_playlists = None
+    st.error(f"m.db nicht lesbar: {e}")
 
 if all_playlists:
     st.write("Wähle Playlisten zum Löschen aus:")
@@ -126,71 +159,159 @@ if all_playlists:
     
     if to_delete:
         if st.button(f"🔥 {len(to_delete)} gewählte Listen permanent löschen", type="secondary"):
-            if pm.delete_multiple_playlists(to_delete):
-                st.success("Erfolgreich gelöscht und Datenbank-Kette repariert!")
-                time.sleep(1)
-                st.rerun()
+            try:
+                deleted = pm.delete_multiple_playlists(to_delete)
+            except db_access.DatabaseLockedError as e:
+                st.warning(f"⏳ {e} Nichts gelöscht - bitte erneut versuchen, wenn der Motor fertig ist.")
             else:
-                st.error("Fehler beim Löschen.")
-else:
+                if deleted:
+                    db_cache.invalidate()
+                    st.success("Erfolgreich gelöscht und Datenbank-Kette repariert!")
+                    time.sleep(1)
+                    st.rerun()
+                else:
+                    st.error(f"Fehler beim Löschen: {pm.last_error}")
+elif all_playlists is not None:
     st.info("Keine Playlisten in der Datenbank gefunden.")
 
 
 
 # --- START LOGIC ---
-if 'logs' not in st.session_state: st.session_state.logs = ""
+if 'logs' not in st.session_state: st.session_state.logs = LogRing()
 if 'result_txt' not in st.session_state: st.session_state.result_txt = None
+if 'trace_id' not in st.session_state: st.session_state.trace_id = None
+if 'engine_job' not in st.session_state:
+    # Neue Sitzung (z.B. Browser neu verbunden): EINMAL fragen, ob der Service noch einen Job abarbeitet
+    st.session_state.engine_job = EngineClient(timeout=0.5).active_job()
+
+class JobView:
+    """Rendert Events inkrementell: Fortschrittsbalken + Log-Ringpuffer, gedrosselt neu gezeichnet."""
+    REDRAW_SEC = 0.3
+
+    def __init__(self):
+        self.bar = st.progress(0.0, text="Warte auf Motor...")
+        self.log_box = st.empty()
+        self._drawn = 0.0
+
+    def on_event(self, ev):
+        kind = ev.get("event")
+        if kind == "phase":
+            st.write(f"👉 [PHASE {ev.get('phase')}] {ev.get('name')}")
+            self.bar.progress(min((ev.get("phase", 1) - 1) / 5.0, 1.0), text=f"Phase {ev.get('phase')}/5: {ev.get('name')}")
+        elif kind == "scan" and ev.get("total"):
+            eta = ev.get("eta_sec")
+            eta_txt = f" | ETA {int(eta // 60)}:{int(eta % 60):02d}" if eta is not None else ""
+            rate = ev.get("tracks_per_sec") or 0
+            self.bar.progress(min(ev["done"] / ev["total"], 1.0), text=f"Scan {ev['done']}/{ev['total']} | {rate:.2f} Tracks/s{eta_txt}")
+        elif kind == "result":
+            if ev.get("txt"): st.session_state.result_txt = ev["txt"]
+            if ev.get("trace_id"): st.session_state.trace_id = ev["trace_id"]
+            self.bar.progress(1.0, text="Fertig")
 
-c_start, c_umount = st.columns([3, 1])
+    def on_line(self, line):
+        ev = progress.parse(line)
+        if ev: return self.on_event(ev)
+        st.session_state.logs.append(line)
+        line_clean = line.strip()
+        if "Reparatur:" in line: st.warning(line_clean) 
+        if "Kette" in line: st.info(line_clean)
+        if "VERIFIKATION" in line: st.success(line_clean)
+        self.redraw()
+
+    def redraw(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._drawn < self.REDRAW_SEC: return
+        self._drawn = now
+        self.log_box.code(st.session_state.logs.text()[-6000:], language=None)
+
+def run_engine_job(kind, argv, job_id=None):
+    """Job über den warmen Engine-Service; Fallback: eigener Prozess wie bisher."""
+    with st.status("AI-DJ arbeitet...", expanded=True) as status:
+        view = JobView()
+        client = EngineClient()
+        if job_id is None and client.ensure_running():
+            job_id = client.submit(kind, argv)
+            if not job_id: st.warning(f"Engine-Service lehnt Job ab: {client.last_error}")
+        if job_id:
+            # Solange gesetzt, hängt sich jeder Rerun wieder an diesen Job (kein Polling ohne laufenden Job)
+            st.session_state.engine_job = {"id": job_id, "kind": kind}
+            try:
+                for line in client.follow(job_id): view.on_line(line)
+                returncode = client.final["returncode"]
+            except Exception as e:
+                st.warning(f"Verbindung zum Engine-Service verloren: {e}")
+                returncode = -1
+            st.session_state.engine_job = None
+        else:
+            cmd = ["python3", "-u", BACKEND_SCRIPT] + argv + (["--scan-only"] if kind == "scan" else [])
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1, universal_newlines=True)
+            for line in proc.stdout: view.on_line(line)
+            proc.wait()
+            returncode = proc.returncode
+        view.redraw(force=True)
+        # Engine hat m.db und evtl. den Stick verändert
+        get_db_cache(pm.db_path).invalidate()
+        get_tree_cache().invalidate()
+        
+        if returncode == 0:
+            status.update(label="✅ Export abgeschlossen!" if kind == "generate" else "✅ Scan abgeschlossen!", state="complete", expanded=False)
+            if st.session_state.result_txt:
+                st.success(f"Playlist gespeichert: {os.path.basename(st.session_state.result_txt)}")
+        else:
+            status.update(label="❌ Fehler aufgetreten!", state="error", expanded=True)
+
+c_start, c_scan, c_umount = st.columns([3, 1, 1])
 
 with c_start:
     if st.button("🚀 START AI-ENGINE V5", type="primary", use_container_width=True, disabled=not folder_path):
-        st.session_state.logs = ""
+        st.session_state.logs.clear()
         st.session_state.result_txt = None
         
-        cmd = ["python3", "-u", BACKEND_SCRIPT, folder_path, 
+        argv = [folder_path, 
                "--length", str(playlist_length), 
                "--bpm-limit", str(bpm_limit), 
                "--energy-weight", str(energy_weight)]
         
-        if force_rescan: cmd.append("--force-analysis")
-        
-        with st.status("AI-DJ arbeitet...", expanded=True) as status:
-            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1, universal_newlines=True)
-            
-            for line in proc.stdout:
-                line_clean = line.strip()
-                st.session_state.logs += line
-                
-                if "[PHASE" in line: st.write(f"👉 {line_clean}")
-                if "Reparatur:" in line: st.warning(line_clean) 
-                if "Kette" in line: st.info(line_clean)
-                if "VERIFIKATION" in line: st.success(line_clean)
-                
-                if "✅ FERTIG! Datei:" in line:
-                    parts = line.split("Datei:")
-                    if len(parts) > 1:
-                        st.session_state.result_txt = parts[1].strip()
-            
-            proc.wait()
-            
-            if proc.returncode == 0:
-                status.update(label="✅ Export abgeschlossen!", state="complete", expanded=False)
-                if st.session_state.result_txt:
-                    st.success(f"Playlist gespeichert: {os.path.basename(st.session_state.result_txt)}")
-            else:
-                status.update(label="❌ Fehler aufgetreten!", state="error", expanded=True)
+        if force_rescan: argv.append("--force-analysis")
+        run_engine_job("generate", argv)
+    elif st.session_state.engine_job:
+        # Rerun/Reconnect, während der Service noch arbeitet -> wieder einklinken (Art des Jobs aus dem Service)
+        job = st.session_state.engine_job
+        st.session_state.logs.clear()
+        run_engine_job(job.get("kind", "generate"), [], job_id=job["id"])
+
+with c_scan:
+    if st.button("🔎 Nur Scan", use_container_width=True, disabled=not folder_path):
+        st.session_state.logs.clear()
+        argv = [folder_path] + (["--force-analysis"] if force_rescan else [])
+        run_engine_job("scan", argv)
 
 with c_umount:
     if st.button("⏏️ EJECT", use_container_width=True):
-        st.info("Syncing & Unmounting...")
-        subprocess.run("sync", shell=True)
-        subprocess.run(["sudo", "umount", "-l", SEARCH_BASE])
-        st.success("Sicher entfernt!")
+        from modules.smart_usb_mount import SmartUSBMount
+        st.info("Flushing & Unmounting...")
+        # Eigene Verbindungen zu m.db freigeben, sonst ist der Mount "busy"
+        db_access.close_under(SEARCH_BASE)
+        written = [pm.db_path]
+        if st.session_state.result_txt:
+            written += [st.session_state.result_txt, st.session_state.result_txt.replace(".txt", ".pdf")]
+        ok, msg = SmartUSBMount(SEARCH_BASE).eject(written)
+        tracing.flush_metrics()
+        get_tree_cache().invalidate()
+        get_db_cache(pm.db_path).invalidate()
+        if ok: st.success(msg)
+        else: st.error(msg)
 
 # --- OUTPUT AREA ---
 st.write("Live Log:")
-st.text_area("System Log", value=st.session_state.logs, height=200, label_visibility="collapsed")
+st.text_area("System Log", value=st.session_state.logs.text(), height=200, label_visibility="collapsed")
+
+# Zeitaufteilung des letzten Laufs (Spans aus traces.jsonl)
+if st.session_state.trace_id:
+    rows = tracing.breakdown(tracing.load_trace(st.session_state.trace_id))
+    if rows:
+        with st.expander(f"⏱️ Timing (Trace {st.session_state.trace_id})"):
+            st.dataframe(rows, hide_index=True, use_container_width=True)
 
 if st.session_state.result_txt:
     txt_path = st.session_state.result_txt
@@ -0,0 +1,40 @@
+import os
+import sqlite3
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main_workflow_v10 as workflow
+from modules import db_access, tracing
+from modules.schema_manager import LIBRARY_SCHEMA_VERSION, get_versions
+
+# songs/Smartlist wie im alten init_db (vor schema_manager, user_version 0)
+BASELINE_DDL = [
+    "CREATE TABLE songs (id INTEGER PRIMARY KEY, relative_path TEXT NOT NULL UNIQUE, filename TEXT NOT NULL, bpm REAL, key_full TEXT, camelot_key TEXT, energy_avg REAL, energy_norm INTEGER, lufs REAL, duration REAL, mix_out_point REAL, rhythm_quality TEXT, first_downbeat REAL, bars_count INTEGER)",
+    "CREATE TABLE Smartlist (listUuid TEXT NOT NULL, title TEXT, parentPlaylistPath TEXT, nextPlaylistPath TEXT, nextListUuid TEXT, rules TEXT, lastEditTime DATETIME, PRIMARY KEY(listUuid))",
+]
+
+
+def test_scan_phase_migrates_baseline_library_without_new_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_FILE", str(tmp_path / "traces.jsonl"))
+    music = tmp_path / "music"
+    music.mkdir()
+    out_dir = tmp_path / "music_ergebnisse"
+    out_dir.mkdir()
+    db_path = str(out_dir / "music_library_v3_final.db")
+    conn = sqlite3.connect(db_path)
+    for stmt in BASELINE_DDL: conn.execute(stmt)
+    conn.execute("INSERT INTO songs (relative_path, filename, bpm, energy_avg) VALUES ('a.mp3', 'a.mp3', 124.0, 0.5)")
+    conn.commit()
+    conn.close()
+
+    try:
+        # Keine neuen Dateien -> kein perform_scan; trotzdem muss migriert werden
+        workflow.run_scan_phase(str(music), output_dir=str(out_dir))
+        conn = db_access.connect(db_path)
+        assert get_versions(conn)[0] == LIBRARY_SCHEMA_VERSION
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert {"smartlist_meta", "sets", "fingerprint_lsh"} <= tables
+        assert "beat_data" in db_access.table_columns(db_path, "songs")
+    finally:
+        db_access.close(db_path)